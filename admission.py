@@ -0,0 +1,161 @@
+"""
+========================================
+🚦 Admission control for detection endpoints
+========================================
+
+Each worker tracks how many detection requests are running and waiting.
+When both the running slots and the wait queue are full, requests are
+rejected at once with 503 and a Retry-After estimate instead of queueing
+behind slow OCR calls. Auto-mode frames (periodic captures) get a shorter
+queue and yield to waiting manual captures.
+"""
+
+import os
+import math
+import time
+import threading
+
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', '4'))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', '8'))
+ADMISSION_LOW_PRIORITY_QUEUE = int(os.environ.get('ADMISSION_LOW_PRIORITY_QUEUE', '2'))
+ADMISSION_MAX_WAIT = float(os.environ.get('ADMISSION_MAX_WAIT', '5'))  # วินาที
+# thread ของ gunicorn ที่เผื่อไว้สำหรับ endpoint อื่น (dashboard, /metrics, /api/ready) เมื่อคิวตรวจจับเต็ม
+ADMISSION_SPARE_THREADS = int(os.environ.get('ADMISSION_SPARE_THREADS', '4'))
+
+PRIORITY_HIGH = 'high'
+PRIORITY_LOW = 'low'
+
+
+def required_threads(max_in_flight=ADMISSION_MAX_IN_FLIGHT, max_queue=ADMISSION_MAX_QUEUE,
+                     spare=ADMISSION_SPARE_THREADS):
+    """
+    gthread threads per worker needed for admission control to work
+
+    A worker never runs more requests than it has threads, so with
+    threads <= max_in_flight the wait queue never forms and nothing is
+    ever shed. One more thread than running + queued requests lets the
+    next request be answered with 503 instead of waiting in gunicorn's
+    accept backlog, and the spare threads keep other endpoints responsive.
+    """
+    return max_in_flight + max_queue + spare
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is over capacity"""
+
+    def __init__(self, retry_after, reason):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight=ADMISSION_MAX_IN_FLIGHT, max_queue=ADMISSION_MAX_QUEUE,
+                 low_priority_queue=ADMISSION_LOW_PRIORITY_QUEUE, max_wait=ADMISSION_MAX_WAIT):
+        """
+        Args:
+            max_in_flight: Requests allowed to run at once in this worker
+            max_queue: Requests allowed to wait for a slot
+            low_priority_queue: Wait queue limit for low priority (auto mode)
+            max_wait: Longest time a request may wait for a slot (seconds)
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.low_priority_queue = low_priority_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self.waiting_high = 0
+        self.ewma_service_time = 1.0  # วินาที ค่าเริ่มต้นประมาณเวลา YOLO + OCR
+        self.admitted = 0
+        self.rejected = {PRIORITY_HIGH: 0, PRIORITY_LOW: 0}
+        self._cond = threading.Condition()
+
+    def _retry_after(self):
+        """ประมาณเวลาที่ควรรอก่อนส่งใหม่ (วินาทีเต็ม ตาม HTTP Retry-After)"""
+        backlog = (self.in_flight + self.waiting) / max(1, self.max_in_flight)
+        return max(1, int(math.ceil(backlog * self.ewma_service_time)))
+
+    def _reject(self, priority, reason):
+        self.rejected[priority] += 1
+        raise AdmissionRejected(self._retry_after(), reason)
+
+    def acquire(self, priority=PRIORITY_HIGH, max_wait=None):
+        """
+        Take a slot or raise AdmissionRejected
+
+        Args:
+            priority: PRIORITY_HIGH (manual) or PRIORITY_LOW (auto mode)
+            max_wait: Upper bound on waiting (e.g. the request deadline)
+
+        Returns:
+            float: Monotonic start time, pass it back to release()
+        """
+        low = priority == PRIORITY_LOW
+        max_wait = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+
+        with self._cond:
+            queue_limit = self.low_priority_queue if low else self.max_queue
+            if self.in_flight >= self.max_in_flight and self.waiting >= queue_limit:
+                self._reject(priority, 'queue full')
+
+            # รอนานกว่าที่ client รอได้ก็ไม่มีประโยชน์ ปฏิเสธทันที
+            expected_wait = (self.waiting + 1) / max(1, self.max_in_flight) * self.ewma_service_time
+            if self.in_flight >= self.max_in_flight and expected_wait > max_wait:
+                self._reject(priority, 'expected wait exceeds budget')
+
+            self.waiting += 1
+            if not low:
+                self.waiting_high += 1
+            give_up_at = time.monotonic() + max_wait
+            try:
+                # low priority ต้องรอให้ manual capture ที่รออยู่ได้ slot ก่อน
+                while self.in_flight >= self.max_in_flight or (low and self.waiting_high > 0):
+                    remaining = give_up_at - time.monotonic()
+                    if remaining <= 0:
+                        self._reject(priority, 'timed out waiting for a slot')
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+                if not low:
+                    self.waiting_high -= 1
+
+            self.in_flight += 1
+            self.admitted += 1
+            return time.monotonic()
+
+    def release(self, started_at):
+        """
+        Free a slot and update the service time estimate
+
+        Args:
+            started_at: Value returned by acquire()
+        """
+        elapsed = time.monotonic() - started_at
+        with self._cond:
+            self.in_flight -= 1
+            self.ewma_service_time = 0.8 * self.ewma_service_time + 0.2 * elapsed
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Current load of this worker
+
+        Returns:
+            dict: In-flight, queue depth, service time and rejection counts
+        """
+        with self._cond:
+            return {
+                'pid': os.getpid(),
+                'in_flight': self.in_flight,
+                'queue_depth': self.waiting,
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'ewma_service_time': round(self.ewma_service_time, 3),
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected)
+            }
+
+
+# Global admission controller (หนึ่งตัวต่อ worker process)
+admission_controller = AdmissionController()
@@ -1,32 +1,346 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-import requests
+# import ก่อน module อื่นเพื่อจับเวลา import ของทุก module (startup profile)
+from startup_profile import startup_profile
+from flask import Flask, Request, Response, g, render_template, request, jsonify, redirect, url_for, send_file
 import os
 import json
-from datetime import datetime
+import math
+import threading
+import time
+import uuid
+import logging
+import functools
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
 from werkzeug.utils import secure_filename
-import cv2
-import numpy as np
-from ultralytics import YOLO
+from model_manager import model_manager
+from camera_config import camera_settings
+from image_io import DecodedImage, decode_image
+from crop_quality import score_crop
+from crop_encoding import encode_crop
+from log_config import setup_logging, log_payload
+import metrics
+from metrics import stage_timer
+from deadline import DEADLINE_HEADER, Deadline, DeadlineExceeded
+from admission import PRIORITY_HIGH, PRIORITY_LOW, AdmissionRejected, admission_controller
+from source_scheduler import SCHEDULER_MAX_WAIT, SUPERSEDED, THROTTLED, FrameRejected, frame_scheduler
+from batch_jobs import batch_manager
+from watchlist import watchlist
+from detection_archive import DICT_COLUMNS as ARCHIVE_GROUP_COLUMNS, detection_archive
+from detection_rollups import SPLIT_DIMENSIONS, TIMESERIES_MAX_POINTS, detection_rollups
+from upload_store import IDEMPOTENCY_HEADER, IdempotencyConflict, content_hash, upload_store
+from response_cache import response_cache
+from cpu_budget import cpu_budget
+from ocr_backends import API_URL, OCR_BACKEND_HEADER, OcrImage, ocr_chain
+from thumbnails import MIME_TYPES as THUMBNAIL_MIME_TYPES, THUMBNAIL_MAX_AGE, THUMBNAIL_SIZES, thumbnail_service
 from firebase_config import firebase_manager, save_detection, get_recent_detections, get_stats
 
+setup_logging()
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_CONTENT_LENGTH = int(os.environ.get('BATCH_MAX_CONTENT_LENGTH', str(512 * 1024 * 1024)))
+
+class LPRRequest(Request):
+    """Batch upload รับไฟล์ได้ใหญ่กว่า endpoint อื่น (zip หลายร้อยภาพ)"""
+    @property
+    def max_content_length(self):
+        if self.path.startswith('/api/batch'):
+            return BATCH_MAX_CONTENT_LENGTH
+        return super().max_content_length
+
 app = Flask(__name__)
+app.request_class = LPRRequest
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 # Load YOLO model
-MODEL_PATH = 'best.pt'  # หรือ 'models/best.pt' ถ้าอยู่ในโฟลเดอร์ models
-try:
-    yolo_model = YOLO(MODEL_PATH)
-    print(f"✅ YOLO model loaded: {MODEL_PATH}")
-except Exception as e:
-    print(f"❌ Failed to load YOLO model: {e}")
-    yolo_model = None
+# background: แต่ละ worker โหลดใน background thread หลัง fork ทำให้ / และ health check ตอบได้ทันที
+#             (request ตรวจจับที่มาก่อนโหลดเสร็จจะรอจนโหลดเสร็จ)
+# preload:    โหลดใน master ครั้งเดียวก่อน fork ทุก worker ใช้ weights ร่วมกันแบบ copy-on-write
+#             แต่ worker จะเริ่มรับ request ได้หลังโหลดและ warm-up เสร็จเท่านั้น
+# ค่าเริ่มต้นเมื่อรันตรงๆ คือ background; gunicorn.conf.py ตั้ง preload (ยกเว้น INFERENCE_SERVER=1)
+MODEL_LOAD_MODE = os.environ.get('MODEL_LOAD_MODE', 'background')
+
+def _apply_cpu_budget():
+    """แบ่ง thread ของ torch / OpenCV ตาม CPU budget และจำนวนเฟรมที่รันพร้อมกันต่อ worker"""
+    budget = cpu_budget.apply()
+    if 'SCHEDULER_CONCURRENCY' not in os.environ:
+        frame_scheduler.concurrency = budget['frames_in_flight']
+
+def _init_model(fork_safe=False):
+    with startup_profile.stage('model'):
+        model_manager.preload(fork_safe=fork_safe)
+    # torch / cv2 ถูก import ตอนโหลดโมเดล ตั้งจำนวน thread อีกครั้งหลังโหลด
+    _apply_cpu_budget()
+    if model_manager.is_ready():
+        startup_profile.mark('model_ready')
+        logger.info("✅ YOLO model ready", extra={'model_path': model_manager.model_path,
+                                                 'warmup_latency_ms': model_manager.warmup_latency_ms})
+    else:
+        logger.error("❌ Failed to load YOLO model", extra={'error': model_manager.error})
+
+def _init_firebase():
+    with startup_profile.stage('firebase'):
+        firebase_manager.connect()
+    startup_profile.mark('firebase_connected')
+
+def start_background_init():
+    """
+    Connect Firebase (and load the model unless preloaded) in background threads
+    
+    Runs at import when the app is started directly; under gunicorn it is
+    called from post_fork in each worker, because threads do not survive
+    fork() and one still importing torch in the master could leave a lock
+    held in the children.
+    """
+    startup_profile.mark('worker_started')
+    _apply_cpu_budget()
+    tasks = [_init_firebase] if MODEL_LOAD_MODE == 'preload' else [_init_model, _init_firebase]
+    for task in tasks:
+        threading.Thread(target=task, name=f"startup{task.__name__}", daemon=True).start()
+
+if MODEL_LOAD_MODE == 'preload':
+    _init_model(fork_safe=os.environ.get('LPR_PRELOAD_FORK_SAFE') == '1')
+
+# endpoint ที่วัด latency ทั้ง request
+TIMED_ENDPOINTS = {'upload_file', 'api_detect', 'api_detect_yolo'}
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+
+@app.after_request
+def record_request_latency(response):
+    if request.endpoint in TIMED_ENDPOINTS and 'request_start' in g:
+        metrics.REQUEST_LATENCY.labels(request.endpoint).observe(time.perf_counter() - g.request_start)
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    startup_profile.mark('first_response')
+    return response
+
+# header ที่ client บอกโหมดการตรวจจับ (auto = จับภาพเป็นระยะ, manual = ผู้ใช้กดเอง)
+DETECTION_MODE_HEADER = 'X-Detection-Mode'
+
+def admission_controlled(default_priority):
+    """
+    Shed load with 503 + Retry-After when this worker is over capacity
+
+    Auto-mode frames get lower priority than manual captures; a dropped
+    auto frame is replaced by the next one anyway.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            mode = request.headers.get(DETECTION_MODE_HEADER, '').lower()
+            if mode == 'auto':
+                priority = PRIORITY_LOW
+            elif mode == 'manual':
+                priority = PRIORITY_HIGH
+            else:
+                priority = default_priority
+
+            # ไม่รอ slot นานกว่าที่ client รอได้ (อ่านจาก header เท่านั้น ไม่ parse form ก่อน admit)
+            max_wait = None
+            try:
+                if request.headers.get(DEADLINE_HEADER):
+                    max_wait = float(request.headers[DEADLINE_HEADER]) / 1000.0
+            except ValueError:
+                pass
+
+            try:
+                started_at = admission_controller.acquire(priority, max_wait)
+            except AdmissionRejected as e:
+                metrics.record_admission_rejected(priority)
+                logger.warning("🚦 Request shed", extra={'priority': priority, 'reason': e.reason,
+                                                        'retry_after': e.retry_after})
+                response = jsonify({
+                    'success': False,
+                    'overloaded': True,
+                    'error': 'ระบบกำลังประมวลผลเต็มกำลัง กรุณาลองใหม่อีกครั้ง',
+                    'retry_after': e.retry_after
+                })
+                response.status_code = 503
+                response.headers['Retry-After'] = str(e.retry_after)
+                return response
+            try:
+                return view(*args, **kwargs)
+            finally:
+                admission_controller.release(started_at)
+        return wrapper
+    return decorator
+
+def frame_rejected_response(error, source):
+    """
+    Response for a frame the fair scheduler did not run
+
+    superseded -> 200 (a newer frame from the same source is being processed),
+    throttled -> 429 and timed_out -> 503, both with Retry-After
+    """
+    metrics.record_scheduler_rejected(error.reason)
+    logger.info("⚖️ Frame not scheduled", extra={'source': source, 'reason': error.reason,
+                                                'retry_after': error.retry_after})
+    if error.reason == SUPERSEDED:
+        return jsonify({'success': False, 'superseded': True, 'source': source})
+    
+    retry_after = max(1, math.ceil(error.retry_after or 1))
+    response = jsonify({
+        'success': False,
+        'overloaded': True,
+        'reason': error.reason,
+        'error': 'ส่งภาพถี่เกินกำหนดของกล้องนี้' if error.reason == THROTTLED
+                 else 'ระบบกำลังประมวลผลเต็มกำลัง กรุณาลองใหม่อีกครั้ง',
+        'retry_after': retry_after
+    })
+    response.status_code = 429 if error.reason == THROTTLED else 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def idempotent(view):
+    """
+    Replay the stored response for a repeated Idempotency-Key
+
+    Runs before admission control so a client retry never costs a slot.
+    Only completed responses are stored; 5xx and 429 responses (load
+    shedding, frame-rate cap) release the key so the client can retry.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+
+        scope = request.endpoint
+        try:
+            stored = upload_store.begin_idempotent(scope, key)
+        except IdempotencyConflict:
+            response = jsonify({
+                'success': False,
+                'error': 'คำขอเดียวกันกำลังประมวลผลอยู่ กรุณารอสักครู่'
+            })
+            response.status_code = 409
+            response.headers['Retry-After'] = '1'
+            return response
+        if stored is not None:
+            response = jsonify(stored['body'])
+            response.status_code = stored['status']
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            upload_store.abandon_idempotent(scope, key)
+            raise
+        if response.status_code < 500 and response.status_code != 429 and response.is_json:
+            upload_store.finish_idempotent(scope, key, response.status_code, response.get_json())
+        else:
+            upload_store.abandon_idempotent(scope, key)
+        return response
+    return wrapper
+
+def cached_response(view):
+    """
+    Serve a JSON read endpoint from the response cache
+
+    Keyed by endpoint and query string. Responses carry a strong ETag
+    (a matching If-None-Match gets 304 without a body) and are sent
+    gzip-compressed to clients that accept it. Error responses
+    (``success: false`` or non-200) are never reused.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not response_cache.enabled:
+            return view(*args, **kwargs)
+        
+        key = f"{request.endpoint}?{urlencode(sorted(request.args.items(multi=True)))}"
+        
+        def build():
+            response = app.make_response(view(*args, **kwargs))
+            body = response.get_json(silent=True) if response.is_json else None
+            cacheable = (response.status_code == 200 and isinstance(body, dict)
+                         and body.get('success', True) is not False)
+            return response.get_data(), response.status_code, response.mimetype, cacheable
+        
+        entry, hit = response_cache.get_or_build(key, build)
+        body, etag, encoding = entry.representation(request.accept_encodings['gzip'] > 0)
+        if request.if_none_match.contains(etag):
+            metrics.record_response_cache(request.endpoint, 'not_modified')
+            response = Response(status=304)
+        else:
+            metrics.record_response_cache(request.endpoint, 'hit' if hit else 'miss')
+            response = Response(body, status=entry.status, mimetype=entry.mimetype)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        # browser ต้องถามใหม่ทุกครั้ง (ได้ 304 ถ้ายังไม่เปลี่ยน)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+    return wrapper
+
+# raw body ของเฟรม (ไม่ต้อง parse multipart) พารามิเตอร์มาจาก header หรือ query string
+RAW_IMAGE_MIMETYPES = {'image/jpeg', 'image/png', 'image/webp', 'application/octet-stream'}
+CONFIDENCE_HEADER = 'X-Confidence'
+SOURCE_HEADER = 'X-Source'
+INVALID_CONFIDENCE_ERROR = 'confidence ต้องเป็นตัวเลขระหว่าง 0 ถึง 1'
+
+def parse_confidence(value, default):
+    """แปลง confidence จาก header / query / form เป็น float (None ถ้าไม่ใช่ตัวเลขระหว่าง 0 ถึง 1)"""
+    if value is None or value == '':
+        return default
+    try:
+        confidence = float(value)
+    except ValueError:
+        return None
+    # nan / inf ไม่ผ่านเงื่อนไขนี้
+    return confidence if 0.0 <= confidence <= 1.0 else None
+
+def read_frame(default_confidence):
+    """
+    อ่านภาพและพารามิเตอร์จาก request ของ detect endpoints
+    
+    รองรับทั้ง raw body (Content-Type: image/jpeg, confidence/source ใน header หรือ query string)
+    และ multipart form เดิม (field file, confidence, source)
+    
+    Returns:
+        tuple: (image_bytes, confidence, source, error) โดย error เป็น None เมื่ออ่านสำเร็จ
+               และ confidence เป็น float ที่ตรวจแล้ว
+    """
+    if request.mimetype in RAW_IMAGE_MIMETYPES:
+        confidence = parse_confidence(request.headers.get(CONFIDENCE_HEADER) or request.args.get('confidence'),
+                                      default_confidence)
+        source = request.headers.get(SOURCE_HEADER) or request.args.get('source', 'unknown')
+        if confidence is None:
+            return None, default_confidence, source, INVALID_CONFIDENCE_ERROR
+        image_bytes = request.get_data()
+        if not image_bytes:
+            return None, confidence, source, 'ไม่มีไฟล์ถูกส่งมา'
+        return image_bytes, confidence, source, None
+    
+    confidence = parse_confidence(request.values.get('confidence'), default_confidence)
+    source = request.values.get('source', 'unknown')
+    if confidence is None:
+        return None, default_confidence, source, INVALID_CONFIDENCE_ERROR
+    if 'file' not in request.files:
+        return None, confidence, source, 'ไม่มีไฟล์ถูกส่งมา'
+    file = request.files['file']
+    if file.filename == '':
+        return None, confidence, source, 'ไม่มีไฟล์ถูกเลือก'
+    return file.read(), confidence, source, None
+
+def cached_result(result, **fields):
+    """สำเนาของผลลัพธ์จาก cache พร้อมข้อมูลของ request ปัจจุบัน"""
+    result = dict(result)
+    result.update(fields)
+    result['cached'] = True
+    return result
 
 # เพิ่ม CORS headers manually
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,X-Request-Deadline-Ms,X-Detection-Mode,Idempotency-Key,X-OCR-Backend')
+    response.headers.add('Access-Control-Expose-Headers', 'Retry-After,X-Request-ID,Idempotent-Replayed')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
 
@@ -34,203 +348,385 @@ def after_request(response):
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
-# ตั้งค่า API
-API_URL = "https://api.aiforthai.in.th/lpr-iapp"
-API_KEY = "GgY2UsQsZRrZxeWKSilQ8uKZGAFLiagW"
+# timeout สูงสุดของ OCR (จะถูกลดลงตามเวลาที่เหลือของ request)
+# ค่า API / backend / fallback chain อยู่ใน ocr_backends.py
+OCR_TIMEOUT = 20
+
+def int_arg(name, default, minimum=0, maximum=None):
+    """
+    อ่าน query parameter ที่เป็นจำนวนเต็ม (ค่าที่เกิน maximum ถูกปรับลง)
 
-# Mock API สำหรับการทดสอบ (เปลี่ยนเป็น True เพื่อใช้ mock)
-USE_MOCK_API = False  # เปลี่ยนเป็น False เพื่อใช้ API จริง
-MOCK_API_URL = "http://127.0.0.1:5001/mock-lpr"
+    Raises:
+        ValueError: ไม่ใช่จำนวนเต็มหรือน้อยกว่า minimum (endpoint ตอบ 400)
+    """
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name} ต้องเป็นจำนวนเต็ม")
+    if number < minimum:
+        raise ValueError(f"{name} ต้องไม่น้อยกว่า {minimum}")
+    return min(number, maximum) if maximum is not None else number
 
 def allowed_file(filename):
     """ตรวจสอบไฟล์ที่อนุญาต"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
 
-def detect_license_plate_yolo(image_path, confidence_threshold=0.7):
-    """ตรวจจับป้ายทะเบียนด้วย YOLO model"""
-    if yolo_model is None:
+def detect_license_plate_yolo(image, confidence_threshold=0.7, source=None, deadline=None):
+    """
+    ตรวจจับป้ายทะเบียนด้วย YOLO model (เฉพาะ ROI และ imgsz ตามการตั้งค่าของกล้อง)
+    
+    image เป็น path, numpy array หรือ DecodedImage ก็ได้ bbox ที่ได้เป็นพิกัดของภาพต้นฉบับเสมอ
+    deadline จำกัดเวลารอ inference server (DeadlineExceeded ถูกส่งต่อให้ผู้เรียก)
+    """
+    engine = model_manager.get_engine()
+    if engine is None:
         return None
     
     try:
         # อ่านภาพ
-        image = cv2.imread(image_path)
+        decoded = image if isinstance(image, DecodedImage) else None
+        if decoded is not None:
+            image = decoded.image
+        elif isinstance(image, str):
+            import cv2
+            image = cv2.imread(image)
         if image is None:
             return None
             
-        # Run YOLO detection
-        results = yolo_model(image)
-        
-        # Extract detections
-        detections = []
-        for result in results:
-            boxes = result.boxes
-            if boxes is not None:
-                for box in boxes:
-                    # Get confidence score
-                    conf = float(box.conf[0])
-                    
-                    # Filter by confidence threshold
-                    if conf >= confidence_threshold:
-                        # Get bounding box coordinates
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        
-                        detection = {
-                            'bbox': [int(x1), int(y1), int(x2), int(y2)],
-                            'confidence': conf,
-                            'class': int(box.cls[0]),
-                            'width': int(x2 - x1),
-                            'height': int(y2 - y1)
-                        }
-                        detections.append(detection)
-        
-        print(f"🎯 YOLO detected {len(detections)} license plates with conf > {confidence_threshold}")
+        # ตัดเฉพาะ ROI ของกล้อง (ถ้ามี) เพื่อลดขนาดภาพที่ต้อง inference
+        settings = camera_settings.get(source)
+        roi = camera_settings.resolve_roi(source, image.shape)
+        region = image[roi[1]:roi[3], roi[0]:roi[2]] if roi else image
+        
+        # Run detection (pytorch หรือ onnx ตาม DETECTION_ENGINE)
+        with stage_timer('yolo'):
+            detections = engine.predict(region, confidence_threshold, imgsz=settings.get('imgsz'),
+                                        deadline=deadline)
+        
+        # แปลงพิกัดใน ROI กลับเป็นพิกัดของภาพเต็ม (และภาพต้นฉบับถ้า decode แบบย่อ)
+        frame_shape = decoded.original_shape if decoded is not None else image.shape
+        for detection in detections:
+            if roi:
+                x1, y1, x2, y2 = detection['bbox']
+                detection['bbox'] = [x1 + roi[0], y1 + roi[1], x2 + roi[0], y2 + roi[1]]
+            if decoded is not None and decoded.scale != 1.0:
+                detection['bbox'] = decoded.to_original(detection['bbox'])
+                detection['width'] = detection['bbox'][2] - detection['bbox'][0]
+                detection['height'] = detection['bbox'][3] - detection['bbox'][1]
+            camera_settings.record_detection(source, detection['bbox'], frame_shape)
+        
+        logger.debug("🎯 YOLO detections", extra={'count': len(detections), 'conf_threshold': confidence_threshold})
         return detections
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        print(f"❌ YOLO detection error: {e}")
+        logger.exception("❌ YOLO detection error")
         return None
 
-def crop_license_plate(image_path, bbox):
-    """ครอบตัดภาพป้ายทะเบียนตาม bounding box"""
+def crop_license_plate(image, bbox):
+    """ครอบตัดภาพป้ายทะเบียนตาม bounding box (image เป็น path หรือ DecodedImage) คืนค่าเป็น numpy array"""
     try:
-        image = cv2.imread(image_path)
-        x1, y1, x2, y2 = bbox
-        
         # Add padding
         padding = 10
-        h, w = image.shape[:2]
-        x1 = max(0, x1 - padding)
-        y1 = max(0, y1 - padding)
-        x2 = min(w, x2 + padding)
-        y2 = min(h, y2 + padding)
-        
-        # Crop image
-        cropped = image[y1:y2, x1:x2]
         
-        # Save cropped image
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
-        cropped_filename = f"cropped_{timestamp}.jpg"
-        cropped_path = os.path.join(app.config['UPLOAD_FOLDER'], cropped_filename)
-        cv2.imwrite(cropped_path, cropped)
+        if isinstance(image, DecodedImage):
+            # decode ความละเอียดสูงขึ้นเฉพาะเมื่อภาพที่ใช้ตรวจจับเล็กเกินไปสำหรับ OCR
+            cropped = image.crop_original(bbox, padding)
+        else:
+            if isinstance(image, str):
+                import cv2
+                image = cv2.imread(image)
+            x1, y1, x2, y2 = bbox
+            h, w = image.shape[:2]
+            x1 = max(0, x1 - padding)
+            y1 = max(0, y1 - padding)
+            x2 = min(w, x2 + padding)
+            y2 = min(h, y2 + padding)
+            
+            # Crop image
+            cropped = image[y1:y2, x1:x2]
         
-        return cropped_path
+        return cropped if cropped.size else None
         
     except Exception as e:
-        print(f"❌ Crop error: {e}")
+        logger.exception("❌ Crop error")
         return None
 
-def send_to_lpr_api(image_path):
-    """ส่งภาพไปยัง API AIforThai LPR เพื่ออ่านป้ายทะเบียน"""
+def save_crop(encoded):
+    """บันทึก bytes ของภาพป้ายที่ encode แล้ว (ชุดเดียวกับที่ส่ง OCR) คืนค่าชื่อไฟล์"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+    cropped_filename = f"cropped_{timestamp}.{encoded.extension}"
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], cropped_filename), 'wb') as f:
+        f.write(encoded.data)
+    return cropped_filename
+
+def send_to_lpr_api(image, timeout=OCR_TIMEOUT, mime_type='image/jpeg', array=None, backends=None, deadline=None):
+    """
+    อ่านป้ายทะเบียนด้วย OCR backend chain (ค่าเริ่มต้น AIforThai LPR, timeout เป็นวินาที)
     
-    # ใช้ Mock API สำหรับการทดสอบ
-    if USE_MOCK_API:
-        import random
-        import time
-        
-        print(f"🎭 Using Mock API: {MOCK_API_URL}")
-        
-        # จำลองการประมวลผล
-        time.sleep(random.uniform(0.2, 0.8))
-        
-        # 70% chance ตรวจพบป้าย
-        if random.random() < 0.7:
-            mock_plates = ["กข 1234", "1กก 2345", "ตณ 3754", "2กร 5678", "บจ 9876"]
-            plate = random.choice(mock_plates)
-            confidence = random.uniform(80, 95)
-            
-            return {
-                'success': True,
-                'license_plate': plate,
-                'confidence': confidence / 100.0,
-                'mock': True,
-                'raw_response': {'lp_number': plate, 'conf': confidence}
-            }
-        else:
-            return {
-                'success': False,
-                'license_plate': '',
-                'confidence': 0,
-                'error': 'ไม่พบป้ายทะเบียนในภาพ (Mock)',
-                'mock': True
-            }
+    image เป็น path ของไฟล์หรือ bytes ที่ encode แล้วก็ได้ array คือภาพ crop (BGR)
+    ที่ backend แบบ local อ่านได้โดยไม่ต้อง decode ซ้ำ backends คือรายชื่อ backend
+    ที่ request เลือก (None = ใช้ chain เริ่มต้น)
+    """
+    if isinstance(image, (bytes, bytearray)):
+        ocr_image = OcrImage(data=image, mime_type=mime_type, array=array)
+    else:
+        ocr_image = OcrImage(path=image, mime_type=mime_type, array=array)
+    return ocr_chain.recognize(ocr_image, timeout, names=backends, deadline=deadline)
+
+def requested_ocr_backends():
+    """Backend chain ที่ request เลือกผ่าน header X-OCR-Backend หรือพารามิเตอร์ ocr_backend"""
+    return ocr_chain.parse(request.headers.get(OCR_BACKEND_HEADER) or request.values.get('ocr_backend'))
+
+def ocr_variant(variant, backends):
+    """ผล OCR จาก chain อื่นไม่ใช้ cache ร่วมกับ chain เริ่มต้น"""
+    if backends:
+        variant['ocr'] = ','.join(backends)
+    return variant
+
+
+def check_watchlist(result, source):
+    """
+    ตรวจป้ายที่อ่านได้กับ watchlist และส่ง alert (push ไป Firebase node watchlist_alerts)
+    
+    ใส่รายการที่ตรงใน result['watchlist_matches'] alert ซ้ำของรายการเดิมจากกล้องเดิมถูกระงับตาม cooldown
+    """
+    if not (result.get('success') and result.get('license_plate')):
+        return
+    with stage_timer('watchlist'):
+        matches, alerts = watchlist.check(result['license_plate'], source)
+    if not matches:
+        return
+    
+    result['watchlist_matches'] = [{
+        'id': match['entry'].get('id'),
+        'label': match['entry'].get('label', ''),
+        'plate': match['entry'].get('plate'),
+        'pattern': match['entry'].get('pattern'),
+        'kind': match['kind'],
+        'distance': match['distance']
+    } for match in matches]
+    
+    for match, summary in zip(matches, result['watchlist_matches']):
+        if match not in alerts:
+            continue
+        metrics.record_watchlist_alert(match['kind'])
+        logger.warning("🚨 Watchlist match", extra={'license_plate': result['license_plate'],
+                                                    'source': source, 'watchlist': summary})
+        try:
+            firebase_manager.save_watchlist_alert({
+                'license_plate': result['license_plate'],
+                'source': source,
+                'watchlist': summary,
+                'firebase_doc_id': result.get('firebase_doc_id'),
+                'confidence': result.get('confidence', 0)
+            })
+        except Exception as firebase_error:
+            logger.warning("⚠️ Watchlist alert save failed", extra={'error': str(firebase_error)})
+
+def deadline_result(stage, source, confidence, temp_filename):
+    """ผลลัพธ์เมื่อหมดงบเวลาของ request ก่อนถึงขั้นตอน stage"""
+    metrics.record_deadline_exceeded(stage)
+    logger.warning("⏳ Deadline exceeded, abandoning request", extra={'stage': stage, 'source': source})
+    return {
+        'success': False,
+        'license_plate': '',
+        'confidence': 0,
+        'error': f'หมดเวลาประมวลผลก่อนขั้นตอน {stage}',
+        'deadline_exceeded': True,
+        'stage': stage,
+        'source': source,
+        'confidence_threshold': confidence,
+        'capture_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'temp_file': temp_filename
+    }
+
+def process_yolo_pipeline(image_bytes, confidence, source, temp_filename, detection_mode="auto", deadline=None,
+                          latest_wins=False, ocr_backends=None):
+    """
+    YOLO -> crop -> AIforThai API -> Firebase สำหรับภาพหนึ่งภาพ
+    
+    ใช้ร่วมกันระหว่าง /api/detect-yolo และ batch jobs คืนค่าเป็น result dict
+    ถ้ามี deadline จะหยุดทำงานทันทีเมื่อหมดงบเวลาของ request
+    ขั้นตอนตรวจจับรอคิวของ source ใน frame_scheduler (อาจ raise FrameRejected)
+    ocr_backends เลือก OCR backend chain ของ request นี้ (None = chain เริ่มต้น)
+    """
+    # ภาพเดิม + พารามิเตอร์เดิม ตอบจาก cache โดยไม่ต้องรัน YOLO / OCR
+    digest = content_hash(image_bytes)
+    variant = ocr_variant({'pipeline': 'yolo', 'confidence': confidence, 'source': source}, ocr_backends)
+    cached = upload_store.get_result(digest, variant)
+    metrics.record_result_cache(cached is not None)
+    if cached is not None:
+        return cached_result(cached, source=source, temp_file=temp_filename,
+                             capture_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
     
-    # ใช้ API จริง
     try:
-        payload = {}
-        
-        with open(image_path, 'rb') as img_file:
-            files = [('file', ('image.jpg', img_file, 'image/jpeg'))]
-            headers = {'apikey': API_KEY}
-            
-            response = requests.post(API_URL, headers=headers, data=payload, files=files, timeout=20)
+        result = _run_yolo_pipeline(image_bytes, confidence, source, temp_filename, detection_mode, deadline,
+                                    latest_wins, ocr_backends)
+    except DeadlineExceeded as e:
+        return deadline_result(e.stage, source, confidence, temp_filename)
+    upload_store.put_result(digest, variant, result)
+    return result
+
+def _run_yolo_pipeline(image_bytes, confidence, source, temp_filename, detection_mode, deadline, latest_wins=False,
+                       ocr_backends=None):
+    # decode + YOLO ใช้ CPU เต็มที่ รอคิวแบบ fair ต่อ source แทนการแย่งกันตามลำดับที่มาถึง
+    max_wait = min(SCHEDULER_MAX_WAIT, deadline.remaining()) if deadline else None
+    with frame_scheduler.slot(source, manual=detection_mode == 'manual', latest_wins=latest_wins,
+                              max_wait=max_wait) as queue_wait:
+        metrics.record_queue_wait(queue_wait)
         
-        print(f"API Response Status: {response.status_code}")
-        print(f"API Response: {response.text}")
+        # decode ที่ขนาดสำหรับตรวจจับ ไม่ใช่ขนาดเต็มของไฟล์ที่อัปโหลด
+        if deadline:
+            deadline.check('decode')
+        with stage_timer('decode'):
+            decoded = decode_image(image_bytes)
         
-        if response.status_code == 200:
-            api_result = response.json()
-            
-            # ตรวจสอบโครงสร้าง response ใหม่
-            if api_result.get('status') == 200 and api_result.get('lp_number'):
-                # API ใหม่ส่ง lp_number แทน LPR array
-                return {
-                    'success': True,
-                    'license_plate': api_result.get('lp_number', ''),
-                    'confidence': api_result.get('conf', 0) / 100.0,  # Convert percentage to decimal
-                    'raw_response': api_result
-                }
-            elif 'LPR' in api_result and len(api_result['LPR']) > 0:
-                # Old API format fallback
-                lpr_data = api_result['LPR'][0]
-                return {
-                    'success': True,
-                    'license_plate': lpr_data.get('plate', ''),
-                    'confidence': lpr_data.get('confidence', 0),
-                    'raw_response': api_result
-                }
-            else:
-                return {
-                    'success': False,
-                    'license_plate': '',
-                    'confidence': 0,
-                    'error': 'ไม่พบป้ายทะเบียนในภาพ',
-                    'raw_response': api_result
-                }
-        elif response.status_code == 401:
-            return {
-                'success': False,
-                'error': 'API Key ไม่ถูกต้องหรือหมดอายุ - กรุณาติดต่อผู้ดูแลระบบ',
-                'message': response.text
-            }
-        elif response.status_code == 429:
-            return {
-                'success': False,
-                'error': 'API Rate Limit - เรียกใช้บ่อยเกินไป กรุณารอสักครู่',
-                'message': response.text
-            }
-        else:
-            return {
-                'success': False,
-                'error': f'API Error: {response.status_code}',
-                'message': response.text
-            }
-            
-    except requests.exceptions.Timeout:
+        # Step 1: YOLO Detection
+        if deadline:
+            deadline.check('yolo')
+        detections = detect_license_plate_yolo(decoded, confidence, source, deadline) if decoded is not None else None
+    metrics.record_yolo(detections)
+    
+    # None = อ่านภาพไม่ได้ / โมเดลยังโหลดไม่เสร็จ / YOLO error ไม่ใช่ "ไม่พบป้าย" จึงต้องไม่ถูก cache
+    if detections is None:
         return {
             'success': False,
-            'error': 'API Timeout - เชื่อมต่อเซิร์ฟเวอร์ช้าเกินไป'
+            'license_plate': '',
+            'confidence': 0,
+            'error': 'ไม่สามารถอ่านไฟล์ภาพได้' if decoded is None else
+                     'YOLO ยังไม่พร้อมหรือทำงานผิดพลาด กรุณาลองใหม่อีกครั้ง',
+            'yolo_error': 'decode' if decoded is None else 'engine',
+            'source': source,
+            'confidence_threshold': confidence,
+            'capture_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'temp_file': temp_filename
         }
-    except requests.exceptions.ConnectionError:
+    
+    if not detections:
         return {
             'success': False,
-            'error': 'Connection Error - ไม่สามารถเชื่อมต่อเซิร์ฟเวอร์ได้'
+            'license_plate': '',
+            'confidence': 0,
+            'error': f'ไม่พบป้ายทะเบียนด้วย YOLO (confidence < {confidence})',
+            'yolo_detections': [],
+            'source': source,
+            'confidence_threshold': confidence,
+            'capture_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'temp_file': temp_filename
         }
-    except Exception as e:
+    
+    # Step 2: ใช้ detection ที่มี confidence สูงสุด
+    best_detection = max(detections, key=lambda x: x['confidence'])
+    logger.debug("🎯 Best YOLO detection", extra={'yolo_confidence': round(best_detection['confidence'], 3)})
+    
+    # Step 3: Crop license plate
+    if deadline:
+        deadline.check('crop')
+    with stage_timer('crop'):
+        cropped = crop_license_plate(decoded, best_detection['bbox'])
+    if cropped is None:
         return {
             'success': False,
-            'error': f'Error calling LPR API: {str(e)}'
+            'error': 'ไม่สามารถครอบตัดภาพป้ายทะเบียนได้',
+            'yolo_detections': detections,
+            'source': source,
+            'confidence_threshold': confidence,
+            'capture_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'temp_file': temp_filename
         }
+    
+    # Step 4: ตรวจคุณภาพภาพป้าย (เบลอ / มืด / เล็กเกินไป) ก่อนเสีย quota ของ OCR
+    bbox = best_detection['bbox']
+    with stage_timer('quality'):
+        quality = score_crop(cropped, (bbox[2] - bbox[0], bbox[3] - bbox[1]))
+    if not quality['passed']:
+        metrics.record_ocr(metrics.OCR_SKIPPED_QUALITY)
+        logger.info("🔍 Crop skipped: low quality", extra={'source': source, 'quality': quality})
+        return {
+            'success': False,
+            'license_plate': '',
+            'confidence': 0,
+            'error': f"ข้ามการอ่านป้าย: คุณภาพภาพต่ำ ({', '.join(quality['reasons'])})",
+            'skipped': 'low_quality',
+            'quality': quality,
+            'yolo_detections': detections,
+            'yolo_confidence': best_detection['confidence'],
+            'bbox': bbox,
+            'source': source,
+            'confidence_threshold': confidence,
+            'capture_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'temp_file': temp_filename
+        }
+    
+    # Step 5: ย่อให้ตัวอักษรสูงพอดีสำหรับ OCR และ encode ในหน่วยความจำให้เล็กที่สุด
+    with stage_timer('encode'):
+        encoded = encode_crop(cropped)
+    if encoded is None:
+        return {
+            'success': False,
+            'error': 'ไม่สามารถ encode ภาพป้ายทะเบียนได้',
+            'yolo_detections': detections,
+            'source': source,
+            'confidence_threshold': confidence,
+            'capture_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'temp_file': temp_filename
+        }
+    cropped_filename = save_crop(encoded)
+    
+    # Step 6: อ่านภาพที่ครอบตัดด้วย OCR backend chain (ข้ามถ้าเวลาเหลือไม่พอ)
+    # backend แบบ local อ่าน crop array โดยตรง ส่วน API ใช้ bytes ที่ encode แล้ว
+    if deadline and not deadline.allows_ocr():
+        metrics.record_ocr(metrics.OCR_SKIPPED_DEADLINE)
+        raise DeadlineExceeded('ocr')
+    with stage_timer('ocr'):
+        api_result = send_to_lpr_api(encoded.data, OCR_TIMEOUT, encoded.mime_type, array=cropped,
+                                     backends=ocr_backends, deadline=deadline)
+    
+    # Step 7: รวมผลลัพธ์
+    result = {
+        'success': api_result.get('success', False),
+        'license_plate': api_result.get('license_plate', ''),
+        'confidence': api_result.get('confidence', 0),
+        'yolo_detections': detections,
+        'yolo_confidence': best_detection['confidence'],
+        'bbox': best_detection['bbox'],
+        'quality': quality,
+        'encoding': encoded.info(),
+        'api_result': api_result,
+        'source': source,
+        'confidence_threshold': confidence,
+        'capture_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'temp_file': temp_filename,
+        'cropped_file': cropped_filename
+    }
+    
+    # บันทึกลง Firebase (ถ้าตรวจพบป้ายทะเบียน)
+    if result.get('success') and result.get('license_plate'):
+        try:
+            with stage_timer('firebase'):
+                firebase_doc_id = firebase_manager.save_detection_result(
+                    license_plate=result['license_plate'],
+                    confidence_api=result.get('confidence', 0),
+                    confidence_yolo=result.get('yolo_confidence', 0),
+                    detection_mode=detection_mode,  # YOLO+API = Auto mode
+                    api_response=api_result,  # ส่ง API response สำหรับการแยกจังหวัด
+                    source=source
+                )
+            if firebase_doc_id:
+                result['firebase_doc_id'] = firebase_doc_id
+                logger.info("✅ Saved to Firebase", extra={'firebase_doc_id': firebase_doc_id})
+        except Exception as firebase_error:
+            logger.warning("⚠️ Firebase save failed", extra={'error': str(firebase_error)})
+            # ไม่ให้ Firebase error ทำให้ API fail
+    
+    check_watchlist(result, source)
+    return result
 
 @app.route('/')
 def index():
@@ -253,15 +749,25 @@ def upload_file():
         return jsonify({'error': 'ไม่มีไฟล์ถูกเลือก'})
     
     if file and allowed_file(file.filename):
-        # บันทึกไฟล์
-        filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        # บันทึกไฟล์ตาม hash ของเนื้อหา (ไฟล์เดิมเก็บครั้งเดียว)
+        with stage_timer('save'):
+            digest, filename = upload_store.put(file.read(), secure_filename(file.filename))
+        filepath = upload_store.path_for(filename)
+        thumbnail_service.schedule(filename)
+        
+        # ภาพเดิมเคยอ่านแล้ว ไม่ต้องเรียก API ซ้ำ
+        ocr_backends = requested_ocr_backends()
+        variant = ocr_variant({'pipeline': 'ocr'}, ocr_backends)
+        cached = upload_store.get_result(digest, variant)
+        metrics.record_result_cache(cached is not None)
+        if cached is not None:
+            return jsonify(cached_result(cached, uploaded_file=filename,
+                                         upload_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
         
         # ส่งไปยัง API
-        result = send_to_lpr_api(filepath)
+        with stage_timer('ocr'):
+            result = send_to_lpr_api(filepath, backends=ocr_backends)
+        upload_store.put_result(digest, variant, result)
         
         # เพิ่มข้อมูลไฟล์ลงใน result
         result['uploaded_file'] = filename
@@ -272,55 +778,71 @@ def upload_file():
         return jsonify({'error': 'ไฟล์ไม่ถูกต้อง รองรับเฉพาะ PNG, JPG, JPEG, GIF, BMP'})
 
 @app.route('/api/detect', methods=['POST'])
+@idempotent
+@admission_controlled(PRIORITY_HIGH)
 def api_detect():
     """API สำหรับการตรวจจับจาก webcam"""
-    if 'file' not in request.files:
-        return jsonify({'success': False, 'error': 'ไม่มีไฟล์ถูกส่งมา'})
-    
-    file = request.files['file']
-    confidence = request.form.get('confidence', '0.25')
-    source = request.form.get('source', 'unknown')
-    
-    if file.filename == '':
-        return jsonify({'success': False, 'error': 'ไม่มีไฟล์ถูกเลือก'})
+    image_bytes, confidence, source, error = read_frame(0.25)
+    if error:
+        return jsonify({'success': False, 'error': error})
+    deadline = Deadline.from_request(request)
     
     try:
-        # สร้างชื่อไฟล์ชั่วคราว
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]  # รวม milliseconds
-        temp_filename = f"webcam_{timestamp}.jpg"
-        temp_filepath = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename)
+        # บันทึกไฟล์ตาม hash ของเนื้อหา (ภาพเดิมเก็บครั้งเดียว)
+        with stage_timer('save'):
+            digest, temp_filename = upload_store.put(image_bytes)
+        temp_filepath = upload_store.path_for(temp_filename)
+        thumbnail_service.schedule(temp_filename)
         
-        # บันทึกไฟล์ชั่วคราว
-        file.save(temp_filepath)
+        logger.debug("📁 Saved temp file", extra={'path': temp_filepath})
         
-        print(f"📁 Saved temp file: {temp_filepath}")
+        # ภาพเดิม (client retry) ตอบจาก cache โดยไม่เรียก API ซ้ำ
+        ocr_backends = requested_ocr_backends()
+        variant = ocr_variant({'pipeline': 'ocr'}, ocr_backends)
+        cached = upload_store.get_result(digest, variant)
+        metrics.record_result_cache(cached is not None)
+        if cached is not None:
+            return jsonify(cached_result(cached, source=source, confidence_threshold=confidence,
+                                         capture_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                         temp_file=temp_filename))
         
-        # ส่งไปยัง API
-        result = send_to_lpr_api(temp_filepath)
+        # ส่งไปยัง API (ข้ามถ้าเวลาที่ client รอได้เหลือไม่พอ)
+        if not deadline.allows_ocr():
+            metrics.record_ocr(metrics.OCR_SKIPPED_DEADLINE)
+            return jsonify(deadline_result('ocr', source, confidence, temp_filename))
+        with stage_timer('ocr'):
+            result = send_to_lpr_api(temp_filepath, OCR_TIMEOUT, backends=ocr_backends, deadline=deadline)
+        upload_store.put_result(digest, variant, result)
         
         # เพิ่มข้อมูลเพิ่มเติม
         result['source'] = source
-        result['confidence_threshold'] = float(confidence)
+        result['confidence_threshold'] = confidence
         result['capture_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         result['temp_file'] = temp_filename
         
         # บันทึกลง Firebase (ถ้าตรวจพบป้ายทะเบียน)
         if result.get('success') and result.get('license_plate'):
             try:
-                firebase_doc_id = firebase_manager.save_detection_result(
-                    license_plate=result['license_plate'],
-                    confidence_api=result.get('confidence', 0),
-                    detection_mode="manual",
-                    api_response=result  # ส่ง API response ทั้งหมดสำหรับการแยกจังหวัด
-                )
+                with stage_timer('firebase'):
+                    firebase_doc_id = firebase_manager.save_detection_result(
+                        license_plate=result['license_plate'],
+                        confidence_api=result.get('confidence', 0),
+                        detection_mode="manual",
+                        api_response=result,  # ส่ง API response ทั้งหมดสำหรับการแยกจังหวัด
+                        source=source
+                    )
                 if firebase_doc_id:
                     result['firebase_doc_id'] = firebase_doc_id
-                    print(f"✅ Saved to Firebase: {firebase_doc_id}")
+                    logger.info("✅ Saved to Firebase", extra={'firebase_doc_id': firebase_doc_id})
             except Exception as firebase_error:
-                print(f"⚠️ Firebase save failed: {firebase_error}")
+                logger.warning("⚠️ Firebase save failed", extra={'error': str(firebase_error)})
                 # ไม่ให้ Firebase error ทำให้ API fail
         
-        print(f"📡 API Result: {result}")
+        check_watchlist(result, source)
+        
+        logger.info("📡 Detect result", extra={'source': source, 'success': result.get('success'),
+                                                'license_plate': result.get('license_plate', '')})
+        log_payload(logger, "📡 API Result", result)
         
         # ลบไฟล์ชั่วคราวหลังจากส่ง API (เก็บไว้ถ้า debug)
         # os.remove(temp_filepath)
@@ -328,114 +850,132 @@ def api_detect():
         return jsonify(result)
         
     except Exception as e:
-        print(f"❌ Error in api_detect: {str(e)}")
+        logger.exception("❌ Error in api_detect")
         return jsonify({
             'success': False, 
             'error': f'เกิดข้อผิดพลาด: {str(e)}'
         })
 
 @app.route('/api/detect-yolo', methods=['POST'])
+@idempotent
+@admission_controlled(PRIORITY_LOW)
 def api_detect_yolo():
     """API สำหรับการตรวจจับด้วย YOLO + AIforThai API"""
-    if 'file' not in request.files:
-        return jsonify({'success': False, 'error': 'ไม่มีไฟล์ถูกส่งมา'})
-    
-    file = request.files['file']
-    confidence = float(request.form.get('confidence', '0.7'))
-    source = request.form.get('source', 'unknown')
-    
-    if file.filename == '':
-        return jsonify({'success': False, 'error': 'ไม่มีไฟล์ถูกเลือก'})
+    image_bytes, confidence, source, error = read_frame(0.7)
+    if error:
+        return jsonify({'success': False, 'error': error})
+    deadline = Deadline.from_request(request)
+    manual = request.headers.get(DETECTION_MODE_HEADER, '').lower() == 'manual'
     
     try:
-        # สร้างชื่อไฟล์ชั่วคราว
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
-        temp_filename = f"webcam_yolo_{timestamp}.jpg"
-        temp_filepath = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename)
-        
-        # บันทึกไฟล์ชั่วคราว
-        file.save(temp_filepath)
-        print(f"📁 Saved temp file: {temp_filepath}")
-        
-        # Step 1: YOLO Detection
-        detections = detect_license_plate_yolo(temp_filepath, confidence)
-        
-        if not detections:
-            return jsonify({
-                'success': False,
-                'license_plate': '',
-                'confidence': 0,
-                'error': f'ไม่พบป้ายทะเบียนด้วย YOLO (confidence < {confidence})',
-                'yolo_detections': [],
-                'source': source,
-                'confidence_threshold': confidence,
-                'capture_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'temp_file': temp_filename
-            })
-        
-        # Step 2: ใช้ detection ที่มี confidence สูงสุด
-        best_detection = max(detections, key=lambda x: x['confidence'])
-        print(f"🎯 Best YOLO detection: confidence={best_detection['confidence']:.3f}")
-        
-        # Step 3: Crop license plate
-        cropped_path = crop_license_plate(temp_filepath, best_detection['bbox'])
-        if not cropped_path:
-            return jsonify({
-                'success': False,
-                'error': 'ไม่สามารถครอบตัดภาพป้ายทะเบียนได้',
-                'yolo_detections': detections,
-                'source': source,
-                'confidence_threshold': confidence,
-                'capture_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'temp_file': temp_filename
-            })
+        # เกิน frame rate ของกล้องนี้ ปฏิเสธก่อนบันทึกไฟล์
+        frame_scheduler.check_rate(source, manual)
         
-        # Step 4: ส่งภาพที่ครอบตัดไปยัง AIforThai API
-        api_result = send_to_lpr_api(cropped_path)
+        # บันทึกไฟล์ตาม hash ของเนื้อหา (อ่าน bytes ครั้งเดียว ใช้ทั้งบันทึกและ decode)
+        with stage_timer('save'):
+            _, temp_filename = upload_store.put(image_bytes)
+        temp_filepath = upload_store.path_for(temp_filename)
+        thumbnail_service.schedule(temp_filename)
+        logger.debug("📁 Saved temp file", extra={'path': temp_filepath})
         
-        # Step 5: รวมผลลัพธ์
-        result = {
-            'success': api_result.get('success', False),
-            'license_plate': api_result.get('license_plate', ''),
-            'confidence': api_result.get('confidence', 0),
-            'yolo_detections': detections,
-            'yolo_confidence': best_detection['confidence'],
-            'bbox': best_detection['bbox'],
-            'api_result': api_result,
-            'source': source,
-            'confidence_threshold': confidence,
-            'capture_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'temp_file': temp_filename,
-            'cropped_file': os.path.basename(cropped_path)
-        }
-        
-        # บันทึกลง Firebase (ถ้าตรวจพบป้ายทะเบียน)
-        if result.get('success') and result.get('license_plate'):
-            try:
-                firebase_doc_id = firebase_manager.save_detection_result(
-                    license_plate=result['license_plate'],
-                    confidence_api=result.get('confidence', 0),
-                    confidence_yolo=result.get('yolo_confidence', 0),
-                    detection_mode="auto",  # YOLO+API = Auto mode
-                    api_response=api_result  # ส่ง API response สำหรับการแยกจังหวัด
-                )
-                if firebase_doc_id:
-                    result['firebase_doc_id'] = firebase_doc_id
-                    print(f"✅ Saved to Firebase: {firebase_doc_id}")
-            except Exception as firebase_error:
-                print(f"⚠️ Firebase save failed: {firebase_error}")
-                # ไม่ให้ Firebase error ทำให้ API fail
+        # auto frame ที่ยังรอคิวอยู่ถูกแทนด้วยเฟรมใหม่กว่าจากกล้องเดียวกัน
+        result = process_yolo_pipeline(image_bytes, confidence, source, temp_filename,
+                                       detection_mode='manual' if manual else 'auto', deadline=deadline,
+                                       latest_wins=not manual, ocr_backends=requested_ocr_backends())
         
-        print(f"📡 YOLO+API Result: {result}")
+        logger.info("📡 YOLO+API result", extra={'source': source, 'success': result.get('success'),
+                                                 'license_plate': result.get('license_plate', '')})
+        log_payload(logger, "📡 YOLO+API Result", result)
         return jsonify(result)
         
+    except FrameRejected as e:
+        return frame_rejected_response(e, source)
     except Exception as e:
-        print(f"❌ Error in api_detect_yolo: {str(e)}")
+        logger.exception("❌ Error in api_detect_yolo")
         return jsonify({
             'success': False, 
             'error': f'เกิดข้อผิดพลาด: {str(e)}'
         })
 
+def _process_batch_item(image_bytes, filename, job_id, confidence):
+    """ประมวลผลภาพหนึ่งภาพของ batch job ด้วย YOLO + AIforThai API"""
+    return process_yolo_pipeline(image_bytes, confidence, f"batch:{job_id}", filename)
+
+@app.route('/api/batch', methods=['POST'])
+def api_batch_submit():
+    """ส่งภาพหลายไฟล์ (หรือไฟล์ zip) เพื่อประมวลผลแบบ batch"""
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not files:
+        return jsonify({'success': False, 'error': 'ไม่มีไฟล์ถูกส่งมา'})
+    
+    try:
+        confidence = float(request.form.get('confidence', '0.7'))
+        # ไฟล์ถูกเขียนลงโฟลเดอร์ของ job ทีละไฟล์ ไม่อ่านทั้ง zip เข้า memory
+        job = batch_manager.submit(
+            files,
+            lambda data, filename, job_id: _process_batch_item(data, filename, job_id, confidence),
+            options={'confidence': confidence}
+        )
+        if job is None:
+            return jsonify({'success': False, 'error': 'ไม่พบไฟล์ภาพ รองรับเฉพาะ PNG, JPG, JPEG, GIF, BMP หรือ ZIP'})
+        job_id = job['job_id']
+        logger.info("📦 Batch job submitted", extra={'job_id': job_id, 'images': job['total']})
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'total': job['total'],
+            'status_url': url_for('api_batch_status', job_id=job_id),
+            'export_url': url_for('api_batch_export', job_id=job_id)
+        }), 202
+        
+    except Exception as e:
+        logger.exception("❌ Error in api_batch_submit")
+        return jsonify({
+            'success': False,
+            'error': f'เกิดข้อผิดพลาด: {str(e)}'
+        })
+
+@app.route('/api/batch/<job_id>')
+def api_batch_status(job_id):
+    """ความคืบหน้าและผลลัพธ์บางส่วนของ batch job"""
+    status = batch_manager.get_status(job_id)
+    if status is None:
+        return jsonify({'success': False, 'error': 'ไม่พบ batch job'}), 404
+    
+    try:
+        offset = int_arg('offset', 0)
+        limit = int_arg('limit', 100, minimum=1, maximum=1000)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    results = batch_manager.get_results(job_id, offset, limit)
+    return jsonify({
+        'success': True,
+        'job': status,
+        'results': results,
+        'next_offset': offset + len(results)
+    })
+
+@app.route('/api/batch/<job_id>/export')
+def api_batch_export(job_id):
+    """ดาวน์โหลดผลลัพธ์ของ batch job เป็น JSONL หรือ CSV"""
+    if batch_manager.get_status(job_id) is None:
+        return jsonify({'success': False, 'error': 'ไม่พบ batch job'}), 404
+    
+    export_format = request.args.get('format', 'jsonl')
+    if export_format == 'csv':
+        return Response(
+            batch_manager.export_csv(job_id),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=batch_{job_id}.csv'}
+        )
+    
+    results_path = batch_manager.results_path(job_id)
+    if results_path is None:
+        return Response('', mimetype='application/x-ndjson')
+    return send_file(os.path.abspath(results_path), mimetype='application/x-ndjson',
+                     as_attachment=True, download_name=f'batch_{job_id}.jsonl')
+
 @app.route('/history')
 def history():
     """หน้าประวัติการอัปโหลด"""
@@ -455,18 +995,170 @@ def history():
     files.sort(key=lambda x: x['modified'], reverse=True)
     return render_template('history.html', files=files)
 
+@app.route('/thumbnails/<size>/<filename>')
+def thumbnail(size, filename):
+    """ภาพย่อของไฟล์ที่อัปโหลด (WebP ถ้า browser รองรับ ไม่งั้น JPEG) สร้างครั้งแรกที่มีคนขอแล้วเก็บไว้บน disk"""
+    if size not in THUMBNAIL_SIZES or secure_filename(filename) != filename or not allowed_file(filename):
+        return jsonify({'success': False, 'error': 'ไม่พบภาพ'}), 404
+    
+    fmt = request.args.get('format')
+    if fmt not in THUMBNAIL_MIME_TYPES:
+        fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+    path = thumbnail_service.get(filename, size, fmt)
+    if path is None:
+        return jsonify({'success': False, 'error': 'ไม่พบภาพ'}), 404
+    
+    response = send_file(os.path.abspath(path), mimetype=THUMBNAIL_MIME_TYPES[fmt], conditional=True)
+    # ชื่อไฟล์อัปโหลดคือ hash ของเนื้อหา ภาพย่อของ URL เดิมจึงไม่เปลี่ยน
+    response.headers['Cache-Control'] = f'public, max-age={THUMBNAIL_MAX_AGE}, immutable'
+    response.headers['Vary'] = 'Accept'
+    return response
+
 @app.route('/api/info')
+@cached_response
 def api_info():
     """ข้อมูล API"""
     return jsonify({
         'api_url': API_URL,
+        'ocr': ocr_chain.status(),
         'status': 'active',
         'supported_formats': ['PNG', 'JPG', 'JPEG', 'GIF', 'BMP'],
         'max_file_size': '16MB',
-        'firebase_connected': firebase_manager.is_connected()
+        'firebase_connected': firebase_manager.is_connected(wait=False),
+        'model_ready': model_manager.is_ready(),
+        'admission': admission_controller.stats(),
+        'scheduler': frame_scheduler.stats(),
+        'thumbnails': thumbnail_service.stats(),
+        'response_cache': response_cache.stats(),
+        'cpu_budget': cpu_budget.status()
+    })
+
+@app.route('/api/scheduler')
+def api_scheduler():
+    """ความยาวคิวและเวลารอของแต่ละ source ใน worker นี้"""
+    return jsonify(frame_scheduler.stats())
+
+@app.route('/api/startup')
+def api_startup():
+    """Startup profile ของ worker นี้: เวลา import ของแต่ละ module และเวลาเริ่มต้น backend"""
+    report = startup_profile.report()
+    report['model'] = {'state': model_manager.state, 'load_time_ms': model_manager.load_time_ms}
+    report['firebase'] = {'connected': firebase_manager.is_connected(wait=False),
+                          'mock_mode': firebase_manager.mock_mode,
+                          'connect_time_ms': firebase_manager.connect_time_ms}
+    return jsonify(report)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus metrics รวมจากทุก gunicorn worker"""
+    body, content_type = metrics.render_metrics()
+    return Response(body, content_type=content_type)
+
+@app.route('/api/cameras')
+def api_cameras():
+    """การตั้งค่า ROI / imgsz และ ROI ที่เรียนรู้ของแต่ละกล้อง"""
+    return jsonify({
+        'success': True,
+        'cameras': camera_settings.status()
+    })
+
+@app.route('/api/watchlist', methods=['GET'])
+def api_watchlist():
+    """รายการ watchlist"""
+    # worker นี้อาจยังไม่เห็นการแก้ไขจาก worker อื่น
+    watchlist.refresh(force=True)
+    return jsonify({
+        'success': True,
+        'entries': watchlist.entries,
+        'count': len(watchlist.entries),
+        'max_distance': watchlist.max_distance
+    })
+
+@app.route('/api/watchlist', methods=['POST'])
+def api_watchlist_add():
+    """เพิ่มป้าย (plate) หรือรูปแบบ (pattern เช่น กข*) ลงใน watchlist"""
+    data = request.get_json(silent=True) or request.form
+    plate = (data.get('plate') or '').strip()
+    pattern = (data.get('pattern') or '').strip()
+    if bool(plate) == bool(pattern):
+        return jsonify({'success': False, 'error': 'ต้องระบุ plate หรือ pattern อย่างใดอย่างหนึ่ง'}), 400
+    entry = watchlist.add(plate=plate or None, pattern=pattern or None, label=data.get('label'))
+    return jsonify({'success': True, 'entry': entry}), 201
+
+@app.route('/api/watchlist/<entry_id>', methods=['DELETE'])
+def api_watchlist_remove(entry_id):
+    """ลบรายการออกจาก watchlist"""
+    if not watchlist.remove(entry_id):
+        return jsonify({'success': False, 'error': 'ไม่พบรายการ'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/watchlist/alerts')
+def api_watchlist_alerts():
+    """การแจ้งเตือน watchlist ล่าสุด"""
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({
+        'success': True,
+        'alerts': firebase_manager.get_watchlist_alerts(limit)
+    })
+
+@app.route('/api/archive/query')
+def api_archive_query():
+    """ค้นข้อมูลที่ archive แล้ว (อ่านเฉพาะ partition ในช่วงวันที่และเฉพาะคอลัมน์ที่ขอ)"""
+    columns = request.args.get('columns')
+    results = detection_archive.query(
+        start_date=request.args.get('start_date'),
+        end_date=request.args.get('end_date'),
+        columns=columns.split(',') if columns else None,
+        license_plate=request.args.get('license_plate'),
+        province=request.args.get('province'),
+        source=request.args.get('source'),
+        detection_mode=request.args.get('mode'),
+        limit=request.args.get('limit', 100, type=int)
+    )
+    return jsonify({
+        'success': True,
+        'results': results,
+        'count': len(results)
     })
 
+@app.route('/api/archive/stats')
+def api_archive_stats():
+    """จำนวนข้อมูลที่ archive แล้วแยกตามคอลัมน์ (province, region, detection_mode, source, license_plate)"""
+    group_by = request.args.get('by', 'province')
+    if group_by not in ARCHIVE_GROUP_COLUMNS:
+        return jsonify({'success': False, 'error': f"by ต้องเป็น {', '.join(ARCHIVE_GROUP_COLUMNS)}"}), 400
+    return jsonify({
+        'success': True,
+        'by': group_by,
+        'counts': detection_archive.count_by(group_by, request.args.get('start_date'), request.args.get('end_date')),
+        'archive': detection_archive.status()
+    })
+
+@app.route('/api/timeseries')
+@cached_response
+def api_timeseries():
+    """จำนวนการตรวจจับตามช่วงเวลาจาก rollups รายชั่วโมง/รายวัน (ไม่ scan record)"""
+    split = [s for s in request.args.get('split', '').split(',') if s in SPLIT_DIMENSIONS]
+    try:
+        end = request.args.get('end') or datetime.now().strftime("%Y-%m-%dT%H")
+        start = request.args.get('start') or (datetime.fromisoformat(end) - timedelta(days=1)).strftime("%Y-%m-%dT%H")
+        max_points = int_arg('max_points', TIMESERIES_MAX_POINTS, minimum=1, maximum=5000)
+        series = detection_rollups.timeseries(start, end, request.args.get('interval'), max_points, split)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify(dict(series, success=True))
+
+@app.route('/api/ready')
+def api_ready():
+    """Readiness check: สถานะโมเดลและเวลา warm-up"""
+    status = model_manager.status()
+    return jsonify({
+        'ready': status['ready'],
+        'model': status
+    }), (200 if status['ready'] else 503)
+
 @app.route('/api/firebase/stats')
+@cached_response
 def firebase_stats():
     """ข้อมูลสถิติจาก Firebase"""
     try:
@@ -482,10 +1174,15 @@ def firebase_stats():
         })
 
 @app.route('/api/firebase/recent')
+@cached_response
 def firebase_recent():
     """ข้อมูลการตรวจจับล่าสุดจาก Firebase"""
     try:
-        limit = int(request.args.get('limit', 20))
+        limit = int_arg('limit', 20, minimum=1, maximum=1000)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    try:
         recent = firebase_manager.get_recent_detections(limit)
         
         # แปลง timestamp เป็น string ถ้าจำเป็น
@@ -539,6 +1236,7 @@ def firebase_search():
         })
 
 @app.route('/api/province-stats', methods=['GET'])
+@cached_response
 def get_province_stats():
     """ดึงสถิติการตรวจจับตามจังหวัดและภาค"""
     try:
@@ -558,5 +1256,13 @@ def dashboard():
     """หน้า Dashboard สำหรับดูข้อมูล Firebase"""
     return render_template('dashboard.html')
 
+startup_profile.mark('app_imported')
+logger.info(f"⏱️ App imported in {startup_profile.milestones['app_imported']:.0f} ms since process start",
+            extra={'slowest_imports': startup_profile.slowest_imports(5)})
+
+# ภายใต้ gunicorn worker แต่ละตัวเรียก start_background_init() เองใน post_fork
+if os.environ.get('LPR_DEFER_BACKGROUND_INIT') != '1':
+    start_background_init()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=8080)
@@ -0,0 +1,370 @@
+"""
+========================================
+📦 Batch upload jobs
+========================================
+
+Many files (or zip archives) are submitted at once, streamed to
+``batch_jobs/<job_id>/inputs/`` and processed on a bounded thread pool that
+reads each image back from disk. Job state lives on disk (status.json +
+results.jsonl) so any gunicorn worker can answer progress polls and
+exports, not only the one running the job. A job whose worker died is
+reported as failed instead of running forever.
+"""
+
+import os
+import io
+import re
+import csv
+import json
+import time
+import uuid
+import shutil
+import socket
+import zipfile
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+BATCH_FOLDER = os.environ.get('BATCH_FOLDER', 'batch_jobs')
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', str(os.cpu_count() or 2)))
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', '1000'))
+BATCH_MAX_FILE_SIZE = 16 * 1024 * 1024  # เท่ากับขนาดไฟล์สูงสุดของ /upload
+# job ที่กำลังรันแต่ไม่มีความคืบหน้านานเกินนี้ (วินาที) ถือว่า worker ค้าง/ตายแล้ว
+BATCH_STALE_AFTER = float(os.environ.get('BATCH_STALE_AFTER', '600'))
+COPY_CHUNK_SIZE = 1024 * 1024
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
+
+# คอลัมน์สำหรับ export CSV
+CSV_COLUMNS = ['index', 'filename', 'success', 'license_plate', 'confidence',
+               'yolo_confidence', 'bbox', 'province', 'firebase_doc_id', 'error']
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{12}$')
+
+# Job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+
+def _is_image(filename):
+    """ตรวจสอบนามสกุลไฟล์ภาพ"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _write_json_atomic(path, data):
+    """เขียน JSON แบบ atomic เพื่อไม่ให้ worker อื่นอ่านไฟล์ที่เขียนไม่เสร็จ"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _copy_limited(source, path, limit=BATCH_MAX_FILE_SIZE):
+    """
+    Stream a file object to path, giving up past limit bytes
+
+    Returns:
+        bool: True if the whole file was written
+    """
+    written = 0
+    with open(path, 'wb') as out:
+        while True:
+            chunk = source.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                return True
+            written += len(chunk)
+            if written > limit:
+                break
+            out.write(chunk)
+    os.remove(path)
+    return False
+
+
+def expand_uploads(files, input_dir):
+    """
+    Stream uploaded files and zip archive members into input_dir
+
+    Nothing is held in memory: a zip is read from the upload's own stream
+    (werkzeug spools large uploads to a temporary file) and each member is
+    copied to disk in chunks.
+
+    Args:
+        files: Iterable of werkzeug FileStorage
+        input_dir: Directory of the job's inputs
+
+    Returns:
+        list: Stored file names in submission order
+    """
+    stored = []
+
+    def store(source, filename):
+        stored_name = f"{len(stored):05d}_{secure_filename(os.path.basename(filename))}"
+        if _copy_limited(source, os.path.join(input_dir, stored_name)):
+            stored.append(stored_name)
+
+    for file in files:
+        if len(stored) >= BATCH_MAX_FILES:
+            break
+        if not file or not file.filename:
+            continue
+        if file.filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(file.stream) as archive:
+                for info in archive.infolist():
+                    if len(stored) >= BATCH_MAX_FILES:
+                        break
+                    if info.is_dir() or not _is_image(info.filename):
+                        continue
+                    # ป้องกัน zip bomb: ข้ามไฟล์ที่ใหญ่เกินกว่าที่ /upload รับได้
+                    # (ตรวจขนาดจริงระหว่างแตกไฟล์ด้วย ไม่เชื่อขนาดใน header อย่างเดียว)
+                    if info.file_size > BATCH_MAX_FILE_SIZE:
+                        continue
+                    with archive.open(info) as member:
+                        store(member, info.filename)
+        elif _is_image(file.filename):
+            store(file.stream, file.filename)
+    return stored
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class BatchJobManager:
+    def __init__(self, folder=BATCH_FOLDER, max_workers=BATCH_MAX_WORKERS):
+        """
+        Queue and track batch jobs
+
+        Args:
+            folder: Directory holding job state and inputs
+            max_workers: Thread pool size (YOLO is serialized inside the
+                engine, OCR calls overlap up to the OCR concurrency limit)
+        """
+        self.folder = folder
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _get_executor(self):
+        """สร้าง thread pool หลัง fork เท่านั้น (thread ไม่ข้าม fork)"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='batch')
+            return self._executor
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.folder, job_id)
+
+    def exists(self, job_id):
+        """ตรวจสอบว่ามี job นี้ (job_id มาจาก URL จึงต้องตรวจรูปแบบก่อนใช้เป็น path)"""
+        return bool(JOB_ID_PATTERN.match(job_id or '')) and os.path.isdir(self._job_dir(job_id))
+
+    def submit(self, files, process_fn, options=None):
+        """
+        Store inputs and queue every image on the worker pool
+
+        Args:
+            files: Uploaded werkzeug FileStorage objects (images or zip archives)
+            process_fn: Callable(image_bytes, filename, job_id) -> result dict
+            options: Extra job options recorded in status.json
+
+        Returns:
+            dict: status of the queued job, or None if there were no images
+        """
+        job_id = uuid.uuid4().hex[:12]
+        job_dir = self._job_dir(job_id)
+        input_dir = os.path.join(job_dir, 'inputs')
+        os.makedirs(input_dir)
+
+        try:
+            filenames = expand_uploads(files, input_dir)
+        except Exception:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+        if not filenames:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return None
+
+        now = time.time()
+        status = {
+            'job_id': job_id,
+            'status': JOB_QUEUED,
+            'total': len(filenames),
+            'processed': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'options': options or {},
+            # worker ที่รัน job (ใช้ตรวจว่า job ค้างเพราะ worker ตาย)
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'created_at': now,
+            'updated_at': now,
+            'started_at': None,
+            'finished_at': None
+        }
+        _write_json_atomic(os.path.join(job_dir, 'status.json'), status)
+
+        job = _RunningJob(job_dir, status)
+        executor = self._get_executor()
+        for index, stored_name in enumerate(filenames):
+            executor.submit(job.run_item, index, stored_name, process_fn)
+
+        logger.info(f"📦 Batch job {job_id} queued with {len(filenames)} images")
+        return status
+
+    def get_status(self, job_id):
+        """
+        Read job progress (any worker can serve this)
+
+        A queued or running job whose worker process is gone, or that has
+        made no progress for BATCH_STALE_AFTER seconds, is marked failed.
+
+        Returns:
+            dict or None if the job does not exist
+        """
+        path = os.path.join(self._job_dir(job_id), 'status.json')
+        if not self.exists(job_id) or not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            status = json.load(f)
+
+        reason = self._stale_reason(status)
+        if reason:
+            status.update({'status': JOB_FAILED, 'error': reason, 'finished_at': time.time()})
+            _write_json_atomic(path, status)
+            logger.warning(f"⚠️ Batch job {job_id} marked failed: {reason}")
+        return status
+
+    @staticmethod
+    def _stale_reason(status):
+        if status['status'] not in (JOB_QUEUED, JOB_RUNNING):
+            return None
+        if status.get('host') == socket.gethostname() and status.get('pid') \
+                and not _process_alive(status['pid']):
+            return 'worker ที่รัน job หยุดทำงานก่อนประมวลผลเสร็จ'
+        # job ที่ยัง queued อาจรอ job อื่นใน pool เดียวกัน จึงตรวจความคืบหน้าเฉพาะ job ที่รันอยู่
+        updated_at = status.get('updated_at') or status.get('started_at') or 0
+        if status['status'] == JOB_RUNNING and time.time() - updated_at > BATCH_STALE_AFTER:
+            return f'ไม่มีความคืบหน้านานกว่า {int(BATCH_STALE_AFTER)} วินาที'
+        return None
+
+    def get_results(self, job_id, offset=0, limit=None):
+        """
+        Read results written so far
+
+        Args:
+            job_id: Job ID
+            offset: Skip this many results (สำหรับ poll แบบต่อเนื่อง)
+            limit: Maximum number of results
+
+        Returns:
+            list: Result dicts in completion order
+        """
+        path = os.path.join(self._job_dir(job_id), 'results.jsonl')
+        if not os.path.exists(path):
+            return []
+        results = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f):
+                if line_no < offset:
+                    continue
+                if limit is not None and len(results) >= limit:
+                    break
+                results.append(json.loads(line))
+        return results
+
+    def results_path(self, job_id):
+        """Path of results.jsonl (or None)"""
+        path = os.path.join(self._job_dir(job_id), 'results.jsonl')
+        return path if os.path.exists(path) else None
+
+    def export_csv(self, job_id):
+        """
+        Build a CSV export of all results
+
+        Returns:
+            str: CSV text
+        """
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=CSV_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        for result in sorted(self.get_results(job_id), key=lambda r: r.get('index', 0)):
+            writer.writerow(result)
+        return output.getvalue()
+
+
+class _RunningJob:
+    """สถานะของ job ใน worker ที่รันอยู่ (นับ progress และเขียน status.json)"""
+
+    def __init__(self, job_dir, status):
+        self.job_dir = job_dir
+        self.status = status
+        self._lock = threading.Lock()
+
+    def run_item(self, index, stored_name, process_fn):
+        with self._lock:
+            if self.status['status'] == JOB_QUEUED:
+                self.status['status'] = JOB_RUNNING
+                self.status['started_at'] = self.status['updated_at'] = time.time()
+                _write_json_atomic(os.path.join(self.job_dir, 'status.json'), self.status)
+
+        input_path = os.path.join(self.job_dir, 'inputs', stored_name)
+        filename = stored_name.split('_', 1)[1]
+        try:
+            with open(input_path, 'rb') as f:
+                data = f.read()
+            result = process_fn(data, filename, os.path.basename(self.job_dir))
+        except Exception as e:
+            result = {'success': False, 'error': f'เกิดข้อผิดพลาด: {str(e)}'}
+
+        record = _summarize(index, filename, result)
+        with self._lock:
+            with open(os.path.join(self.job_dir, 'results.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+            self.status['processed'] += 1
+            self.status['updated_at'] = time.time()
+            if record['success']:
+                self.status['succeeded'] += 1
+            else:
+                self.status['failed'] += 1
+            if self.status['processed'] >= self.status['total']:
+                self.status['status'] = JOB_COMPLETED
+                self.status['finished_at'] = time.time()
+                logger.info(f"✅ Batch job {self.status['job_id']} completed: "
+                            f"{self.status['succeeded']}/{self.status['total']} plates read")
+            _write_json_atomic(os.path.join(self.job_dir, 'status.json'), self.status)
+
+
+def _summarize(index, filename, result):
+    """ตัดผลลัพธ์ให้เหลือเฉพาะข้อมูลที่ใช้ export"""
+    api_result = result.get('api_result') or {}
+    raw_response = api_result.get('raw_response') or {}
+    return {
+        'index': index,
+        'filename': filename,
+        'success': bool(result.get('success')),
+        'license_plate': result.get('license_plate', ''),
+        'confidence': result.get('confidence', 0),
+        'yolo_confidence': result.get('yolo_confidence'),
+        'bbox': result.get('bbox'),
+        'province': raw_response.get('province'),
+        'firebase_doc_id': result.get('firebase_doc_id'),
+        'error': result.get('error')
+    }
+
+
+# Global batch job manager instance
+batch_manager = BatchJobManager()
@@ -0,0 +1,179 @@
+"""
+========================================
+📷 Per-camera detection settings (ROI & inference size)
+========================================
+
+Settings are keyed by the ``source`` form field sent with each frame and
+loaded from a JSON file, e.g.::
+
+    {
+        "gate1":  {"roi": [0.10, 0.40, 0.90, 1.00], "imgsz": 480, "weight": 2},
+        "webcam": {"auto_roi": true, "imgsz": 640, "max_fps": 2}
+    }
+
+``roi`` is [x1, y1, x2, y2] either as fractions of the frame (<= 1.0) or
+pixels. With ``auto_roi`` the region is learned from a rolling history of
+detected bboxes once enough samples have been seen. ``weight`` and
+``max_fps`` control the camera's share of detection (see source_scheduler).
+"""
+
+import os
+import json
+import threading
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CAMERA_CONFIG_PATH = os.environ.get('CAMERA_CONFIG_PATH', 'camera_settings.json')
+
+DEFAULT_CAMERA_SETTINGS = {
+    'roi': None,        # [x1, y1, x2, y2] fraction หรือ pixel
+    'imgsz': None,      # ขนาด inference (None = ค่า default ของ engine)
+    'auto_roi': False,  # เรียนรู้ ROI จากตำแหน่งป้ายที่ตรวจพบ
+    'weight': 1.0,      # สัดส่วนเวลาตรวจจับเทียบกับกล้องอื่น
+    'max_fps': None     # จำนวน auto frame สูงสุดต่อวินาที (None = SCHEDULER_DEFAULT_MAX_FPS)
+}
+
+# Auto ROI learning
+AUTO_ROI_HISTORY = 200          # จำนวน bbox ล่าสุดที่เก็บต่อกล้อง
+AUTO_ROI_MIN_SAMPLES = 30       # ต้องมี bbox อย่างน้อยเท่านี้ก่อนใช้ ROI ที่เรียนรู้
+AUTO_ROI_MARGIN = 0.10          # ขยายขอบ ROI ออกไปอีก 10% ของขนาดเฟรม
+AUTO_ROI_PERCENTILE = 0.02      # ตัด bbox ผิดปกติที่ขอบ 2% ออก
+AUTO_ROI_FULL_FRAME_EVERY = 20  # ตรวจทั้งเฟรมทุกๆ N เฟรม เพื่อให้ ROI ยังเรียนรู้ต่อได้
+
+
+def _percentile(values, q):
+    """Percentile แบบง่ายโดยไม่ต้องใช้ numpy"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class CameraSettings:
+    def __init__(self, config_path=CAMERA_CONFIG_PATH):
+        """
+        Per-source ROI / imgsz settings with auto ROI learning
+
+        Args:
+            config_path: JSON file with settings per source
+        """
+        self.config_path = config_path
+        self.settings = {}
+        self.history = {}       # source -> deque of normalized bboxes
+        self.frame_counts = {}  # source -> frames seen (สำหรับ full-frame exploration)
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Load settings from the JSON config file (if present)"""
+        if not os.path.exists(self.config_path):
+            return
+        try:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                self.settings = json.load(f)
+            logger.info(f"📷 Camera settings loaded for: {', '.join(self.settings) or '-'}")
+        except Exception as e:
+            logger.error(f"❌ Failed to load camera settings: {e}")
+
+    def get(self, source):
+        """
+        Get merged settings for a source
+
+        Returns:
+            dict: Settings with defaults filled in
+        """
+        merged = dict(DEFAULT_CAMERA_SETTINGS)
+        merged.update(self.settings.get(source or 'unknown', {}))
+        return merged
+
+    def learned_roi(self, source):
+        """
+        ROI learned from bbox history as fractions of the frame
+
+        Returns:
+            [x1, y1, x2, y2] fractions or None if not enough samples
+        """
+        with self._lock:
+            boxes = list(self.history.get(source, ()))
+        if len(boxes) < AUTO_ROI_MIN_SAMPLES:
+            return None
+
+        x1 = _percentile([b[0] for b in boxes], AUTO_ROI_PERCENTILE) - AUTO_ROI_MARGIN
+        y1 = _percentile([b[1] for b in boxes], AUTO_ROI_PERCENTILE) - AUTO_ROI_MARGIN
+        x2 = _percentile([b[2] for b in boxes], 1 - AUTO_ROI_PERCENTILE) + AUTO_ROI_MARGIN
+        y2 = _percentile([b[3] for b in boxes], 1 - AUTO_ROI_PERCENTILE) + AUTO_ROI_MARGIN
+        return [max(0.0, x1), max(0.0, y1), min(1.0, x2), min(1.0, y2)]
+
+    def resolve_roi(self, source, frame_shape):
+        """
+        Pixel ROI to run detection on for this frame
+
+        Args:
+            source: Camera source name
+            frame_shape: image.shape of the full frame
+
+        Returns:
+            (x1, y1, x2, y2) pixels or None for the whole frame
+        """
+        settings = self.get(source)
+        roi = settings.get('roi')
+
+        if roi is None and settings.get('auto_roi'):
+            with self._lock:
+                count = self.frame_counts.get(source, 0) + 1
+                self.frame_counts[source] = count
+            if count % AUTO_ROI_FULL_FRAME_EVERY != 0:
+                roi = self.learned_roi(source)
+
+        if not roi:
+            return None
+
+        h, w = frame_shape[:2]
+        if all(0 <= v <= 1 for v in roi):
+            x1, y1, x2, y2 = roi[0] * w, roi[1] * h, roi[2] * w, roi[3] * h
+        else:
+            x1, y1, x2, y2 = roi
+
+        x1, y1 = max(0, int(x1)), max(0, int(y1))
+        x2, y2 = min(w, int(x2)), min(h, int(y2))
+        if x2 - x1 < 32 or y2 - y1 < 32:
+            return None
+        return x1, y1, x2, y2
+
+    def record_detection(self, source, bbox, frame_shape):
+        """
+        Add a full-frame bbox to the source history for auto ROI
+
+        Args:
+            source: Camera source name
+            bbox: [x1, y1, x2, y2] in full-frame pixels
+            frame_shape: image.shape of the full frame
+        """
+        if not self.get(source).get('auto_roi'):
+            return
+        h, w = frame_shape[:2]
+        normalized = (bbox[0] / w, bbox[1] / h, bbox[2] / w, bbox[3] / h)
+        with self._lock:
+            self.history.setdefault(source, deque(maxlen=AUTO_ROI_HISTORY)).append(normalized)
+
+    def status(self):
+        """
+        Current settings and learned ROI per source
+
+        Returns:
+            dict: source -> settings summary
+        """
+        sources = set(self.settings) | set(self.history)
+        return {
+            source: {
+                **self.get(source),
+                'learned_roi': self.learned_roi(source),
+                'samples': len(self.history.get(source, ()))
+            }
+            for source in sorted(sources)
+        }
+
+
+# Global camera settings instance
+camera_settings = CameraSettings()
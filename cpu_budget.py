@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+========================================
+🧮 CPU thread budget for workers
+========================================
+
+torch (OpenMP / MKL), OpenCV and ONNX Runtime each start a thread pool
+sized to every core of the machine, in every gunicorn worker. With N
+workers that is N x cores threads competing for the CPU, and a frame's
+latency depends on how many other workers happen to be inferring.
+
+The budget is planned once per process from the CPUs this container may
+actually use (affinity mask and cgroup CPU quota) divided by the number
+of processes that run inference, then applied to every library:
+
+- latency (default): one frame at a time per worker, using all of the
+  worker's share of cores (torch intra-op, ONNX Runtime and OpenCV).
+- throughput: several frames in flight per worker with ~2 threads each
+  (ONNX engine) and single-threaded OpenCV, so frames from concurrent
+  requests run side by side instead of time-slicing one big pool.
+
+With INFERENCE_SERVER=1 the server process owns every core for the model
+and web workers only keep threads for OpenCV decode / crop / encode.
+
+    python cpu_budget.py --workers 4 --profile throughput
+"""
+
+import os
+import math
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROFILE_LATENCY = 'latency'
+PROFILE_THROUGHPUT = 'throughput'
+PROFILES = (PROFILE_LATENCY, PROFILE_THROUGHPUT)
+
+CPU_PROFILE = os.environ.get('CPU_PROFILE', PROFILE_LATENCY)
+# กำหนดจำนวน core ที่ใช้ได้เอง (ค่าว่าง = ตรวจจาก affinity / cgroup quota)
+CPU_LIMIT = os.environ.get('CPU_LIMIT', '')
+# โหมด throughput: thread ต่อเฟรมที่รันพร้อมกัน
+THROUGHPUT_THREADS_PER_FRAME = 2
+
+# library ที่อ่านจำนวน thread จาก environment ตอน import (ต้องตั้งก่อน import torch / numpy)
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+def _read_first_line(path):
+    try:
+        with open(path, 'r') as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_quota():
+    """
+    CPU quota of this container in cores
+
+    Reads cgroup v2 ``cpu.max`` or cgroup v1 ``cpu.cfs_quota_us`` /
+    ``cpu.cfs_period_us``.
+
+    Returns:
+        float or None when there is no quota
+    """
+    line = _read_first_line('/sys/fs/cgroup/cpu.max')
+    if line:
+        quota, _, period = line.partition(' ')
+        if quota != 'max' and period:
+            return int(quota) / int(period)
+        return None
+
+    for folder in ('/sys/fs/cgroup/cpu', '/sys/fs/cgroup/cpu,cpuacct'):
+        quota = _read_first_line(os.path.join(folder, 'cpu.cfs_quota_us'))
+        period = _read_first_line(os.path.join(folder, 'cpu.cfs_period_us'))
+        if quota and period and int(quota) > 0:
+            return int(quota) / int(period)
+    return None
+
+
+def detect_cpus():
+    """
+    CPUs this process can use
+
+    Returns:
+        dict: online cores, affinity mask size, cgroup quota and the
+              effective core count (the smallest of them, at least 1)
+    """
+    online = os.cpu_count() or 1
+    try:
+        affinity = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        affinity = online
+    quota = cgroup_cpu_quota()
+
+    effective = affinity
+    if quota is not None:
+        # quota 1.5 core -> 1 thread: ปัดลงเพื่อไม่ให้โดน CFS throttle กลาง inference
+        effective = min(effective, max(1, math.floor(quota)))
+    if CPU_LIMIT:
+        effective = min(effective, int(CPU_LIMIT))
+    return {
+        'online': online,
+        'affinity': affinity,
+        'quota': round(quota, 2) if quota is not None else None,
+        'effective': max(1, effective)
+    }
+
+
+def plan_budget(cpus, workers=1, profile=CPU_PROFILE, engine='pytorch', inference_server=False,
+                role='worker'):
+    """
+    Thread counts for one process
+
+    Args:
+        cpus: Effective cores of the machine / container
+        workers: Gunicorn worker processes
+        profile: 'latency' or 'throughput'
+        engine: Detection engine of the workers ('pytorch', 'onnx', 'remote')
+        inference_server: Inference runs in the shared inference server
+        role: 'worker' (gunicorn worker) or 'inference' (the inference server)
+
+    Returns:
+        dict: intra_op / inter_op threads, OpenCV threads and frames in flight
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown CPU profile: {profile} (use {' / '.join(PROFILES)})")
+    workers = max(1, int(workers))
+
+    if role == 'inference' or not inference_server:
+        # process ที่รัน YOLO: inference server ได้ทุก core, worker ได้ส่วนแบ่งของตัวเอง
+        share = cpus if role == 'inference' else max(1, cpus // workers)
+        frames = 1
+        if profile == PROFILE_THROUGHPUT and engine == 'onnx' and role != 'inference':
+            # ONNX session.run() thread-safe: รันหลายเฟรมพร้อมกัน เฟรมละไม่กี่ thread
+            # (inference server รันทีละเฟรมอยู่แล้ว)
+            frames = max(1, share // THROUGHPUT_THREADS_PER_FRAME)
+        intra = max(1, share // frames)
+    else:
+        # worker ฝั่ง web เมื่อโมเดลอยู่ใน inference server: แค่ decode / crop / encode
+        share = max(1, cpus // workers)
+        frames = share
+        intra = 1
+
+    return {
+        'profile': profile,
+        'role': role,
+        'workers': workers,
+        'cores_per_process': share,
+        'intra_op_threads': intra,
+        'inter_op_threads': 1,
+        'opencv_threads': share if profile == PROFILE_LATENCY else 1,
+        'frames_in_flight': frames
+    }
+
+
+class CpuBudget:
+    def __init__(self, profile=CPU_PROFILE):
+        """
+        Args:
+            profile: 'latency' or 'throughput'
+        """
+        self.profile = profile
+        self.workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+        self.role = 'worker'
+        self.cpus = detect_cpus()
+        self.applied = {}
+        self._lock = threading.Lock()
+
+    def configure(self, workers=None, role=None):
+        """Set the worker count / role before apply() (called from gunicorn post_fork)"""
+        if workers is not None:
+            self.workers = workers
+        if role is not None:
+            self.role = role
+
+    def plan(self):
+        if self.role == 'inference':
+            from inference_server import INFERENCE_ENGINE as engine
+        else:
+            from detection_engine import DETECTION_ENGINE as engine
+        return plan_budget(self.cpus['effective'], self.workers, self.profile, engine,
+                           inference_server=engine == 'remote', role=self.role)
+
+    def apply_environment(self):
+        """
+        Export OMP / MKL / OpenBLAS thread counts
+
+        Must run before torch / numpy are imported (gunicorn.conf.py, before
+        the app is preloaded); values set by the operator are kept.
+        """
+        budget = self.plan()
+        for name in THREAD_ENV_VARS:
+            os.environ.setdefault(name, str(budget['intra_op_threads']))
+        return budget
+
+    def apply(self):
+        """
+        Apply the budget to torch and OpenCV if they are imported
+
+        Called again once the model is loaded, since torch and cv2 are
+        imported lazily (until then they start from OMP_NUM_THREADS).
+
+        Returns:
+            dict: The budget with the values that were applied
+        """
+        with self._lock:
+            budget = self.plan()
+            applied = dict(budget)
+
+            import sys
+            torch = sys.modules.get('torch')
+            if torch is not None:
+                torch.set_num_threads(budget['intra_op_threads'])
+                try:
+                    torch.set_num_interop_threads(budget['inter_op_threads'])
+                except RuntimeError:
+                    # ตั้งได้ครั้งเดียวก่อนเริ่มงาน inter-op ครั้งแรก (เช่นถูก warm-up ใน master แล้ว)
+                    pass
+                applied['torch'] = {'intra_op': torch.get_num_threads(),
+                                    'inter_op': torch.get_num_interop_threads()}
+
+            cv2 = sys.modules.get('cv2')
+            if cv2 is not None:
+                cv2.setNumThreads(budget['opencv_threads'])
+                applied['opencv'] = cv2.getNumThreads()
+
+            applied['env'] = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+            self.applied = applied
+            logger.info("🧮 CPU budget applied", extra={'cpus': self.cpus, 'budget': applied})
+            return applied
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'cpus': self.cpus,
+            'applied': self.applied or None
+        }
+
+
+# Global CPU budget instance
+cpu_budget = CpuBudget()
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Show the CPU thread budget per process')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', '1')))
+    parser.add_argument('--profile', choices=PROFILES, default=CPU_PROFILE)
+    parser.add_argument('--engine', default=os.environ.get('DETECTION_ENGINE', 'pytorch'))
+    parser.add_argument('--inference-server', action='store_true',
+                        default=os.environ.get('INFERENCE_SERVER') == '1')
+    args = parser.parse_args()
+
+    cpus = detect_cpus()
+    engine = 'remote' if args.inference_server else args.engine
+    report = {
+        'cpus': cpus,
+        'worker': plan_budget(cpus['effective'], args.workers, args.profile, engine,
+                              inference_server=args.inference_server)
+    }
+    if args.inference_server:
+        report['inference_server'] = plan_budget(cpus['effective'], 1, args.profile,
+                                                 os.environ.get('INFERENCE_ENGINE', args.engine),
+                                                 role='inference')
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,152 @@
+"""
+========================================
+📦 Adaptive crop encoding for OCR upload
+========================================
+
+Plate crops are resized so the characters are about
+CROP_TARGET_CHAR_HEIGHT pixels tall (more pixels do not help the OCR),
+then encoded in memory at the smallest JPEG (or WebP) quality whose
+decoded image stays above a fidelity floor (PSNR against the resized
+crop). The floor is the knob that keeps OCR accuracy: raise it if reads
+get worse, lower it to save bandwidth on slow links.
+"""
+
+import os
+
+# ความสูงตัวอักษรเป้าหมาย (pixel) และสัดส่วนความสูงตัวอักษรต่อความสูงของภาพป้าย (รวม padding)
+CROP_TARGET_CHAR_HEIGHT = int(os.environ.get('CROP_TARGET_CHAR_HEIGHT', '32'))
+CHAR_HEIGHT_RATIO = 0.4
+
+# PSNR ขั้นต่ำ (dB) ของภาพหลัง encode เทียบกับภาพก่อน encode
+CROP_MIN_PSNR = float(os.environ.get('CROP_MIN_PSNR', '34'))
+
+# รูปแบบที่อนุญาต (AIforThai รับ JPEG เสมอ; เปิด webp เมื่อ OCR backend รองรับ)
+CROP_ENCODING_FORMATS = [f.strip() for f in os.environ.get('CROP_ENCODING_FORMATS', 'jpeg').split(',') if f.strip()]
+
+# ลองจากคุณภาพต่ำไปสูง ใช้ค่าแรกที่ผ่านเกณฑ์
+QUALITY_LADDER = (40, 55, 70, 85, 95)
+
+MIME_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp'}
+
+
+class EncodedCrop:
+    def __init__(self, data, fmt, quality, size, psnr):
+        """
+        Args:
+            data: Encoded bytes
+            fmt: 'jpeg' or 'webp'
+            quality: Encoder quality used
+            size: (width, height) after resizing
+            psnr: PSNR of the decoded bytes against the resized crop
+        """
+        self.data = data
+        self.format = fmt
+        self.quality = quality
+        self.size = size
+        self.psnr = psnr
+
+    @property
+    def mime_type(self):
+        return MIME_TYPES[self.format]
+
+    @property
+    def extension(self):
+        return EXTENSIONS[self.format]
+
+    def info(self):
+        """ข้อมูลการ encode สำหรับใส่ใน response"""
+        return {
+            'format': self.format,
+            'quality': self.quality,
+            'bytes': len(self.data),
+            'width': self.size[0],
+            'height': self.size[1],
+            'psnr': round(self.psnr, 1)
+        }
+
+
+def resize_for_ocr(crop, target_char_height=CROP_TARGET_CHAR_HEIGHT):
+    """
+    Downscale a crop so the characters are about target_char_height tall
+
+    Crops that are already smaller are returned unchanged; upscaling adds
+    bytes without adding detail.
+    """
+    import cv2
+
+    target_height = int(round(target_char_height / CHAR_HEIGHT_RATIO))
+    h, w = crop.shape[:2]
+    if h <= target_height:
+        return crop
+    width = max(1, int(round(w * target_height / h)))
+    return cv2.resize(crop, (width, target_height), interpolation=cv2.INTER_AREA)
+
+
+def _encode(image, fmt, quality):
+    import cv2
+
+    try:
+        if fmt == 'webp':
+            ok, buffer = cv2.imencode('.webp', image, [cv2.IMWRITE_WEBP_QUALITY, quality])
+        else:
+            ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality,
+                                                      cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+    except cv2.error:
+        return None
+    return buffer.tobytes() if ok else None
+
+
+def _psnr(reference, data):
+    import cv2
+    import numpy as np
+
+    decoded = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if decoded is None or decoded.shape != reference.shape:
+        return 0.0
+    return float(cv2.PSNR(reference, decoded))
+
+
+def encode_crop(crop, formats=None, min_psnr=CROP_MIN_PSNR, target_char_height=CROP_TARGET_CHAR_HEIGHT):
+    """
+    Resize and encode a crop into the smallest payload above the fidelity floor
+
+    Args:
+        crop: BGR numpy array
+        formats: Formats to try (default CROP_ENCODING_FORMATS)
+        min_psnr: Fidelity floor in dB
+        target_char_height: Character height to resize to
+
+    Returns:
+        EncodedCrop or None if encoding failed
+    """
+    image = resize_for_ocr(crop, target_char_height)
+    size = (image.shape[1], image.shape[0])
+
+    def rank(encoded):
+        # ผ่านเกณฑ์ก่อน แล้วจึงเลือกขนาดเล็กสุด
+        return (encoded.psnr < min_psnr, len(encoded.data))
+
+    best = None
+    for fmt in formats or CROP_ENCODING_FORMATS:
+        if fmt not in MIME_TYPES:
+            continue
+        candidate = None
+        for quality in QUALITY_LADDER:
+            data = _encode(image, fmt, quality)
+            if data is None:
+                break
+            candidate = EncodedCrop(data, fmt, quality, size, _psnr(image, data))
+            if candidate.psnr >= min_psnr:
+                break
+        # ถ้าไม่มีคุณภาพไหนผ่านเกณฑ์ candidate คือคุณภาพสูงสุดของรูปแบบนี้
+        if candidate is not None and (best is None or rank(candidate) < rank(best)):
+            best = candidate
+
+    if best is None:
+        # รูปแบบที่ตั้งค่าไว้ใช้ไม่ได้ทั้งหมด (เช่น OpenCV build ไม่มี WebP) กลับไปใช้ JPEG
+        data = _encode(image, 'jpeg', QUALITY_LADDER[-1])
+        if data is None:
+            return None
+        best = EncodedCrop(data, 'jpeg', QUALITY_LADDER[-1], size, _psnr(image, data))
+    return best
@@ -0,0 +1,97 @@
+"""
+========================================
+⏳ Per-request deadline budget
+========================================
+
+The client says how long it is willing to wait (header
+``X-Request-Deadline-Ms``, query parameter or form field ``deadline_ms``), capped by the
+server. Each pipeline stage checks the remaining budget so a worker stops
+spending time on responses nobody is waiting for.
+"""
+
+import os
+import time
+
+DEADLINE_HEADER = 'X-Request-Deadline-Ms'
+DEADLINE_FORM_FIELD = 'deadline_ms'
+
+# งบเวลาสูงสุดที่ server ยอมให้ และค่าเริ่มต้นเมื่อ client ไม่ได้ส่งมา
+MAX_REQUEST_BUDGET_MS = int(os.environ.get('MAX_REQUEST_BUDGET_MS', '20000'))
+DEFAULT_REQUEST_BUDGET_MS = int(os.environ.get('DEFAULT_REQUEST_BUDGET_MS', '20000'))
+
+# ถ้าเหลือเวลาน้อยกว่านี้ ไม่ต้องเรียก OCR (AIforThai ใช้เวลาราว 1 วินาที)
+MIN_OCR_BUDGET_MS = int(os.environ.get('MIN_OCR_BUDGET_MS', '1000'))
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage starts after the request budget is spent"""
+
+    def __init__(self, stage):
+        super().__init__(f"Deadline exceeded before {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    def __init__(self, budget_ms):
+        """
+        Args:
+            budget_ms: Time budget in milliseconds from now
+        """
+        self.budget_ms = budget_ms
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget_ms / 1000.0
+
+    @classmethod
+    def from_request(cls, request):
+        """
+        Build a deadline from the request header / query / form field, capped by the server
+
+        Returns:
+            Deadline
+        """
+        value = request.headers.get(DEADLINE_HEADER) or request.args.get(DEADLINE_FORM_FIELD)
+        if not value and request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+            value = request.form.get(DEADLINE_FORM_FIELD)
+        try:
+            budget_ms = int(float(value)) if value else DEFAULT_REQUEST_BUDGET_MS
+        except (ValueError, OverflowError):
+            # ค่าที่ไม่ใช่ตัวเลข / nan (ValueError) หรือ inf, 1e400 (OverflowError) ใช้ค่าเริ่มต้น
+            budget_ms = DEFAULT_REQUEST_BUDGET_MS
+        return cls(max(0, min(budget_ms, MAX_REQUEST_BUDGET_MS)))
+
+    def remaining(self):
+        """Remaining budget in seconds (never negative)"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def remaining_ms(self):
+        """Remaining budget in milliseconds"""
+        return int(self.remaining() * 1000)
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage):
+        """
+        Abandon work if the deadline has passed
+
+        Raises:
+            DeadlineExceeded
+        """
+        if self.expired():
+            raise DeadlineExceeded(stage)
+
+    def timeout_for(self, max_timeout):
+        """
+        Shrink a stage timeout to the remaining budget
+
+        Args:
+            max_timeout: Stage's own timeout in seconds
+
+        Returns:
+            float: Timeout in seconds
+        """
+        return min(max_timeout, self.remaining())
+
+    def allows_ocr(self):
+        """มีเวลาเหลือพอสำหรับเรียก OCR หรือไม่"""
+        return self.remaining_ms() >= MIN_OCR_BUDGET_MS
@@ -0,0 +1,345 @@
+"""
+========================================
+🧊 Cold archive of old detections
+========================================
+
+Detections older than ARCHIVE_AFTER_DAYS are moved out of the hot
+``license_plate_detections`` node into one compressed NumPy ``.npz`` file
+per day (``detection_archive/YYYY/MM/YYYY-MM-DD.npz``). Each column is a
+separate array; repetitive text columns (plate, province, region, mode,
+source) are dictionary-encoded as int32 codes plus a small dictionary.
+
+Queries open only the partitions inside the date range and, because an
+``.npz`` member is decompressed only when accessed, only the columns
+needed for filtering and output (column pruning). Filters on dictionary
+columns are evaluated on the dictionary first, so a partition that
+cannot match is skipped without reading its codes.
+
+NumPy is imported on first use so importing the app does not pay for it.
+
+Run the archival job from cron::
+
+    python detection_archive.py run --days 30
+"""
+
+import os
+import glob
+import argparse
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FOLDER = os.environ.get('ARCHIVE_FOLDER', 'detection_archive')
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '30'))
+
+# คอลัมน์ที่เก็บในไฟล์ archive แยกตามชนิดข้อมูล (field อื่นของ record ไม่ถูกเก็บ)
+DICT_COLUMNS = ['license_plate', 'province', 'region', 'detection_mode', 'source']
+FLOAT_COLUMNS = ['confidence_api', 'confidence_yolo', 'province_confidence']
+INT_COLUMNS = ['hit_count']
+TIME_COLUMNS = ['timestamp', 'last_seen']  # epoch milliseconds
+ALL_COLUMNS = ['id'] + TIME_COLUMNS + DICT_COLUMNS + FLOAT_COLUMNS + INT_COLUMNS
+
+
+def _epoch_ms(value):
+    """ISO timestamp -> epoch milliseconds (0 ถ้าอ่านไม่ได้)"""
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _iso(epoch_ms):
+    return datetime.fromtimestamp(epoch_ms / 1000).isoformat() if epoch_ms else None
+
+
+def _dict_encode(values):
+    """
+    Dictionary-encode strings
+
+    Returns:
+        tuple: (codes int32 array, dictionary unicode array); None -> ''
+    """
+    import numpy as np
+
+    dictionary, codes = np.unique(np.array([v or '' for v in values], dtype=str), return_inverse=True)
+    return codes.astype(np.int32), dictionary
+
+
+def _encode_columns(records):
+    """แปลง list ของ record เป็น arrays สำหรับ np.savez"""
+    import numpy as np
+
+    arrays = {'id': np.array([r['id'] for r in records], dtype=str)}
+    for column in TIME_COLUMNS:
+        arrays[column] = np.array([_epoch_ms(r.get(column)) for r in records], dtype=np.int64)
+    for column in DICT_COLUMNS:
+        arrays[f"{column}__codes"], arrays[f"{column}__dict"] = _dict_encode([r.get(column) for r in records])
+    for column in FLOAT_COLUMNS:
+        arrays[column] = np.array([r[column] if r.get(column) is not None else np.nan for r in records],
+                                  dtype=np.float32)
+    for column in INT_COLUMNS:
+        arrays[column] = np.array([r.get(column) or 1 for r in records], dtype=np.int32)
+    return arrays
+
+
+def _decode_records(npz, columns):
+    """อ่านทุก record ของ partition กลับเป็น dict (ใช้ตอน merge partition เดิม)"""
+    n = len(npz['id'])
+    records = [{} for _ in range(n)]
+    for column in columns:
+        values = _column_values(npz, column)
+        for record, value in zip(records, values):
+            record[column] = value
+    return records
+
+
+def _column_values(npz, column, index=None):
+    """ค่าของคอลัมน์ (เฉพาะแถวใน index) เป็น list ของ Python values โดยอ่านเฉพาะ array ของคอลัมน์นี้"""
+    import numpy as np
+
+    if column in DICT_COLUMNS:
+        codes = npz[f"{column}__codes"]
+        values = npz[f"{column}__dict"][codes if index is None else codes[index]]
+        return [v or None for v in values.tolist()]
+    values = npz[column] if index is None else npz[column][index]
+    if column in TIME_COLUMNS:
+        return [_iso(v) for v in values.tolist()]
+    if column in FLOAT_COLUMNS:
+        return [None if np.isnan(v) else round(float(v), 4) for v in values]
+    return values.tolist()
+
+
+class DetectionArchive:
+    def __init__(self, folder=ARCHIVE_FOLDER):
+        """
+        Args:
+            folder: Root directory of the date-partitioned archive
+        """
+        self.folder = folder
+
+    def _partition_path(self, day):
+        return os.path.join(self.folder, day[:4], day[5:7], f"{day}.npz")
+
+    def partitions(self, start_date=None, end_date=None):
+        """
+        Partition files within a date range (inclusive, 'YYYY-MM-DD')
+
+        Returns:
+            list: [(day, path), ...] sorted by day
+        """
+        found = []
+        for path in glob.glob(os.path.join(self.folder, '*', '*', '*.npz')):
+            day = os.path.basename(path)[:-4]
+            if (start_date and day < start_date) or (end_date and day > end_date):
+                continue
+            found.append((day, path))
+        return sorted(found)
+
+    def write(self, records):
+        """
+        Append records to their day partitions
+
+        Records already archived (same id) are not duplicated, so a run
+        interrupted before deleting from Firebase can simply be repeated.
+        Records without a usable timestamp have no partition and are skipped.
+
+        Args:
+            records: Detection dicts including 'id' and 'timestamp'
+
+        Returns:
+            list: Ids of the records that are now in the archive (newly
+                  written or already there); only these may be deleted
+        """
+        import numpy as np
+
+        by_day = {}
+        for record in records:
+            day = (record.get('timestamp') or '')[:10]
+            if len(day) == 10:
+                by_day.setdefault(day, []).append(record)
+
+        persisted = []
+        for day, day_records in by_day.items():
+            path = self._partition_path(day)
+            if os.path.exists(path):
+                with np.load(path, allow_pickle=False) as npz:
+                    existing = _decode_records(npz, ALL_COLUMNS)
+                known = {r['id'] for r in existing}
+                persisted.extend(r['id'] for r in day_records if r['id'] in known)
+                day_records = [r for r in day_records if r['id'] not in known]
+                if not day_records:
+                    continue
+                merged = existing + day_records
+            else:
+                merged = day_records
+
+            merged.sort(key=lambda r: r.get('timestamp') or '')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+            np.savez_compressed(tmp_path, **_encode_columns(merged))
+            os.replace(tmp_path, path)
+            persisted.extend(r['id'] for r in day_records)
+            logger.info(f"🧊 Archived {len(day_records)} detections to {path}")
+        return persisted
+
+    def query(self, start_date=None, end_date=None, columns=None, license_plate=None,
+              province=None, source=None, detection_mode=None, limit=None):
+        """
+        Read archived detections with partition and column pruning
+
+        Args:
+            start_date / end_date: 'YYYY-MM-DD' (inclusive)
+            columns: Columns to return (default: all)
+            license_plate: Substring match on the plate
+            province / source / detection_mode: Exact match
+            limit: Maximum number of records (newest partitions first)
+
+        Returns:
+            list: Detection dicts with only the requested columns
+        """
+        import numpy as np
+
+        columns = [c for c in (columns or ALL_COLUMNS) if c in ALL_COLUMNS]
+        equals = {'province': province, 'source': source, 'detection_mode': detection_mode}
+        results = []
+
+        for day, path in reversed(self.partitions(start_date, end_date)):
+            with np.load(path, allow_pickle=False) as npz:
+                mask = None
+                skip = False
+                for column, wanted in equals.items():
+                    if not wanted:
+                        continue
+                    matches = np.flatnonzero(npz[f"{column}__dict"] == wanted)
+                    if matches.size == 0:
+                        skip = True  # ค่าไม่อยู่ใน dictionary: partition นี้ไม่มีทางตรง
+                        break
+                    column_mask = npz[f"{column}__codes"] == matches[0]
+                    mask = column_mask if mask is None else mask & column_mask
+                if not skip and license_plate:
+                    dictionary = npz['license_plate__dict']
+                    matches = np.flatnonzero(np.char.find(np.char.lower(dictionary), license_plate.lower()) >= 0)
+                    if matches.size == 0:
+                        skip = True
+                    else:
+                        column_mask = np.isin(npz['license_plate__codes'], matches)
+                        mask = column_mask if mask is None else mask & column_mask
+                if skip or (mask is not None and not mask.any()):
+                    continue
+
+                # newest first ภายใน partition
+                index = np.arange(len(npz['timestamp'])) if mask is None else np.flatnonzero(mask)
+                index = index[np.argsort(npz['timestamp'][index], kind='stable')[::-1]]
+                if limit is not None:
+                    index = index[:limit - len(results)]
+                values = {column: _column_values(npz, column, index) for column in columns}
+                results.extend(dict(zip(columns, row)) for row in zip(*(values[c] for c in columns)))
+
+            if limit is not None and len(results) >= limit:
+                break
+        return results
+
+    def count_by(self, column, start_date=None, end_date=None):
+        """
+        Count archived detections grouped by a dictionary column
+
+        Only the codes and dictionary of that column are read.
+
+        Returns:
+            dict: value -> count
+        """
+        import numpy as np
+
+        if column not in DICT_COLUMNS:
+            raise ValueError(f"count_by supports {', '.join(DICT_COLUMNS)}")
+        counts = {}
+        for day, path in self.partitions(start_date, end_date):
+            with np.load(path, allow_pickle=False) as npz:
+                dictionary = npz[f"{column}__dict"]
+                for value, count in zip(dictionary.tolist(),
+                                        np.bincount(npz[f"{column}__codes"], minlength=len(dictionary)).tolist()):
+                    if count:
+                        key = value or 'ไม่ระบุ'
+                        counts[key] = counts.get(key, 0) + count
+        return counts
+
+    def status(self):
+        """Partition count, date range and size on disk"""
+        partitions = self.partitions()
+        return {
+            'partitions': len(partitions),
+            'first_day': partitions[0][0] if partitions else None,
+            'last_day': partitions[-1][0] if partitions else None,
+            'bytes': sum(os.path.getsize(path) for _, path in partitions)
+        }
+
+
+def archive_old_detections(manager, archive, older_than_days=ARCHIVE_AFTER_DAYS):
+    """
+    Move detections older than the cutoff from Firebase into the archive
+
+    Records are written to the archive first and only the ones the archive
+    holds are then deleted from the hot node.
+
+    Args:
+        manager: FirebaseManager
+        archive: DetectionArchive
+        older_than_days: Age in days after which records are archived
+
+    Returns:
+        dict: Summary (cutoff, fetched, archived, skipped, deleted)
+    """
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+    records = manager.get_detections_before(cutoff)
+    archived_ids = archive.write(records) if records else []
+    # ลบเฉพาะ record ที่อยู่ใน archive แล้ว record ที่ถูกข้าม (ไม่มี timestamp) ยังอยู่ใน Firebase
+    deleted = manager.delete_detections(archived_ids) if archived_ids else 0
+    summary = {'cutoff': cutoff, 'fetched': len(records), 'archived': len(archived_ids),
+               'skipped': len(records) - len(archived_ids), 'deleted': deleted}
+    logger.info(f"🧊 Archive run: {summary}")
+    return summary
+
+
+# Global archive instance
+detection_archive = DetectionArchive()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Detection cold archive')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Move old detections from Firebase to the archive')
+    run_parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS, help='Archive records older than this')
+
+    query_parser = subparsers.add_parser('query', help='Query archived detections')
+    query_parser.add_argument('--start', help='Start date YYYY-MM-DD')
+    query_parser.add_argument('--end', help='End date YYYY-MM-DD')
+    query_parser.add_argument('--columns', help='Comma separated columns')
+    query_parser.add_argument('--plate', help='License plate substring')
+    query_parser.add_argument('--province', help='Province')
+    query_parser.add_argument('--limit', type=int, default=20)
+
+    count_parser = subparsers.add_parser('count', help='Count archived detections by a column')
+    count_parser.add_argument('column', choices=DICT_COLUMNS)
+    count_parser.add_argument('--start', help='Start date YYYY-MM-DD')
+    count_parser.add_argument('--end', help='End date YYYY-MM-DD')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        from firebase_config import firebase_manager
+        print(archive_old_detections(firebase_manager, detection_archive, args.days))
+    elif args.command == 'query':
+        columns = args.columns.split(',') if args.columns else None
+        for record in detection_archive.query(args.start, args.end, columns, args.plate,
+                                              args.province, limit=args.limit):
+            print(record)
+    else:
+        for value, count in sorted(detection_archive.count_by(args.column, args.start, args.end).items(),
+                                   key=lambda item: -item[1]):
+            print(f"{value}\t{count}")
+
+
+if __name__ == '__main__':
+    main()
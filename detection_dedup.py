@@ -0,0 +1,155 @@
+"""
+========================================
+🔁 Detection write deduplication
+========================================
+
+A car idling at the gate is recognized on every frame. Within
+DETECTION_DEDUP_WINDOW seconds of the last sighting, the same normalized
+plate from the same source updates ``last_seen`` / ``hit_count`` of the
+record already written instead of pushing a new one.
+
+The window state is kept in small files (one per source + plate) guarded
+by ``flock`` so every gunicorn worker sees the same sightings.
+"""
+
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# หน้าต่างเวลา (วินาที) นับจากครั้งล่าสุดที่เห็นป้ายนี้ 0 = ปิดการ dedup
+DETECTION_DEDUP_WINDOW = float(os.environ.get('DETECTION_DEDUP_WINDOW', '60'))
+DETECTION_DEDUP_FOLDER = os.environ.get('DETECTION_DEDUP_FOLDER', '/tmp/lpr_dedup')
+
+_THAI_DIGITS = str.maketrans('๐๑๒๓๔๕๖๗๘๙', '0123456789')
+_PLATE_SEPARATORS = re.compile(r'[\s\-\.·]+')
+
+
+def normalize_plate(license_plate):
+    """
+    Canonical form of a plate for comparison
+
+    Removes spaces / separators, converts Thai digits and upper-cases
+    Latin letters, e.g. "1กก-๒๓๔๕" and "1กก 2345" both become "1กก2345".
+    """
+    return _PLATE_SEPARATORS.sub('', (license_plate or '').translate(_THAI_DIGITS)).upper()
+
+
+class Sighting:
+    """สถานะของป้ายหนึ่งป้ายจากกล้องหนึ่งตัวภายในหน้าต่างเวลา"""
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.doc_id = data.get('doc_id')
+        self.last_seen = data.get('last_seen', 0.0)
+        self.hit_count = data.get('hit_count', 0)
+        self.best_confidence = data.get('best_confidence', 0.0)
+
+    def is_active(self, now, window):
+        """ยังอยู่ในหน้าต่างเวลาและมี record ให้อัปเดตหรือไม่"""
+        return self.doc_id is not None and now - self.last_seen <= window
+
+    def start(self, doc_id, now, confidence):
+        """เริ่มหน้าต่างใหม่หลังจาก push record ใหม่"""
+        self.doc_id = doc_id
+        self.last_seen = now
+        self.hit_count = 1
+        self.best_confidence = confidence or 0.0
+
+    def hit(self, now, confidence):
+        """นับการเห็นซ้ำ คืนค่า True ถ้า confidence ดีกว่าเดิม"""
+        self.last_seen = now
+        self.hit_count += 1
+        improved = (confidence or 0.0) > self.best_confidence
+        if improved:
+            self.best_confidence = confidence
+        return improved
+
+    def to_dict(self):
+        return {
+            'doc_id': self.doc_id,
+            'last_seen': self.last_seen,
+            'hit_count': self.hit_count,
+            'best_confidence': self.best_confidence
+        }
+
+
+class DetectionDeduper:
+    def __init__(self, window=DETECTION_DEDUP_WINDOW, folder=DETECTION_DEDUP_FOLDER):
+        """
+        Args:
+            window: Dedup window in seconds since the last sighting (0 disables)
+            folder: Directory for the shared sighting files
+        """
+        self.window = window
+        self.folder = folder
+        self._last_purge = time.time()
+        os.makedirs(folder, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def _path(self, source, normalized_plate):
+        digest = hashlib.sha256(f"{source}\x00{normalized_plate}".encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.folder, f"{digest}.json")
+
+    @contextmanager
+    def sighting(self, source, license_plate):
+        """
+        Lock and yield the sighting for (source, plate); changes are saved on exit
+
+        Usage:
+            with deduper.sighting(source, plate) as sighting:
+                if sighting.is_active(now, deduper.window):
+                    ...update existing record...
+                else:
+                    ...push new record...
+                    sighting.start(doc_id, now, confidence)
+        """
+        # ล้างไฟล์ของป้ายที่หมดหน้าต่างแล้วเป็นระยะ ไม่ต้องมี background thread
+        if time.time() - self._last_purge > max(self.window, 60) * 10:
+            self._last_purge = time.time()
+            self.purge()
+
+        path = self._path(source or 'unknown', normalize_plate(license_plate))
+        with open(path, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                try:
+                    sighting = Sighting(json.loads(raw) if raw else None)
+                except ValueError:
+                    sighting = Sighting()
+                yield sighting
+                f.seek(0)
+                f.truncate()
+                json.dump(sighting.to_dict(), f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def purge(self, doc_id=None):
+        """
+        Drop expired sightings, and the one pointing at doc_id if given
+
+        Call with the ID of a deleted record, otherwise the next repeat would
+        update a record that no longer exists.
+        """
+        now = time.time()
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.loads(f.read() or '{}')
+                if (doc_id is not None and data.get('doc_id') == doc_id) or now - data.get('last_seen', 0) > self.window:
+                    os.remove(path)
+            except (OSError, ValueError):
+                pass
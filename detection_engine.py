@@ -0,0 +1,708 @@
+#!/usr/bin/env python3
+"""
+========================================
+⚙️ License Plate Detection Engines
+========================================
+
+Engines share one interface: ``predict(image, conf_threshold, imgsz)``
+returns a list of detection dicts (bbox, confidence, class, width, height).
+
+- pytorch: ultralytics YOLO object (best.pt)
+- onnx:    ONNX Runtime on CPU with its own letterbox pre-processing and NMS,
+           optionally using a statically quantized INT8 model
+- remote:  client of the shared inference server process (inference_server.py);
+           frames go through shared memory, the model lives in that process only
+"""
+
+import os
+import time
+import queue
+import socket
+import atexit
+import threading
+import logging
+
+from deadline import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+# Engine configuration
+DETECTION_ENGINE = os.environ.get('DETECTION_ENGINE', 'pytorch')  # 'pytorch', 'onnx' หรือ 'remote'
+ONNX_MODEL_PATH = os.environ.get('ONNX_MODEL_PATH', '')  # ค่าว่าง = ใช้ชื่อเดียวกับ .pt แต่เป็น .onnx
+ONNX_USE_INT8 = os.environ.get('ONNX_USE_INT8', '0') == '1'
+ONNX_IMGSZ = int(os.environ.get('ONNX_IMGSZ', '640'))
+NMS_IOU_THRESHOLD = 0.45
+
+
+def _make_detection(x1, y1, x2, y2, conf, cls):
+    """สร้าง detection dict รูปแบบเดียวกันทุก engine"""
+    return {
+        'bbox': [int(x1), int(y1), int(x2), int(y2)],
+        'confidence': float(conf),
+        'class': int(cls),
+        'width': int(x2 - x1),
+        'height': int(y2 - y1)
+    }
+
+
+class PyTorchEngine:
+    name = 'pytorch'
+
+    def __init__(self, model_path):
+        """
+        Ultralytics YOLO engine
+
+        Args:
+            model_path: Path to .pt weights
+        """
+        from ultralytics import YOLO
+        self.model_path = model_path
+        self.model = YOLO(model_path)
+        # ultralytics predictor ไม่ thread-safe; torch ใช้ทุก core ภายใน call อยู่แล้ว
+        self._lock = threading.Lock()
+
+    def predict(self, image, conf_threshold=0.25, imgsz=None, deadline=None):
+        """
+        Run detection on a BGR image
+
+        Args:
+            image: BGR numpy array
+            conf_threshold: Minimum confidence to keep
+            imgsz: Inference size (None = model default)
+            deadline: Request deadline (unused: a local call runs to completion)
+
+        Returns:
+            List of detection dicts
+        """
+        kwargs = {'conf': conf_threshold, 'verbose': False}
+        if imgsz:
+            kwargs['imgsz'] = imgsz
+        with self._lock:
+            results = self.model(image, **kwargs)
+
+        detections = []
+        for result in results:
+            boxes = result.boxes
+            if boxes is None:
+                continue
+            for box in boxes:
+                conf = float(box.conf[0])
+                if conf >= conf_threshold:
+                    x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
+                    detections.append(_make_detection(x1, y1, x2, y2, conf, box.cls[0]))
+        return detections
+
+
+def letterbox(image, new_size, color=(114, 114, 114)):
+    """
+    Resize keeping aspect ratio and pad to a square, like ultralytics
+
+    Args:
+        image: BGR numpy array
+        new_size: Target side length
+        color: Padding color
+
+    Returns:
+        tuple: (padded image, scale ratio, (pad_x, pad_y))
+    """
+    import cv2
+
+    h, w = image.shape[:2]
+    ratio = min(new_size / h, new_size / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    pad_x = (new_size - new_w) / 2
+    pad_y = (new_size - new_h) / 2
+
+    if (w, h) != (new_w, new_h):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return image, ratio, (left, top)
+
+
+def preprocess(image, imgsz):
+    """
+    BGR image -> NCHW float32 tensor in [0, 1]
+
+    Returns:
+        tuple: (tensor, ratio, pad)
+    """
+    import numpy as np
+
+    padded, ratio, pad = letterbox(image, imgsz)
+    tensor = padded[:, :, ::-1].transpose(2, 0, 1)  # BGR -> RGB, HWC -> CHW
+    tensor = np.ascontiguousarray(tensor, dtype=np.float32) / 255.0
+    return tensor[None], ratio, pad
+
+
+def nms(boxes, scores, iou_threshold=NMS_IOU_THRESHOLD):
+    """
+    Greedy non-maximum suppression
+
+    Args:
+        boxes: (N, 4) xyxy array
+        scores: (N,) array
+        iou_threshold: Overlap above which lower scored boxes are dropped
+
+    Returns:
+        List of kept indices
+    """
+    import numpy as np
+
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(int(i))
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        inter = (xx2 - xx1).clip(0) * (yy2 - yy1).clip(0)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        order = order[1:][iou <= iou_threshold]
+    return keep
+
+
+def postprocess(output, ratio, pad, image_shape, conf_threshold, iou_threshold=NMS_IOU_THRESHOLD):
+    """
+    Decode YOLOv8 output (1, 4 + num_classes, N) into detections
+
+    Returns:
+        List of detection dicts in original image coordinates
+    """
+    import numpy as np
+
+    preds = output[0].T  # (N, 4 + nc)
+    class_scores = preds[:, 4:]
+    class_ids = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(class_ids)), class_ids]
+
+    mask = scores >= conf_threshold
+    if not mask.any():
+        return []
+    preds, scores, class_ids = preds[mask], scores[mask], class_ids[mask]
+
+    # cx, cy, w, h -> x1, y1, x2, y2 แล้วย้อน letterbox กลับไปพิกัดภาพจริง
+    boxes = np.empty((len(preds), 4), dtype=np.float32)
+    boxes[:, 0] = preds[:, 0] - preds[:, 2] / 2
+    boxes[:, 1] = preds[:, 1] - preds[:, 3] / 2
+    boxes[:, 2] = preds[:, 0] + preds[:, 2] / 2
+    boxes[:, 3] = preds[:, 1] + preds[:, 3] / 2
+    boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / ratio
+    boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / ratio
+
+    h, w = image_shape[:2]
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+
+    detections = []
+    for cls in np.unique(class_ids):
+        idx = np.where(class_ids == cls)[0]
+        for i in nms(boxes[idx], scores[idx], iou_threshold):
+            x1, y1, x2, y2 = boxes[idx[i]]
+            detections.append(_make_detection(x1, y1, x2, y2, scores[idx[i]], cls))
+
+    detections.sort(key=lambda d: d['confidence'], reverse=True)
+    return detections
+
+
+class OnnxEngine:
+    name = 'onnx'
+
+    def __init__(self, onnx_path, imgsz=ONNX_IMGSZ):
+        """
+        ONNX Runtime CPU engine
+
+        Args:
+            onnx_path: Path to exported (or INT8 quantized) .onnx model
+            imgsz: Default inference size when the model has dynamic input
+        """
+        import onnxruntime as ort
+
+        from cpu_budget import cpu_budget
+
+        budget = cpu_budget.plan()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # ไม่ใช้ทุก core ของเครื่องในทุก worker: จำนวน thread ตามส่วนแบ่งของ process นี้
+        options.intra_op_num_threads = budget['intra_op_threads']
+        options.inter_op_num_threads = budget['inter_op_threads']
+        self.session = ort.InferenceSession(onnx_path, sess_options=options,
+                                            providers=['CPUExecutionProvider'])
+        self.model_path = onnx_path
+        self.input_name = self.session.get_inputs()[0].name
+
+        # ถ้า export แบบ static shape ต้องใช้ขนาดนั้นเสมอ
+        input_shape = self.session.get_inputs()[0].shape
+        self.static_imgsz = input_shape[2] if isinstance(input_shape[2], int) else None
+        self.imgsz = self.static_imgsz or imgsz
+
+    def predict(self, image, conf_threshold=0.25, imgsz=None, deadline=None):
+        """
+        Run detection on a BGR image
+
+        Args:
+            image: BGR numpy array
+            conf_threshold: Minimum confidence to keep
+            imgsz: Inference size (ignored for static-shape models)
+            deadline: Request deadline (unused: a local call runs to completion)
+
+        Returns:
+            List of detection dicts
+        """
+        size = self.static_imgsz or imgsz or self.imgsz
+        size = int(-(-size // 32) * 32)  # ต้องหาร stride 32 ลงตัว
+        tensor, ratio, pad = preprocess(image, size)
+        output = self.session.run(None, {self.input_name: tensor})[0]
+        return postprocess(output, ratio, pad, image.shape, conf_threshold)
+
+
+class _Slot:
+    """One shared memory slot and its connection to the inference server"""
+
+    def __init__(self, index, offset, shm=None):
+        self.index = index
+        self.offset = offset
+        # segment ของ slot เอง (slot ที่มาแทน slot ใน ring ที่ถูกปลดหลัง timeout)
+        self.shm = shm
+        self.sock = None
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+
+class RemoteEngine:
+    name = 'remote'
+
+    def __init__(self, socket_path=None, slots=None, slot_bytes=None, timeout=None, connect_timeout=None):
+        """
+        Client of the shared inference server
+
+        Waits until the server accepts connections (it binds its socket only
+        after the model is loaded). The shared memory ring and the slot
+        connections are created lazily in each process, so an engine built
+        in the gunicorn master is still usable after fork.
+
+        Args:
+            socket_path: Server Unix socket (default INFERENCE_SOCKET)
+            slots: Frames this process can have in flight (default INFERENCE_SLOTS)
+            slot_bytes: Size of one slot (default INFERENCE_SLOT_BYTES)
+            timeout: Per-frame timeout in seconds when the request has no deadline
+            connect_timeout: How long to wait for the server to come up
+        """
+        import inference_server
+
+        self.socket_path = socket_path or inference_server.INFERENCE_SOCKET
+        self.slots = slots or inference_server.INFERENCE_SLOTS
+        self.slot_bytes = slot_bytes or inference_server.INFERENCE_SLOT_BYTES
+        self.timeout = timeout or inference_server.INFERENCE_TIMEOUT
+        self.server_info = self._wait_for_server(connect_timeout or inference_server.INFERENCE_CONNECT_TIMEOUT)
+        self.model_path = self.server_info.get('model_path')
+        self._pid = None
+        self._shm = None
+        self._free = None
+        self._lock = threading.Lock()
+        logger.info(f"🛰️ Using inference server at {self.socket_path}", extra=self.server_info)
+
+    def _wait_for_server(self, connect_timeout):
+        from inference_server import recv_message, send_message
+
+        deadline = time.monotonic() + connect_timeout
+        while True:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.settimeout(self.timeout)
+                    sock.connect(self.socket_path)
+                    send_message(sock, {'op': 'info'})
+                    return recv_message(sock)
+            except OSError as e:
+                if time.monotonic() >= deadline:
+                    raise ConnectionError(f"Inference server not reachable at {self.socket_path}: {e}")
+                time.sleep(0.5)
+
+    def _ensure_ring(self):
+        """Create this process's shared memory ring (once per pid)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            from multiprocessing.shared_memory import SharedMemory
+
+            # ring ที่ติดมาจาก parent ก่อน fork เป็นของ parent ไม่ใช้ร่วมกัน
+            self._shm = SharedMemory(create=True, size=self.slots * self.slot_bytes)
+            self._free = queue.Queue()
+            for index in range(self.slots):
+                self._free.put(_Slot(index, index * self.slot_bytes))
+            self._pid = os.getpid()
+            atexit.register(_release_shared_memory, self._shm)
+
+    def _connect(self, slot, timeout):
+        from inference_server import recv_message, send_message
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self.socket_path)
+            send_message(sock, {'op': 'attach', 'shm': (slot.shm or self._shm).name,
+                                'offset': slot.offset, 'size': self.slot_bytes})
+            reply = recv_message(sock)
+        except OSError:
+            sock.close()
+            raise
+        if not reply.get('ok'):
+            sock.close()
+            raise ConnectionError(f"Inference server refused slot: {reply.get('error')}")
+        slot.sock = sock
+
+    def _retire(self, slot):
+        """
+        Replace a slot whose request timed out
+
+        The server may still be reading the frame from that region, so it
+        is never written again; the replacement gets its own segment.
+        """
+        from multiprocessing.shared_memory import SharedMemory
+
+        slot.close()
+        if slot.shm is not None:
+            # unlink แค่ลบชื่อ server ที่ยัง map อยู่อ่านต่อได้
+            _release_shared_memory(slot.shm)
+        shm = SharedMemory(create=True, size=self.slot_bytes)
+        atexit.register(_release_shared_memory, shm)
+        logger.warning(f"⚠️ Inference slot {slot.index} retired after timeout")
+        return _Slot(slot.index, 0, shm)
+
+    def predict(self, image, conf_threshold=0.25, imgsz=None, deadline=None):
+        """
+        Run detection on a BGR image in the inference server
+
+        The frame is copied once into a free slot of the ring; the server
+        reads it in place. On timeout the slot is retired rather than
+        reused, since the server may still be reading it.
+
+        Args:
+            image: BGR numpy array
+            conf_threshold: Minimum confidence to keep
+            imgsz: Inference size (None = model default)
+            deadline: Request deadline; bounds the wait instead of INFERENCE_TIMEOUT
+
+        Returns:
+            List of detection dicts
+
+        Raises:
+            DeadlineExceeded: The request budget ran out before the reply
+        """
+        import numpy as np
+        from multiprocessing.shared_memory import SharedMemory
+        from inference_server import frame_view, recv_message, send_message
+
+        timeout = min(self.timeout, deadline.remaining()) if deadline else self.timeout
+        if timeout <= 0:
+            raise DeadlineExceeded('yolo')
+
+        self._ensure_ring()
+        try:
+            slot = self._free.get(timeout=timeout)
+        except queue.Empty:
+            if deadline and deadline.expired():
+                raise DeadlineExceeded('yolo')
+            raise TimeoutError('No free inference slot')
+
+        temp = None
+        try:
+            request = {'op': 'predict', 'shape': list(image.shape), 'dtype': str(image.dtype),
+                       'conf': float(conf_threshold), 'imgsz': imgsz}
+            if image.nbytes <= self.slot_bytes:
+                np.copyto(frame_view(slot.shm or self._shm, image.shape, image.dtype, slot.offset), image)
+            else:
+                temp = SharedMemory(create=True, size=image.nbytes)
+                np.copyto(frame_view(temp, image.shape, image.dtype), image)
+                request['shm'] = temp.name
+
+            for attempt in range(2):
+                # เวลาที่เหลือของ request (รอ slot ไปแล้วบางส่วน)
+                if deadline:
+                    timeout = min(self.timeout, deadline.remaining())
+                    if timeout <= 0:
+                        raise DeadlineExceeded('yolo')
+                fresh = slot.sock is None
+                try:
+                    if fresh:
+                        self._connect(slot, timeout)
+                    slot.sock.settimeout(timeout)
+                    send_message(slot.sock, request)
+                    reply = recv_message(slot.sock)
+                    break
+                except socket.timeout:
+                    slot = self._retire(slot)
+                    if deadline and deadline.expired():
+                        raise DeadlineExceeded('yolo')
+                    raise
+                except OSError:
+                    # server ถูก restart: ต่อใหม่แล้วส่งซ้ำครั้งเดียว
+                    slot.close()
+                    if fresh or attempt:
+                        raise
+
+            if not reply.get('ok'):
+                raise RuntimeError(f"Inference server error: {reply.get('error')}")
+            return reply['detections']
+        finally:
+            if temp is not None:
+                _release_shared_memory(temp)
+            self._free.put(slot)
+
+
+def _release_shared_memory(shm):
+    try:
+        shm.close()
+        shm.unlink()
+    except (BufferError, FileNotFoundError):
+        pass
+
+
+def onnx_path_for(model_path, int8=False):
+    """best.pt -> best.onnx / best.int8.onnx"""
+    base = os.path.splitext(model_path)[0]
+    return f"{base}.int8.onnx" if int8 else f"{base}.onnx"
+
+
+def export_onnx(model_path, imgsz=ONNX_IMGSZ):
+    """
+    Export .pt weights to ONNX with ultralytics
+
+    Returns:
+        str: Path of the exported model
+    """
+    from ultralytics import YOLO
+
+    exported = YOLO(model_path).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    logger.info(f"📦 Exported ONNX model: {exported}")
+    return exported
+
+
+class _CalibrationReader:
+    """CalibrationDataReader ที่ป้อนภาพจริงผ่าน pre-processing เดียวกับตอน inference"""
+
+    def __init__(self, input_name, image_paths, imgsz):
+        self.input_name = input_name
+        self.image_paths = list(image_paths)
+        self.imgsz = imgsz
+        self._index = 0
+
+    def get_next(self):
+        import cv2
+
+        while self._index < len(self.image_paths):
+            path = self.image_paths[self._index]
+            self._index += 1
+            image = cv2.imread(path)
+            if image is not None:
+                tensor, _, _ = preprocess(image, self.imgsz)
+                return {self.input_name: tensor}
+        return None
+
+
+def quantize_int8(onnx_path, calibration_images, output_path=None, imgsz=ONNX_IMGSZ):
+    """
+    Statically quantize an ONNX model to INT8 using calibration images
+
+    Args:
+        onnx_path: FP32 ONNX model
+        calibration_images: Iterable of image paths (ภาพจริงจากกล้อง 100-300 ภาพกำลังดี)
+        output_path: Output path (default best.int8.onnx)
+        imgsz: Calibration input size
+
+    Returns:
+        str: Path of the quantized model
+    """
+    import onnxruntime as ort
+    from onnxruntime.quantization import quantize_static, QuantFormat, QuantType
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    output_path = output_path or onnx_path.replace('.onnx', '.int8.onnx')
+    prepared_path = onnx_path.replace('.onnx', '.prep.onnx')
+    quant_pre_process(onnx_path, prepared_path)
+
+    input_name = ort.InferenceSession(prepared_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    reader = _CalibrationReader(input_name, calibration_images, imgsz)
+    quantize_static(prepared_path, output_path, reader,
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8,
+                    per_channel=True)
+    os.remove(prepared_path)
+    logger.info(f"📦 INT8 quantized model: {output_path}")
+    return output_path
+
+
+def create_engine(model_path, engine=DETECTION_ENGINE, use_int8=ONNX_USE_INT8):
+    """
+    Build the configured detection engine
+
+    Args:
+        model_path: Path to .pt weights
+        engine: 'pytorch', 'onnx' or 'remote'
+        use_int8: Use the INT8 model for the onnx engine
+
+    Returns:
+        Engine instance
+    """
+    if engine == 'remote':
+        return RemoteEngine()
+    if engine == 'onnx':
+        onnx_path = ONNX_MODEL_PATH or onnx_path_for(model_path, int8=use_int8)
+        if not os.path.exists(onnx_path):
+            if use_int8:
+                raise FileNotFoundError(f"INT8 model not found: {onnx_path} (run: python detection_engine.py quantize)")
+            onnx_path = export_onnx(model_path)
+        return OnnxEngine(onnx_path)
+    if engine == 'pytorch':
+        return PyTorchEngine(model_path)
+    raise ValueError(f"Unknown detection engine: {engine}")
+
+
+def box_iou(a, b):
+    """IoU ของ bbox สองกล่อง [x1, y1, x2, y2]"""
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def check_parity(reference, candidate, image_paths, conf_threshold=0.25,
+                 min_iou=0.9, max_conf_diff=0.05):
+    """
+    Compare two engines detection by detection
+
+    Each reference box is matched to the candidate box with the highest IoU.
+
+    Args:
+        reference: Reference engine (usually pytorch)
+        candidate: Engine under test (onnx / int8)
+        image_paths: Images to compare on
+        conf_threshold: Detection threshold for both engines
+        min_iou: Minimum IoU for a matched box
+        max_conf_diff: Maximum absolute confidence difference
+
+    Returns:
+        dict: Summary with pass flag, mean IoU and worst confidence diff
+    """
+    import cv2
+
+    ious = []
+    conf_diffs = []
+    missed = 0
+    extra = 0
+    images = 0
+
+    for path in image_paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        images += 1
+        ref_dets = reference.predict(image, conf_threshold)
+        cand_dets = candidate.predict(image, conf_threshold)
+        extra += max(0, len(cand_dets) - len(ref_dets))
+
+        for ref in ref_dets:
+            best = max(cand_dets, key=lambda c: box_iou(ref['bbox'], c['bbox']), default=None)
+            if best is None or box_iou(ref['bbox'], best['bbox']) < min_iou:
+                missed += 1
+                continue
+            ious.append(box_iou(ref['bbox'], best['bbox']))
+            conf_diffs.append(abs(ref['confidence'] - best['confidence']))
+
+    max_diff = max(conf_diffs) if conf_diffs else 0.0
+    return {
+        'images': images,
+        'matched': len(ious),
+        'missed': missed,
+        'extra': extra,
+        'mean_iou': sum(ious) / len(ious) if ious else 0.0,
+        'min_iou': min(ious) if ious else 0.0,
+        'max_conf_diff': max_diff,
+        'passed': missed == 0 and extra == 0 and max_diff <= max_conf_diff
+    }
+
+
+def measure_latency(engine, width=640, height=480, runs=5):
+    """
+    Measure steady-state per-frame latency on a dummy frame
+
+    Returns:
+        float: Median latency in milliseconds
+    """
+    import numpy as np
+
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        engine.predict(frame)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def _list_images(directory):
+    """รายชื่อไฟล์ภาพในโฟลเดอร์"""
+    exts = ('.jpg', '.jpeg', '.png', '.bmp')
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.lower().endswith(exts))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Detection engine tools")
+    parser.add_argument('--model', default=os.environ.get('MODEL_PATH', 'best.pt'))
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('export', help='Export best.pt to ONNX')
+
+    quant = sub.add_parser('quantize', help='Static INT8 quantization')
+    quant.add_argument('images', help='Calibration image directory')
+
+    parity = sub.add_parser('parity', help='Compare onnx engine against pytorch')
+    parity.add_argument('images', help='Image directory')
+    parity.add_argument('--int8', action='store_true')
+    parity.add_argument('--min-iou', type=float, default=0.9)
+    parity.add_argument('--max-conf-diff', type=float, default=0.05)
+
+    bench = sub.add_parser('benchmark', help='Per-frame latency of each engine')
+    bench.add_argument('--int8', action='store_true')
+
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_onnx(args.model)
+    elif args.command == 'quantize':
+        onnx_path = onnx_path_for(args.model)
+        if not os.path.exists(onnx_path):
+            onnx_path = export_onnx(args.model)
+        quantize_int8(onnx_path, _list_images(args.images))
+    elif args.command == 'parity':
+        summary = check_parity(create_engine(args.model, 'pytorch'),
+                               create_engine(args.model, 'onnx', use_int8=args.int8),
+                               _list_images(args.images),
+                               min_iou=args.min_iou, max_conf_diff=args.max_conf_diff)
+        print(f"🧪 Parity: {summary}")
+        raise SystemExit(0 if summary['passed'] else 1)
+    elif args.command == 'benchmark':
+        for name in ('pytorch', 'onnx'):
+            engine = create_engine(args.model, name, use_int8=args.int8)
+            print(f"⏱️ {name}: {measure_latency(engine):.1f} ms/frame")
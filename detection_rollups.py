@@ -0,0 +1,418 @@
+"""
+========================================
+📈 Time-series rollups of detection volume
+========================================
+
+Every saved detection is added to an hourly and a daily bucket, so volume
+charts never scan the detection records. A bucket holds the detection
+count, counts by ``detection_mode``, province and region, and the sums of
+the API / YOLO confidences (averages are computed at query time).
+
+Buckets are stored as compact JSON, one file per month of hourly buckets
+(``rollups/hourly/YYYY-MM.json``) and one per year of daily buckets
+(``rollups/daily/YYYY.json``). Saves are accumulated in memory and merged
+into the files under ``flock`` every ROLLUP_FLUSH_INTERVAL seconds, so
+every gunicorn worker writes to the same rollups. A year of daily data is
+one small file; parsed files are cached until their mtime changes.
+
+Counts are of saved records: a repeat sighting merged by the dedup window
+is not counted again, and deleting or archiving records does not remove
+them from the rollups. Rebuild from Firebase and the archive with::
+
+    python detection_rollups.py rebuild
+"""
+
+import os
+import json
+import fcntl
+import atexit
+import argparse
+import threading
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FOLDER = os.environ.get('ROLLUP_FOLDER', 'rollups')
+ROLLUP_FLUSH_INTERVAL = float(os.environ.get('ROLLUP_FLUSH_INTERVAL', '2'))  # วินาที
+# จำนวนจุดสูงสุดที่ /api/timeseries คืนเมื่อไม่ได้ระบุ interval
+TIMESERIES_MAX_POINTS = int(os.environ.get('TIMESERIES_MAX_POINTS', '500'))
+
+# Resolutions
+HOURLY = 'hourly'
+DAILY = 'daily'
+
+# ช่วงเวลาที่ downsample ได้ เรียงจากละเอียดไปหยาบ (ชื่อ, ความยาวโดยประมาณเป็นชั่วโมง)
+INTERVALS = [('1h', 1), ('3h', 3), ('6h', 6), ('12h', 12), ('1d', 24), ('1w', 24 * 7), ('1M', 24 * 30)]
+INTERVAL_HOURS = dict(INTERVALS)
+
+SPLIT_DIMENSIONS = ('mode', 'province', 'region')
+
+
+def _empty_bucket():
+    return {'count': 0, 'confidence_api_sum': 0.0, 'confidence_yolo_sum': 0.0, 'yolo_count': 0,
+            'mode': {}, 'province': {}, 'region': {}}
+
+
+def _merge_bucket(target, delta):
+    """บวก bucket delta เข้า target (แก้ target)"""
+    for field in ('count', 'confidence_api_sum', 'confidence_yolo_sum', 'yolo_count'):
+        target[field] = target.get(field, 0) + delta.get(field, 0)
+    for dimension in SPLIT_DIMENSIONS:
+        counts = target.setdefault(dimension, {})
+        for value, count in delta.get(dimension, {}).items():
+            counts[value] = counts.get(value, 0) + count
+    return target
+
+
+def _bucket_keys(timestamp):
+    """(hourly key, daily key) ของเวลา"""
+    return timestamp.strftime('%Y-%m-%dT%H'), timestamp.strftime('%Y-%m-%d')
+
+
+def _parse_time(value, end=False):
+    """
+    'YYYY-MM-DD', 'YYYY-MM-DDTHH[:MM[:SS]]' or datetime -> datetime
+
+    A bare date as the end of a range means the end of that day.
+    """
+    if isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1) - timedelta(microseconds=1)
+    return parsed
+
+
+def _window_start(moment, interval):
+    """จุดเริ่มของช่วง downsample ที่ moment อยู่"""
+    if interval == '1M':
+        return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if interval == '1w':
+        day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        return day - timedelta(days=day.weekday())
+    hours = INTERVAL_HOURS[interval]
+    return moment.replace(hour=moment.hour - moment.hour % hours, minute=0, second=0, microsecond=0)
+
+
+def _next_window(start, interval):
+    if interval == '1M':
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(hours=INTERVAL_HOURS[interval])
+
+
+def window_count(start, end, interval):
+    """จำนวนจุด (โดยประมาณ) ของช่วง start-end ที่ interval"""
+    span_hours = max(1.0, (end - start).total_seconds() / 3600)
+    return span_hours / INTERVAL_HOURS[interval]
+
+
+def choose_interval(start, end, max_points=TIMESERIES_MAX_POINTS):
+    """Finest interval that keeps the range within max_points points"""
+    for name, _ in INTERVALS:
+        if window_count(start, end, name) <= max_points:
+            return name
+    return INTERVALS[-1][0]
+
+
+class DetectionRollups:
+    def __init__(self, folder=ROLLUP_FOLDER, flush_interval=ROLLUP_FLUSH_INTERVAL):
+        """
+        Args:
+            folder: Where rollup files are stored
+            flush_interval: Seconds saves are buffered before being merged into the files
+        """
+        self.folder = folder
+        self.flush_interval = flush_interval
+        self._pending = {HOURLY: {}, DAILY: {}}  # resolution -> {bucket key: delta}
+        self._flush_timer = None
+        self._file_cache = {}  # path -> (mtime_ns, buckets)
+        self._lock = threading.Lock()
+        for resolution in (HOURLY, DAILY):
+            os.makedirs(os.path.join(folder, resolution), exist_ok=True)
+        atexit.register(self.flush)
+
+    def _path(self, resolution, key):
+        # hourly: ไฟล์ละเดือน, daily: ไฟล์ละปี
+        name = key[:7] if resolution == HOURLY else key[:4]
+        return os.path.join(self.folder, resolution, f"{name}.json")
+
+    # ---------- Write ----------
+
+    def record(self, timestamp=None, detection_mode=None, province=None, region=None,
+               confidence_api=None, confidence_yolo=None):
+        """
+        Add one saved detection to its hourly and daily buckets
+
+        Args:
+            timestamp: datetime of the detection (default now)
+            detection_mode: 'auto' or 'manual'
+            province / region: Province analysis of the plate (None = not counted)
+            confidence_api / confidence_yolo: Confidence scores
+        """
+        timestamp = timestamp or datetime.now()
+        delta = _empty_bucket()
+        delta['count'] = 1
+        delta['confidence_api_sum'] = float(confidence_api or 0.0)
+        if confidence_yolo is not None:
+            delta['confidence_yolo_sum'] = float(confidence_yolo)
+            delta['yolo_count'] = 1
+        for dimension, value in (('mode', detection_mode), ('province', province), ('region', region)):
+            if value:
+                delta[dimension][value] = 1
+
+        hour_key, day_key = _bucket_keys(timestamp)
+        with self._lock:
+            _merge_bucket(self._pending[HOURLY].setdefault(hour_key, _empty_bucket()), delta)
+            _merge_bucket(self._pending[DAILY].setdefault(day_key, _empty_bucket()), delta)
+            if self._flush_timer is None:
+                # timer สร้างเมื่อมีข้อมูลรอเขียนเท่านั้น (thread ไม่ข้าม fork)
+                self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self):
+        """Merge buffered saves into the rollup files"""
+        with self._lock:
+            pending, self._pending = self._pending, {HOURLY: {}, DAILY: {}}
+            self._flush_timer = None
+
+        for resolution, buckets in pending.items():
+            by_path = {}
+            for key, delta in buckets.items():
+                by_path.setdefault(self._path(resolution, key), {})[key] = delta
+            for path, deltas in by_path.items():
+                try:
+                    self._merge_file(path, deltas)
+                except OSError as e:
+                    logger.error(f"❌ Failed to write rollups {path}: {e}")
+
+    def _merge_file(self, path, deltas):
+        with open(path, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                try:
+                    buckets = json.loads(raw) if raw else {}
+                except ValueError:
+                    logger.warning(f"⚠️ Corrupt rollup file {path}, starting over")
+                    buckets = {}
+                for key, delta in deltas.items():
+                    _merge_bucket(buckets.setdefault(key, _empty_bucket()), delta)
+                f.seek(0)
+                f.truncate()
+                json.dump(buckets, f, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # ---------- Read ----------
+
+    def _load(self, path):
+        """Buckets of one file (cached until the file changes)"""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return {}
+        cached = self._file_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'r', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                raw = f.read()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        try:
+            buckets = json.loads(raw) if raw else {}
+        except ValueError:
+            buckets = {}
+        self._file_cache[path] = (mtime, buckets)
+        return buckets
+
+    def buckets(self, resolution, start, end):
+        """
+        Stored buckets between start and end (inclusive)
+
+        Returns:
+            list: [(bucket start datetime, bucket), ...] in time order
+        """
+        hour_keys, day_keys = _bucket_keys(start), _bucket_keys(end)
+        if resolution == HOURLY:
+            first_key, last_key, fmt = hour_keys[0], day_keys[0], '%Y-%m-%dT%H'
+        else:
+            first_key, last_key, fmt = hour_keys[1], day_keys[1], '%Y-%m-%d'
+
+        # ไฟล์ที่ครอบคลุมช่วงเวลา (เดือนละไฟล์สำหรับ hourly, ปีละไฟล์สำหรับ daily)
+        paths = []
+        cursor = start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        while cursor <= end:
+            path = self._path(resolution, cursor.strftime('%Y-%m-%dT%H'))
+            if path not in paths:
+                paths.append(path)
+            cursor = (cursor.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+        results = []
+        for path in paths:
+            for key, bucket in self._load(path).items():
+                if first_key <= key <= last_key:
+                    results.append((datetime.strptime(key, fmt), bucket))
+        results.sort(key=lambda item: item[0])
+        return results
+
+    def timeseries(self, start, end, interval=None, max_points=TIMESERIES_MAX_POINTS, split=None):
+        """
+        Detection volume between start and end, downsampled to interval
+
+        Args:
+            start / end: datetime or ISO date/time strings (a bare end date is inclusive)
+            interval: One of INTERVALS (default: finest that fits max_points);
+                      coarsened when it would give more than max_points points
+            max_points: Upper bound on points
+            split: Dimensions to include per point ('mode', 'province', 'region')
+
+        Returns:
+            dict: interval, resolution read and one point per window (empty windows are zeros)
+
+        Raises:
+            ValueError: Bad times / interval, or a range too long even at the coarsest interval
+        """
+        start, end = _parse_time(start), _parse_time(end, end=True)
+        if end < start:
+            raise ValueError('end must not be before start')
+        if interval and interval not in INTERVAL_HOURS:
+            raise ValueError(f"interval must be one of {', '.join(INTERVAL_HOURS)}")
+        # interval ที่ client เลือกก็ต้องไม่เกิน max_points (ไม่งั้นช่วงหลายสิบปีที่ 1h วนหลายแสนรอบ)
+        if not interval or window_count(start, end, interval) > max_points:
+            interval = choose_interval(start, end, max_points)
+        if window_count(start, end, interval) > max_points:
+            raise ValueError(f"range too long: more than {max_points} points even at {interval}")
+        split = [s for s in (split or []) if s in SPLIT_DIMENSIONS]
+
+        # ระดับวันขึ้นไปอ่านจากไฟล์รายวัน (ไฟล์เดียวต่อปี)
+        resolution = HOURLY if INTERVAL_HOURS[interval] < 24 else DAILY
+        self.flush()
+
+        windows = {}
+        for moment, bucket in self.buckets(resolution, start, end):
+            _merge_bucket(windows.setdefault(_window_start(moment, interval), _empty_bucket()), bucket)
+
+        points = []
+        cursor = _window_start(start, interval)
+        while cursor <= end:
+            bucket = windows.get(cursor) or _empty_bucket()
+            point = {
+                't': cursor.isoformat(timespec='minutes'),
+                'count': bucket['count'],
+                'avg_confidence_api': round(bucket['confidence_api_sum'] / bucket['count'], 4) if bucket['count'] else None,
+                'avg_confidence_yolo': round(bucket['confidence_yolo_sum'] / bucket['yolo_count'], 4) if bucket['yolo_count'] else None
+            }
+            for dimension in split:
+                point[dimension] = bucket[dimension]
+            points.append(point)
+            cursor = _next_window(cursor, interval)
+
+        return {
+            'start': start.isoformat(timespec='minutes'),
+            'end': end.isoformat(timespec='minutes'),
+            'interval': interval,
+            'resolution': resolution,
+            'total': sum(point['count'] for point in points),
+            'points': points
+        }
+
+    # ---------- Rebuild ----------
+
+    def rebuild(self, records):
+        """
+        Replace all rollups with the given detection records
+
+        Args:
+            records: Iterable of detection dicts (timestamp, detection_mode,
+                     province, region, confidence_api, confidence_yolo)
+
+        Returns:
+            int: Number of records rolled up
+        """
+        built = {HOURLY: {}, DAILY: {}}
+        count = 0
+        for record in records:
+            try:
+                timestamp = datetime.fromisoformat(record.get('timestamp') or '')
+            except ValueError:
+                continue
+            delta = _empty_bucket()
+            delta['count'] = 1
+            delta['confidence_api_sum'] = float(record.get('confidence_api') or 0.0)
+            if record.get('confidence_yolo') is not None:
+                delta['confidence_yolo_sum'] = float(record['confidence_yolo'])
+                delta['yolo_count'] = 1
+            for dimension, field in (('mode', 'detection_mode'), ('province', 'province'), ('region', 'region')):
+                if record.get(field):
+                    delta[dimension][record[field]] = 1
+            hour_key, day_key = _bucket_keys(timestamp)
+            _merge_bucket(built[HOURLY].setdefault(hour_key, _empty_bucket()), delta)
+            _merge_bucket(built[DAILY].setdefault(day_key, _empty_bucket()), delta)
+            count += 1
+
+        with self._lock:
+            self._pending = {HOURLY: {}, DAILY: {}}
+        for resolution, buckets in built.items():
+            folder = os.path.join(self.folder, resolution)
+            for name in os.listdir(folder):
+                os.remove(os.path.join(folder, name))
+            by_path = {}
+            for key, bucket in buckets.items():
+                by_path.setdefault(self._path(resolution, key), {})[key] = bucket
+            for path, deltas in by_path.items():
+                self._merge_file(path, deltas)
+        self._file_cache.clear()
+        return count
+
+    def status(self):
+        files = {resolution: sorted(os.listdir(os.path.join(self.folder, resolution)))
+                 for resolution in (HOURLY, DAILY)}
+        return {
+            'folder': self.folder,
+            'hourly_files': len(files[HOURLY]),
+            'daily_files': len(files[DAILY]),
+            'first_year': files[DAILY][0][:4] if files[DAILY] else None,
+            'last_year': files[DAILY][-1][:4] if files[DAILY] else None
+        }
+
+
+# Global rollups instance
+detection_rollups = DetectionRollups()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Detection time-series rollups')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('rebuild', help='Rebuild rollups from Firebase and the archive')
+
+    show_parser = subparsers.add_parser('show', help='Print a time series')
+    show_parser.add_argument('--start', required=True, help='Start YYYY-MM-DD[THH]')
+    show_parser.add_argument('--end', required=True, help='End YYYY-MM-DD[THH]')
+    show_parser.add_argument('--interval', choices=list(INTERVAL_HOURS))
+
+    args = parser.parse_args()
+
+    if args.command == 'rebuild':
+        from firebase_config import firebase_manager
+        from detection_archive import detection_archive
+
+        records = firebase_manager.get_detections_before(datetime.max.isoformat())
+        records += detection_archive.query(columns=['timestamp', 'detection_mode', 'province', 'region',
+                                                    'confidence_api', 'confidence_yolo'])
+        print(f"Rolled up {detection_rollups.rebuild(records)} detections")
+    else:
+        series = detection_rollups.timeseries(args.start, args.end, args.interval)
+        print(f"interval={series['interval']} total={series['total']}")
+        for point in series['points']:
+            print(f"{point['t']}\t{point['count']}")
+
+
+if __name__ == '__main__':
+    main()
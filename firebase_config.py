@@ -4,18 +4,22 @@
 ========================================
 """
 
-import firebase_admin
-from firebase_admin import credentials, db
-import pyrebase
 import os
+import time
+import threading
 from datetime import datetime
 import logging
 import json
 from province_utils import analyze_license_plate
 from api_province_utils import extract_province_from_api_response
+from metrics import record_firebase_failure
+from detection_dedup import DetectionDeduper, normalize_plate
+from response_cache import response_cache
+from detection_rollups import detection_rollups
+from log_config import setup_logging
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+# Setup logging (queue-backed JSON logging, ไม่ block request thread)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Firebase configuration
@@ -33,7 +37,11 @@ FIREBASE_CONFIG = {
 class FirebaseManager:
     def __init__(self, service_account_path=None):
         """
-        Initialize Firebase connection
+        Firebase connection manager
+        
+        Nothing is imported or connected here; call connect() (the app does
+        so from a background thread at startup) or let the first database
+        operation connect on demand.
         
         Args:
             service_account_path: Path to Firebase service account JSON file
@@ -43,45 +51,83 @@ class FirebaseManager:
         self.initialized = False
         self.mock_mode = False
         self.mock_data = []  # สำหรับเก็บข้อมูล mock
+        self.mock_alerts = []  # watchlist alerts ใน mock mode
+        self.deduper = DetectionDeduper()
+        self.connect_time_ms = None
+        self._connected = threading.Event()
+        self._connect_lock = threading.Lock()
+    
+    def connect(self):
+        """
+        Initialize the Firebase connection (only once)
         
-        try:
-            # Try Firebase Admin SDK first
-            if not firebase_admin._apps:
-                firebase_admin.initialize_app(options={
-                    'databaseURL': FIREBASE_CONFIG['databaseURL'],
-                    'databaseAuthVariableOverride': None
-                })
-                
-            self.database = db.reference()
-            self.initialized = True
-            logger.info("✅ Firebase Admin SDK initialized successfully")
-            
-        except Exception as admin_error:
-            logger.warning(f"⚠️ Firebase Admin SDK failed: {admin_error}")
-            
+        Tries the Admin SDK, then pyrebase, then falls back to mock mode.
+        A caller arriving while another thread is connecting waits for it.
+        """
+        if self._connected.is_set():
+            return
+        with self._connect_lock:
+            if self._connected.is_set():
+                return
+            start = time.perf_counter()
             try:
-                # Fallback to pyrebase
-                firebase = pyrebase.initialize_app(FIREBASE_CONFIG)
-                self.pyrebase_db = firebase.database()
+                # Try Firebase Admin SDK first
+                import firebase_admin
+                from firebase_admin import db
+                
+                if not firebase_admin._apps:
+                    firebase_admin.initialize_app(options={
+                        'databaseURL': FIREBASE_CONFIG['databaseURL'],
+                        'databaseAuthVariableOverride': None
+                    })
+                    
+                self.database = db.reference()
                 self.initialized = True
-                self.mock_mode = False
-                logger.info("✅ Firebase Pyrebase initialized successfully")
+                logger.info("✅ Firebase Admin SDK initialized successfully")
                 
-            except Exception as pyrebase_error:
-                logger.error(f"❌ Pyrebase initialization failed: {pyrebase_error}")
-                logger.info("💡 Switching to Mock Firebase mode for local development")
-                self.mock_mode = True
-                self.initialized = True  # Set to true for mock mode
+            except Exception as admin_error:
+                logger.warning(f"⚠️ Firebase Admin SDK failed: {admin_error}")
+                
+                try:
+                    # Fallback to pyrebase
+                    import pyrebase
+                    
+                    firebase = pyrebase.initialize_app(FIREBASE_CONFIG)
+                    self.pyrebase_db = firebase.database()
+                    self.initialized = True
+                    self.mock_mode = False
+                    logger.info("✅ Firebase Pyrebase initialized successfully")
+                    
+                except Exception as pyrebase_error:
+                    logger.error(f"❌ Pyrebase initialization failed: {pyrebase_error}")
+                    logger.info("💡 Switching to Mock Firebase mode for local development")
+                    self.mock_mode = True
+                    self.initialized = True  # Set to true for mock mode
+            
+            self.connect_time_ms = round((time.perf_counter() - start) * 1000, 1)
+            self._connected.set()
     
-    def is_connected(self):
-        """Check if Firebase is properly connected"""
+    def is_connected(self, wait=True):
+        """
+        Check if Firebase is properly connected
+        
+        Args:
+            wait: Connect first (or wait for the connection in progress);
+                  False only reports the current state
+        """
+        if wait:
+            self.connect()
         return self.initialized and (self.database is not None or self.pyrebase_db is not None or self.mock_mode)
     
     def save_detection_result(self, license_plate, confidence_api, confidence_yolo=None, 
-                            image_data=None, detection_mode="manual", api_response=None):
+                            image_data=None, detection_mode="manual", api_response=None, source=None):
         """
         Save license plate detection result to Firebase Realtime Database
         
+        The same normalized plate from the same source within the dedup window
+        updates last_seen / hit_count of the existing record instead of
+        pushing a new one.
+        
         Args:
             license_plate: Detected license plate text
             confidence_api: API confidence score
@@ -89,14 +135,81 @@ class FirebaseManager:
             image_data: Base64 encoded image data (optional)
             detection_mode: "auto" or "manual"
             api_response: Full API response for province extraction (optional)
+            source: Camera / client that produced the detection (optional)
         
         Returns:
             Document ID if successful, None if failed
         """
+        doc_id = self._save_detection_result(license_plate, confidence_api, confidence_yolo,
+                                             image_data, detection_mode, api_response, source)
+        if doc_id:
+            # stats / recent ที่ cache ไว้ต้องเห็น record นี้ทันที
+            response_cache.invalidate()
+        return doc_id
+    
+    def _save_detection_result(self, license_plate, confidence_api, confidence_yolo,
+                               image_data, detection_mode, api_response, source):
+        """Push a new record or update the active sighting (see save_detection_result)"""
         if not self.is_connected():
             logger.error("❌ Firebase not connected")
             return None
         
+        if not self.deduper.enabled:
+            return self._push_detection_result(license_plate, confidence_api, confidence_yolo,
+                                               image_data, detection_mode, api_response, source)
+        
+        now = time.time()
+        with self.deduper.sighting(source, license_plate) as sighting:
+            if sighting.is_active(now, self.deduper.window):
+                fields = {'hit_count': sighting.hit_count + 1,
+                          'last_seen': datetime.now().isoformat()}
+                improved = (confidence_api or 0.0) > sighting.best_confidence
+                if improved:
+                    fields['confidence_api'] = confidence_api
+                    if confidence_yolo is not None:
+                        fields['confidence_yolo'] = confidence_yolo
+                if self._update_detection(sighting.doc_id, fields):
+                    sighting.hit(now, confidence_api)
+                    logger.info(f"🔁 Repeat sighting of {license_plate} from {source}: "
+                                f"{sighting.doc_id} (hit {sighting.hit_count})")
+                    return sighting.doc_id
+            
+            doc_id = self._push_detection_result(license_plate, confidence_api, confidence_yolo,
+                                                 image_data, detection_mode, api_response, source)
+            if doc_id:
+                sighting.start(doc_id, now, confidence_api)
+            return doc_id
+    
+    def _update_detection(self, doc_id, fields):
+        """
+        Update fields of an existing detection record
+        
+        Returns:
+            True if successful, False otherwise
+        """
+        if self.mock_mode:
+            for doc in self.mock_data:
+                if doc.get('id') == doc_id:
+                    doc.update(fields)
+                    return True
+            return False
+        
+        try:
+            if self.database:
+                self.database.child('license_plate_detections').child(doc_id).update(fields)
+            elif self.pyrebase_db:
+                self.pyrebase_db.child('license_plate_detections').child(doc_id).update(fields)
+            else:
+                return False
+            return True
+        except Exception as e:
+            logger.error(f"❌ Failed to update detection {doc_id}: {e}")
+            record_firebase_failure('update')
+            return False
+    
+    def _push_detection_result(self, license_plate, confidence_api, confidence_yolo,
+                               image_data, detection_mode, api_response, source):
+        """Push a new detection record (see save_detection_result)"""
         # Mock mode
         if self.mock_mode:
             # Province analysis priority: API response > License plate text analysis
@@ -134,7 +247,12 @@ class FirebaseManager:
                 'province': province,
                 'province_confidence': province_confidence,
                 'region': region,
-                'province_analysis_success': analysis_success
+                'province_analysis_success': analysis_success,
+                # Dedup information
+                'source': source,
+                'normalized_plate': normalize_plate(license_plate),
+                'last_seen': datetime.now().isoformat(),
+                'hit_count': 1
             }
             if confidence_yolo is not None:
                 mock_doc['confidence_yolo'] = confidence_yolo
@@ -145,6 +263,7 @@ class FirebaseManager:
                 mock_doc['has_image'] = False
             
             self.mock_data.append(mock_doc)
+            detection_rollups.record(None, detection_mode, province, region, confidence_api, confidence_yolo)
             logger.info(f"✅ Detection saved to Mock Firebase: {doc_id}")
             return doc_id
             
@@ -186,7 +305,12 @@ class FirebaseManager:
                 'province': province,
                 'province_confidence': province_confidence,
                 'region': region,
-                'province_analysis_success': analysis_success
+                'province_analysis_success': analysis_success,
+                # Dedup information
+                'source': source,
+                'normalized_plate': normalize_plate(license_plate),
+                'last_seen': datetime.now().isoformat(),
+                'hit_count': 1
             }
             
             # Add YOLO confidence if available
@@ -213,11 +337,13 @@ class FirebaseManager:
             else:
                 raise Exception("No database connection available")
             
+            detection_rollups.record(None, detection_mode, province, region, confidence_api, confidence_yolo)
             logger.info(f"✅ Detection saved to Firebase: {doc_id}")
             return doc_id
             
         except Exception as e:
             logger.error(f"❌ Failed to save detection: {e}")
+            record_firebase_failure('save')
             return None
     
     def get_recent_detections(self, limit=50):
@@ -270,6 +396,7 @@ class FirebaseManager:
             
         except Exception as e:
             logger.error(f"❌ Failed to get detections: {e}")
+            record_firebase_failure('recent')
             return []
     
     def get_detection_stats(self):
@@ -360,6 +487,7 @@ class FirebaseManager:
             
         except Exception as e:
             logger.error(f"❌ Failed to get stats: {e}")
+            record_firebase_failure('stats')
             return {}
     
     def search_detections(self, license_plate=None, start_date=None, end_date=None):
@@ -425,6 +553,7 @@ class FirebaseManager:
             
         except Exception as e:
             logger.error(f"❌ Search failed: {e}")
+            record_firebase_failure('search')
             return []
     
     def get_province_stats(self):
@@ -504,6 +633,7 @@ class FirebaseManager:
             
         except Exception as e:
             logger.error(f"❌ Failed to get province stats: {e}")
+            record_firebase_failure('province_stats')
             return {}
     
     def delete_detection(self, doc_id):
@@ -519,9 +649,13 @@ class FirebaseManager:
         if not self.is_connected():
             return False
         
+        # ป้ายที่เห็นซ้ำหลังจากนี้ต้อง push record ใหม่ ไม่ใช่อัปเดต record ที่ถูกลบ
+        self.deduper.purge(doc_id)
+        
         # Mock mode
         if self.mock_mode:
             self.mock_data = [d for d in self.mock_data if d.get('id') != doc_id]
+            response_cache.invalidate()
             logger.info(f"✅ Detection deleted from Mock Firebase: {doc_id}")
             return True
             
@@ -535,21 +669,190 @@ class FirebaseManager:
                 self.pyrebase_db.child('license_plate_detections').child(doc_id).remove()
             else:
                 return False
+            response_cache.invalidate()
             logger.info(f"✅ Detection deleted: {doc_id}")
             return True
             
         except Exception as e:
             logger.error(f"❌ Failed to delete detection: {e}")
+            record_firebase_failure('delete')
             return False
 
+    def get_detections_before(self, cutoff):
+        """
+        Get detections with a timestamp before the cutoff (for archiving)
+        
+        Records without a timestamp are never returned.
+        
+        Args:
+            cutoff: ISO timestamp
+            
+        Returns:
+            List of detection documents including 'id'
+        """
+        if not self.is_connected():
+            return []
+        
+        # Mock mode
+        if self.mock_mode:
+            return [dict(d) for d in self.mock_data if d.get('timestamp') and d['timestamp'] < cutoff]
+            
+        try:
+            # ใช้ query ตาม timestamp (ต้องมี .indexOn: timestamp ใน database rules) ถ้าไม่ได้ค่อยอ่านทั้ง node
+            try:
+                if self.database:
+                    docs = self.database.child('license_plate_detections').order_by_child('timestamp').end_at(cutoff).get()
+                elif self.pyrebase_db:
+                    docs = self.pyrebase_db.child('license_plate_detections').order_by_child('timestamp').end_at(cutoff).get()
+                    if hasattr(docs, 'val'):
+                        docs = docs.val()
+                else:
+                    return []
+            except Exception as query_error:
+                logger.warning(f"⚠️ Indexed query failed, reading all detections: {query_error}")
+                if self.database:
+                    docs = self.database.child('license_plate_detections').get()
+                else:
+                    docs = self.pyrebase_db.child('license_plate_detections').get()
+                    if hasattr(docs, 'val'):
+                        docs = docs.val()
+            
+            # end_at เรียง record ที่ไม่มี timestamp (null) ไว้ก่อน ต้องกรองออก ไม่งั้นจะถูกลบโดยไม่ได้ archive
+            return [dict(value, id=key) for key, value in (docs or {}).items()
+                    if isinstance(value, dict) and value.get('timestamp') and value['timestamp'] < cutoff]
+            
+        except Exception as e:
+            logger.error(f"❌ Failed to get old detections: {e}")
+            record_firebase_failure('archive_read')
+            return []
+    
+    def delete_detections(self, doc_ids, batch_size=500):
+        """
+        Delete many detection records with multi-path updates
+        
+        Args:
+            doc_ids: Document IDs to delete
+            batch_size: IDs per update request
+            
+        Returns:
+            int: Number of records deleted
+        """
+        if not self.is_connected() or not doc_ids:
+            return 0
+        
+        # Mock mode
+        if self.mock_mode:
+            ids = set(doc_ids)
+            before = len(self.mock_data)
+            self.mock_data = [d for d in self.mock_data if d.get('id') not in ids]
+            response_cache.invalidate()
+            return before - len(self.mock_data)
+            
+        deleted = 0
+        try:
+            for start in range(0, len(doc_ids), batch_size):
+                # ค่า None ใน multi-path update = ลบ path นั้น
+                update = {doc_id: None for doc_id in doc_ids[start:start + batch_size]}
+                if self.database:
+                    self.database.child('license_plate_detections').update(update)
+                elif self.pyrebase_db:
+                    self.pyrebase_db.child('license_plate_detections').update(update)
+                else:
+                    break
+                deleted += len(update)
+            logger.info(f"✅ Deleted {deleted} archived detections")
+            return deleted
+            
+        except Exception as e:
+            logger.error(f"❌ Failed to delete archived detections: {e}")
+            record_firebase_failure('archive_delete')
+            return deleted
+        finally:
+            if deleted:
+                response_cache.invalidate()
+    
+    def save_watchlist_alert(self, alert):
+        """
+        Push a watchlist alert to the watchlist_alerts node
+        
+        Clients subscribed to the node (e.g. the dashboard) receive it as a
+        realtime push event.
+        
+        Args:
+            alert: Alert document (plate, source, entry, kind, ...)
+            
+        Returns:
+            Alert ID if successful, None if failed
+        """
+        if not self.is_connected():
+            return None
+        
+        alert = dict(alert, timestamp=datetime.now().isoformat())
+        
+        # Mock mode
+        if self.mock_mode:
+            alert_id = f"mock_alert_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]}"
+            self.mock_alerts.append(dict(alert, id=alert_id))
+            return alert_id
+            
+        try:
+            if self.database:
+                alert_id = self.database.child('watchlist_alerts').push(alert).key
+            elif self.pyrebase_db:
+                alert_id = self.pyrebase_db.child('watchlist_alerts').push(alert)['name']
+            else:
+                return None
+            return alert_id
+            
+        except Exception as e:
+            logger.error(f"❌ Failed to save watchlist alert: {e}")
+            record_firebase_failure('watchlist_alert')
+            return None
+    
+    def get_watchlist_alerts(self, limit=50):
+        """
+        Get recent watchlist alerts (newest first)
+        
+        Args:
+            limit: Maximum number of results to return
+            
+        Returns:
+            List of alert documents
+        """
+        if not self.is_connected():
+            return []
+        
+        # Mock mode
+        if self.mock_mode:
+            return sorted(self.mock_alerts, key=lambda x: x['timestamp'], reverse=True)[:limit]
+            
+        try:
+            if self.database:
+                docs = self.database.child('watchlist_alerts').order_by_key().limit_to_last(limit).get()
+            elif self.pyrebase_db:
+                docs = self.pyrebase_db.child('watchlist_alerts').order_by_key().limit_to_last(limit).get()
+                if hasattr(docs, 'val'):
+                    docs = docs.val()
+            else:
+                return []
+            
+            alerts = [dict(value, id=key) for key, value in (docs or {}).items()]
+            alerts.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+            return alerts[:limit]
+            
+        except Exception as e:
+            logger.error(f"❌ Failed to get watchlist alerts: {e}")
+            record_firebase_failure('watchlist_alerts')
+            return []
+
 # Global Firebase manager instance
 firebase_manager = FirebaseManager()
 
 # Convenience functions for easy usage
-def save_detection(license_plate, confidence_api, confidence_yolo=None, detection_mode="manual"):
+def save_detection(license_plate, confidence_api, confidence_yolo=None, detection_mode="manual", source=None):
     """Convenience function to save detection"""
     return firebase_manager.save_detection_result(
-        license_plate, confidence_api, confidence_yolo, None, detection_mode
+        license_plate, confidence_api, confidence_yolo, None, detection_mode, source=source
     )
 
 def get_recent_detections(limit=50):
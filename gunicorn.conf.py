@@ -0,0 +1,98 @@
+"""
+========================================
+🦄 Gunicorn configuration
+========================================
+"""
+
+import os
+import sys
+import shutil
+import logging
+import subprocess
+
+from admission import ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE, required_threads
+from cpu_budget import THREAD_ENV_VARS, cpu_budget
+
+# โหลด app ครั้งเดียวใน master ก่อน fork (YOLO model ด้วยเมื่อ MODEL_LOAD_MODE=preload ดูด้านล่าง)
+preload_app = True
+
+# gthread: หลาย request ต่อ worker เพื่อให้ OCR (I/O) ซ้อนกันได้
+# admission control (admission.py) จำกัดจำนวนงานที่รันพร้อมกันต่อ worker: thread ต้องมากกว่า
+# in-flight + คิว ไม่งั้นคิวไม่เคยเกิดและไม่มี request ไหนได้ 503 (ไปค้างใน accept backlog แทน)
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS') or required_threads())
+if threads <= ADMISSION_MAX_IN_FLIGHT + ADMISSION_MAX_QUEUE:
+    logging.getLogger('gunicorn.error').warning(
+        f"GUNICORN_THREADS={threads} <= ADMISSION_MAX_IN_FLIGHT + ADMISSION_MAX_QUEUE "
+        f"({ADMISSION_MAX_IN_FLIGHT + ADMISSION_MAX_QUEUE}): detection requests will queue in gunicorn "
+        f"instead of being shed with 503")
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+
+# warm-up ใน master ด้วย torch thread เดียว เพื่อไม่ให้ OpenMP pool ค้างข้าม fork()
+# (เฉพาะ MODEL_LOAD_MODE=preload)
+os.environ.setdefault('LPR_PRELOAD_FORK_SAFE', '1')
+
+# INFERENCE_SERVER=1: โมเดลอยู่ใน inference_server.py process เดียว worker ส่งเฟรมผ่าน shared memory
+# (INFERENCE_ENGINE คือ engine ที่ server ใช้ ค่าเริ่มต้นตาม DETECTION_ENGINE เดิม)
+INFERENCE_SERVER = os.environ.get('INFERENCE_SERVER') == '1'
+if INFERENCE_SERVER:
+    os.environ.setdefault('INFERENCE_ENGINE', os.environ.get('DETECTION_ENGINE', 'pytorch'))
+    os.environ['DETECTION_ENGINE'] = 'remote'
+
+# ค่าเริ่มต้นภายใต้ gunicorn: โหลดโมเดลใน master ก่อน fork worker ทุกตัวใช้ weights ร่วมกันแบบ
+# copy-on-write และไม่ต้อง warm-up เอง (app.py รันตรงๆ ใช้ background)
+# ยกเว้น INFERENCE_SERVER=1: weights อยู่ใน server ซึ่งเริ่มใน on_starting หลังจาก preload app แล้ว
+os.environ.setdefault('MODEL_LOAD_MODE', 'background' if INFERENCE_SERVER else 'preload')
+_inference_process = None
+
+# แบ่ง core ให้ worker (CPU_PROFILE=latency|throughput) ต้องตั้ง OMP_NUM_THREADS ก่อน preload import torch
+# inference server ได้ค่าที่ผู้ดูแลตั้งไว้เดิม และคำนวณส่วนของตัวเอง (ทุก core)
+_operator_thread_env = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+cpu_budget.configure(workers=workers)
+cpu_budget.apply_environment()
+
+# ไม่เริ่ม background thread (Firebase / โหลดโมเดล) ใน master ให้แต่ละ worker เริ่มเองหลัง fork
+os.environ.setdefault('LPR_DEFER_BACKGROUND_INIT', '1')
+
+# Prometheus multiprocess: ล้างไฟล์ metrics ของรอบก่อนก่อนโหลด app
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/lpr_metrics')
+shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+
+def on_starting(server):
+    """เริ่ม inference server (ถ้าเปิดใช้) worker จะรอจนกว่า server โหลดโมเดลเสร็จ"""
+    global _inference_process
+    if INFERENCE_SERVER:
+        env = dict(os.environ)
+        for name, value in _operator_thread_env.items():
+            if value is None:
+                env.pop(name, None)
+            else:
+                env[name] = value
+        _inference_process = subprocess.Popen([sys.executable, '-m', 'inference_server'], env=env)
+
+
+def on_exit(server):
+    """หยุด inference server พร้อม gunicorn"""
+    if _inference_process is not None:
+        _inference_process.terminate()
+        try:
+            _inference_process.wait(10)
+        except subprocess.TimeoutExpired:
+            _inference_process.kill()
+
+
+def post_fork(server, worker):
+    """แบ่ง thread ของ torch / OpenCV ให้ worker หลัง fork และเริ่มเชื่อมต่อ backend ใน background"""
+    # จำนวน worker จริง (รวม -w บน command line) budget ถูกใช้ใน start_background_init
+    cpu_budget.configure(workers=server.cfg.workers)
+
+    from app import start_background_init
+    start_background_init()
+
+
+def child_exit(server, worker):
+    """ลบ metrics ของ worker ที่จบการทำงานออกจากการรวมผล"""
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
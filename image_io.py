@@ -0,0 +1,157 @@
+"""
+========================================
+🖼️ Image decoding for detection
+========================================
+
+Uploads are decoded at (roughly) the detection size instead of full
+resolution. The image header is read first; JPEGs are then decoded with
+OpenCV's DCT-scaled reduced modes (1/2, 1/4, 1/8) which are much faster
+and smaller than a full decode. The compressed bytes are kept so a
+higher resolution crop of the chosen bbox can be decoded later on demand.
+"""
+
+import os
+import logging
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+# ด้านยาวสุดของภาพที่ใช้ตรวจจับ (ภาพที่ใหญ่กว่านี้จะถูก decode แบบย่อ)
+DECODE_TARGET_SIZE = int(os.environ.get('DECODE_TARGET_SIZE', '1280'))
+
+# ความสูงขั้นต่ำของภาพป้ายที่ครอบตัด (pixel) ก่อนส่ง OCR
+CROP_MIN_HEIGHT = int(os.environ.get('CROP_MIN_HEIGHT', '96'))
+
+REDUCTION_FACTORS = (8, 4, 2, 1)
+
+
+def read_image_size(data):
+    """
+    Read (width, height) from the image header without decoding pixels
+
+    Args:
+        data: Encoded image bytes
+
+    Returns:
+        tuple: (width, height) or None if the header cannot be parsed
+    """
+    try:
+        from PIL import Image
+        with Image.open(BytesIO(data)) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def _reduced_flag(factor):
+    """cv2.imread flag สำหรับ decode แบบย่อ 1/factor"""
+    import cv2
+
+    return {
+        1: cv2.IMREAD_COLOR,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8
+    }[factor]
+
+
+def _decode(data, factor=1):
+    """Decode bytes at 1/factor resolution"""
+    import cv2
+    import numpy as np
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(buffer, _reduced_flag(factor))
+
+
+class DecodedImage:
+    def __init__(self, data, image, original_size):
+        """
+        Detection-sized image plus lazy access to the original resolution
+
+        Args:
+            data: Encoded image bytes (kept for high-resolution crops)
+            image: Decoded BGR array used for detection
+            original_size: (width, height) of the original image
+        """
+        self.data = data
+        self.image = image
+        self.original_size = original_size
+        self.scale = image.shape[1] / original_size[0]  # decoded / original
+
+    @property
+    def original_shape(self):
+        """(height, width) ของภาพต้นฉบับ ใช้แทน image.shape"""
+        return self.original_size[1], self.original_size[0]
+
+    def to_original(self, bbox):
+        """Map a bbox from decoded to original image coordinates"""
+        return [int(round(v / self.scale)) for v in bbox]
+
+    def crop_original(self, bbox, padding=10, min_height=CROP_MIN_HEIGHT):
+        """
+        Crop a bbox at the lowest resolution that still gives min_height pixels
+
+        Args:
+            bbox: [x1, y1, x2, y2] in original image coordinates
+            padding: Padding in pixels of the crop resolution
+            min_height: Minimum crop height before padding
+
+        Returns:
+            BGR numpy array of the crop
+        """
+        box_h = max(1, bbox[3] - bbox[1])
+        factor = next(f for f in REDUCTION_FACTORS if f == 1 or box_h / f >= min_height)
+
+        # ภาพที่ decode ไว้แล้วละเอียดพอ ไม่ต้อง decode ใหม่
+        if self.scale >= 1.0 / factor:
+            source, scale = self.image, self.scale
+        else:
+            source = _decode(self.data, factor)
+            scale = source.shape[1] / self.original_size[0]
+
+        h, w = source.shape[:2]
+        x1 = max(0, int(bbox[0] * scale) - padding)
+        y1 = max(0, int(bbox[1] * scale) - padding)
+        x2 = min(w, int(bbox[2] * scale) + padding)
+        y2 = min(h, int(bbox[3] * scale) + padding)
+        return source[y1:y2, x1:x2].copy()
+
+
+def decode_image(data, target_size=DECODE_TARGET_SIZE):
+    """
+    Decode an upload at detection size
+
+    Args:
+        data: Encoded image bytes
+        target_size: Maximum long side of the decoded image
+
+    Returns:
+        DecodedImage or None if the bytes are not a readable image
+    """
+    import cv2
+
+    size = read_image_size(data)
+    factor = 1
+    if size:
+        long_side = max(size)
+        factor = next((f for f in REDUCTION_FACTORS if long_side / f >= target_size), 1)
+
+    image = _decode(data, factor)
+    if image is None:
+        return None
+    if size is None:
+        size = (image.shape[1] * factor, image.shape[0] * factor)
+    elif size[0] != size[1] and (image.shape[1] > image.shape[0]) != (size[0] > size[1]):
+        # imdecode หมุนภาพตาม EXIF orientation แต่ header ยังเป็นขนาดก่อนหมุน
+        size = (size[1], size[0])
+
+    # reduced decode ได้แค่ 1/2, 1/4, 1/8 ย่อส่วนที่เหลือด้วย INTER_AREA
+    h, w = image.shape[:2]
+    if max(h, w) > target_size:
+        ratio = target_size / max(h, w)
+        image = cv2.resize(image, (int(w * ratio), int(h * ratio)), interpolation=cv2.INTER_AREA)
+
+    if factor > 1:
+        logger.debug(f"🖼️ Reduced decode 1/{factor}: {size[0]}x{size[1]} -> {image.shape[1]}x{image.shape[0]}")
+    return DecodedImage(data, image, size)
@@ -0,0 +1,279 @@
+"""
+========================================
+🛰️ Shared inference server
+========================================
+
+One process owns the detection model and every gunicorn worker sends it
+frames instead of loading its own copy (DETECTION_ENGINE=remote, see
+detection_engine.RemoteEngine). The model's memory is paid once however
+many workers run, and frames are inferred one at a time with all cores
+instead of every worker competing for them, so web workers can be scaled
+for OCR waits on their own.
+
+- Frames travel through shared memory: each worker owns a ring of
+  INFERENCE_SLOTS slots in one SharedMemory segment and the server wraps
+  a slot in a NumPy array without copying.
+- Every slot has its own Unix socket connection carrying small
+  length-prefixed JSON messages (frame shape and threshold in,
+  detections out).
+
+Started by gunicorn when INFERENCE_SERVER=1 (see gunicorn.conf.py), or
+on its own::
+
+    python inference_server.py
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import struct
+import threading
+import logging
+
+from cpu_budget import cpu_budget
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_SOCKET = os.environ.get('INFERENCE_SOCKET', '/tmp/lpr_inference.sock')
+# engine ที่ server ใช้จริง (pytorch / onnx)
+INFERENCE_ENGINE = os.environ.get('INFERENCE_ENGINE', 'pytorch')
+# slot ต่อ worker = จำนวนเฟรมที่ worker ส่งได้พร้อมกัน (request ตรวจจับที่ admission control ให้รันพร้อมกัน)
+INFERENCE_SLOTS = int(os.environ.get('INFERENCE_SLOTS', os.environ.get('ADMISSION_MAX_IN_FLIGHT', '4')))
+# ขนาดต่อ slot (MB) พอสำหรับภาพ 1280x1280 BGR หลัง decode แบบย่อ เฟรมที่ใหญ่กว่าใช้ segment ชั่วคราว
+INFERENCE_SLOT_BYTES = int(float(os.environ.get('INFERENCE_SLOT_MB', '5')) * 1024 * 1024)
+# เวลารอผลต่อเฟรมเมื่อ request ไม่มี deadline (ถ้ามี ใช้เวลาที่เหลือของ request แทน)
+INFERENCE_TIMEOUT = float(os.environ.get('INFERENCE_TIMEOUT', '30'))
+# เวลาที่ worker รอให้ server โหลดโมเดลเสร็จและเริ่มรับการเชื่อมต่อ (วินาที)
+INFERENCE_CONNECT_TIMEOUT = float(os.environ.get('INFERENCE_CONNECT_TIMEOUT', '120'))
+
+_HEADER = struct.Struct('!I')
+
+
+def send_message(sock, message):
+    """Send one length-prefixed JSON message"""
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Inference connection closed')
+        data += chunk
+    return bytes(data)
+
+
+def recv_message(sock):
+    """Receive one length-prefixed JSON message"""
+    size, = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return json.loads(_recv_exact(sock, size))
+
+
+def attach_shared_memory(name):
+    """Open a segment created by another process without taking ownership of it"""
+    from multiprocessing import resource_tracker
+    from multiprocessing.shared_memory import SharedMemory
+
+    shm = SharedMemory(name=name)
+    # Python < 3.13 ลงทะเบียน segment ที่แค่เปิดด้วย และจะ unlink ทิ้งเมื่อ process นี้จบ
+    # ทั้งที่ worker ยังใช้อยู่ worker ที่สร้าง segment เป็นผู้ unlink เอง
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def frame_view(shm, shape, dtype='uint8', offset=0):
+    """NumPy array over a region of shared memory (no copy)"""
+    import numpy as np
+
+    return np.ndarray(tuple(shape), dtype=dtype, buffer=shm.buf, offset=offset)
+
+
+def _close_shared_memory(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # ยังมี view ค้างอยู่ (เช่นใน traceback) ปล่อยให้ GC ปิดเอง
+        pass
+
+
+class InferenceServer:
+    def __init__(self, socket_path=INFERENCE_SOCKET, engine_name=INFERENCE_ENGINE, model_path=None):
+        """
+        Args:
+            socket_path: Unix socket to listen on
+            engine_name: Engine that owns the model ('pytorch' or 'onnx')
+            model_path: Path to YOLO weights (default MODEL_PATH)
+        """
+        from model_manager import MODEL_PATH, ModelManager
+
+        if engine_name == 'remote':
+            raise ValueError("INFERENCE_ENGINE must be a local engine ('pytorch' or 'onnx')")
+        self.socket_path = socket_path
+        self.model_manager = ModelManager(model_path or MODEL_PATH, engine_name)
+        self.requests = 0
+        self.connections = 0
+        self.started_at = time.time()
+        # ทีละเฟรม: engine ใช้ทุก core ภายใน call เดียวอยู่แล้ว
+        self._inference_lock = threading.Lock()
+
+    def info(self):
+        status = self.model_manager.status()
+        return {
+            'pid': os.getpid(),
+            'engine': status['engine'],
+            'model_path': status['model_path'],
+            'state': status['state'],
+            'frame_latency_ms': status['frame_latency_ms'],
+            'connections': self.connections,
+            'requests': self.requests,
+            'cpu_budget': cpu_budget.applied or None,
+            'uptime_s': round(time.time() - self.started_at, 1)
+        }
+
+    def serve_forever(self):
+        """Load the model, then accept worker connections"""
+        if self.model_manager.preload() is None:
+            raise RuntimeError(f"Failed to load model: {self.model_manager.error}")
+        cpu_budget.apply()
+
+        # bind หลังโหลดโมเดลเสร็จ worker ที่เชื่อมต่อได้จึงใช้งานได้ทันที
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(128)
+        logger.info(f"🛰️ Inference server listening on {self.socket_path}", extra=self.info())
+
+        try:
+            while True:
+                conn, _ = listener.accept()
+                threading.Thread(target=self._handle, args=(conn,), name='inference-conn', daemon=True).start()
+        finally:
+            listener.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def _handle(self, conn):
+        """Serve one worker slot connection until it closes"""
+        self.connections += 1
+        shm = None
+        offset = size = 0
+        try:
+            while True:
+                try:
+                    message = recv_message(conn)
+                except (ConnectionError, OSError):
+                    break
+
+                op = message.get('op')
+                if op == 'attach':
+                    if shm is not None:
+                        _close_shared_memory(shm)
+                        shm = None
+                    try:
+                        shm = attach_shared_memory(message['shm'])
+                        offset, size = message.get('offset', 0), message['size']
+                        reply = dict(self.info(), ok=True)
+                    except OSError as e:
+                        reply = {'ok': False, 'error': str(e)}
+                elif op == 'predict':
+                    reply = self._predict(message, shm, offset, size)
+                elif op == 'info':
+                    reply = dict(self.info(), ok=True)
+                else:
+                    reply = {'ok': False, 'error': f"Unknown op: {op}"}
+                try:
+                    send_message(conn, reply)
+                except OSError:
+                    break
+        finally:
+            self.connections -= 1
+            conn.close()
+            if shm is not None:
+                _close_shared_memory(shm)
+
+    def _predict(self, message, shm, offset, size):
+        """Run the engine on the frame a worker wrote into shared memory"""
+        import numpy as np
+
+        temp = None
+        try:
+            if message.get('shm'):
+                # เฟรมใหญ่กว่า slot: worker สร้าง segment ชั่วคราวสำหรับเฟรมนี้
+                temp = attach_shared_memory(message['shm'])
+                source, base, limit = temp, 0, temp.size
+            elif shm is None:
+                return {'ok': False, 'error': 'Slot not attached'}
+            else:
+                source, base, limit = shm, offset, size
+
+            shape, dtype = message['shape'], message.get('dtype', 'uint8')
+            if int(np.prod(shape)) * np.dtype(dtype).itemsize > limit:
+                return {'ok': False, 'error': 'Frame larger than its shared memory region'}
+
+            image = frame_view(source, shape, dtype, base)
+            start = time.perf_counter()
+            with self._inference_lock:
+                detections = self.model_manager.engine.predict(image, message.get('conf', 0.25),
+                                                               imgsz=message.get('imgsz'))
+            del image
+            self.requests += 1
+            return {'ok': True, 'detections': detections,
+                    'inference_ms': round((time.perf_counter() - start) * 1000, 1)}
+        except Exception as e:
+            logger.exception("❌ Inference failed")
+            return {'ok': False, 'error': str(e)}
+        finally:
+            if temp is not None:
+                _close_shared_memory(temp)
+
+
+def serve():
+    """Entry point of the server process"""
+    from log_config import setup_logging
+
+    # handler ของ supervisor ติดมากับ fork ให้ SIGTERM หยุด process นี้ตามปกติ
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    setup_logging()
+    # process นี้รันโมเดลทีละเฟรมด้วยทุก core (worker ฝั่ง web ไม่รัน inference)
+    cpu_budget.configure(workers=1, role='inference')
+    cpu_budget.apply_environment()
+    InferenceServer().serve_forever()
+
+
+def run_supervised(restart_delay=2.0):
+    """
+    Run the server in a child process and restart it when it dies
+
+    Workers reconnect (and re-attach their slots) on their next frame.
+    SIGTERM stops the child and exits.
+    """
+    import multiprocessing
+
+    child = None
+
+    def stop(signum, frame):
+        if child is not None and child.is_alive():
+            child.terminate()
+            child.join(10)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while True:
+        child = multiprocessing.Process(target=serve, name='inference-server')
+        child.start()
+        child.join()
+        logger.error(f"❌ Inference server exited with code {child.exitcode}, restarting in {restart_delay:.0f}s")
+        time.sleep(restart_delay)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    run_supervised()
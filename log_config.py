@@ -0,0 +1,169 @@
+"""
+========================================
+📝 Non-blocking structured logging
+========================================
+
+Request threads only put records on a bounded in-memory queue
+(QueueHandler); a background QueueListener thread formats them as JSON
+lines and writes to stdout. When the queue is full, records are dropped
+and counted instead of blocking the request.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+
+# สัดส่วนของ payload ขนาดใหญ่ (API response, result dict) ที่จะถูก log
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', '0.01'))
+
+# ฟิลด์มาตรฐานของ LogRecord ที่ไม่ต้องใส่ซ้ำใน JSON
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'request_id'}
+
+_listener = None
+_queue = None
+dropped_records = 0
+
+
+class RequestIdFilter(logging.Filter):
+    """แนบ request_id ของ Flask request ปัจจุบันให้ทุก record (รันใน thread ของ request)"""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = '-'
+            try:
+                from flask import g, has_request_context
+                if has_request_context():
+                    record.request_id = g.get('request_id', '-')
+            except Exception:
+                pass
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+            'pid': record.process
+        }
+        # extra={...} fields
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: drops the record when the queue is full"""
+
+    def enqueue(self, record):
+        global dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records += 1
+
+    def prepare(self, record):
+        # ไม่ format ข้อความใน request thread; แค่รวม args และตัด exc_info ที่ pickle ไม่ได้
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _start_listener():
+    """เริ่ม background writer thread"""
+    global _listener
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(_queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+
+
+def _restart_after_fork():
+    """thread ไม่ข้าม fork: worker ของ gunicorn ต้องเริ่ม writer thread ใหม่"""
+    global _queue
+    if _listener is None:
+        return
+    _queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            handler.queue = _queue
+    _start_listener()
+
+
+def _stop_listener():
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def setup_logging(level=LOG_LEVEL):
+    """
+    Route all logging through the non-blocking queue (idempotent)
+
+    Args:
+        level: Root log level name (DEBUG, INFO, WARNING, ...)
+    """
+    global _queue
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _listener is not None:
+        return
+
+    _queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(_queue)
+    handler.addFilter(RequestIdFilter())
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+
+    # werkzeug/urllib3 พิมพ์ทุก request ที่ระดับ INFO
+    logging.getLogger('werkzeug').setLevel(max(logging.WARNING, root.level))
+    logging.getLogger('urllib3').setLevel(max(logging.WARNING, root.level))
+
+    _start_listener()
+    atexit.register(_stop_listener)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def log_payload(logger, message, payload, level=logging.INFO, sample_rate=None):
+    """
+    Log a large payload for a sampled fraction of calls
+
+    The sampling decision is made before anything is serialized, and the
+    payload is serialized by the background writer, not the caller.
+
+    Args:
+        logger: Logger to use
+        message: Log message
+        payload: dict / str to attach as the 'payload' field
+        level: Log level
+        sample_rate: Override LOG_PAYLOAD_SAMPLE_RATE
+    """
+    rate = LOG_PAYLOAD_SAMPLE_RATE if sample_rate is None else sample_rate
+    if not logger.isEnabledFor(level) or random.random() >= rate:
+        return
+    if isinstance(payload, dict):
+        payload = dict(payload)
+    logger.log(level, message, extra={'payload': payload})
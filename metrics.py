@@ -0,0 +1,180 @@
+"""
+========================================
+📈 Pipeline metrics (Prometheus)
+========================================
+
+Uses prometheus_client in multiprocess mode: every gunicorn worker writes
+its samples to PROMETHEUS_MULTIPROC_DIR and /metrics aggregates all of
+them, so a scrape sees the whole server rather than one worker.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+METRICS_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR', '/tmp/lpr_metrics')
+
+# ต้องตั้งค่า env ก่อน import prometheus_client เพื่อเปิด multiprocess mode
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', METRICS_DIR)
+os.makedirs(METRICS_DIR, exist_ok=True)
+
+from prometheus_client import (  # noqa: E402
+    CollectorRegistry, Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+
+# Stage latency buckets: เร็วสุด (decode/crop) ถึงช้าสุด (OCR timeout 20s)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0)
+
+STAGE_LATENCY = Histogram(
+    'lpr_stage_duration_seconds', 'Latency of each detection pipeline stage',
+    ['stage'], buckets=STAGE_BUCKETS
+)
+REQUEST_LATENCY = Histogram(
+    'lpr_request_duration_seconds', 'End-to-end latency of detection endpoints',
+    ['endpoint'], buckets=STAGE_BUCKETS
+)
+YOLO_FRAMES = Counter(
+    'lpr_yolo_frames_total', 'Frames run through YOLO by outcome', ['outcome']
+)
+YOLO_DETECTIONS = Counter(
+    'lpr_yolo_detections_total', 'License plates detected by YOLO above threshold'
+)
+OCR_REQUESTS = Counter(
+    'lpr_ocr_requests_total', 'OCR calls by outcome', ['outcome']
+)
+OCR_BACKEND_CALLS = Counter(
+    'lpr_ocr_backend_calls_total', 'OCR backend chain calls by backend and outcome', ['backend', 'outcome']
+)
+DEADLINE_EXCEEDED = Counter(
+    'lpr_deadline_exceeded_total', 'Requests abandoned because the deadline budget ran out', ['stage']
+)
+ADMISSION_REJECTED = Counter(
+    'lpr_admission_rejected_total', 'Detection requests shed with 503 by priority', ['priority']
+)
+OCR_UPLOAD_BYTES = Histogram(
+    'lpr_ocr_upload_bytes', 'Image bytes uploaded per OCR call',
+    buckets=(1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144, 1048576, 4194304)
+)
+RESULT_CACHE = Counter(
+    'lpr_result_cache_total', 'Whole-result cache lookups by image hash', ['outcome']
+)
+WATCHLIST_ALERTS = Counter(
+    'lpr_watchlist_alerts_total', 'Watchlist alerts raised by match kind', ['kind']
+)
+FIREBASE_FAILURES = Counter(
+    'lpr_firebase_failures_total', 'Failed Firebase operations', ['operation']
+)
+RESPONSE_CACHE = Counter(
+    'lpr_response_cache_total', 'Dashboard response cache lookups by outcome', ['endpoint', 'outcome']
+)
+SCHEDULER_REJECTED = Counter(
+    'lpr_scheduler_rejected_total', 'Frames the fair scheduler did not run by reason', ['reason']
+)
+
+# OCR outcomes
+OCR_SUCCESS = 'success'
+OCR_NO_PLATE = 'no_plate'
+OCR_UNAUTHORIZED = 'unauthorized_401'
+OCR_RATE_LIMITED = 'rate_limited_429'
+OCR_TIMEOUT = 'timeout'
+OCR_CONNECTION_ERROR = 'connection_error'
+OCR_ERROR = 'error'
+OCR_SKIPPED_DEADLINE = 'skipped_deadline'
+OCR_SKIPPED_QUALITY = 'skipped_low_quality'
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Time a pipeline stage
+
+    Usage:
+        with stage_timer('yolo'):
+            detections = engine.predict(image)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+
+def record_yolo(detections):
+    """นับผลของ YOLO ต่อเฟรม"""
+    if detections:
+        YOLO_FRAMES.labels('found').inc()
+        YOLO_DETECTIONS.inc(len(detections))
+    else:
+        YOLO_FRAMES.labels('none' if detections is not None else 'error').inc()
+
+
+def record_ocr(outcome):
+    """นับผลการเรียก OCR"""
+    OCR_REQUESTS.labels(outcome).inc()
+
+
+def record_ocr_backend(backend, outcome):
+    """นับการเรียก OCR backend แต่ละตัวใน chain (success / failed)"""
+    OCR_BACKEND_CALLS.labels(backend, outcome).inc()
+
+
+def record_ocr_upload(num_bytes):
+    """บันทึกขนาดภาพที่ส่งไป OCR"""
+    OCR_UPLOAD_BYTES.observe(num_bytes)
+
+
+def record_deadline_exceeded(stage):
+    """นับ request ที่ถูกยกเลิกเพราะหมดงบเวลา"""
+    DEADLINE_EXCEEDED.labels(stage).inc()
+
+
+def record_admission_rejected(priority):
+    """นับ request ที่ถูกปฏิเสธเพราะ worker รับงานเต็ม"""
+    ADMISSION_REJECTED.labels(priority).inc()
+
+
+def record_result_cache(hit):
+    """นับผลการค้น result cache (hit / miss)"""
+    RESULT_CACHE.labels('hit' if hit else 'miss').inc()
+
+
+def record_response_cache(endpoint, outcome):
+    """นับผลการค้น response cache ของ dashboard (hit / miss / not_modified)"""
+    RESPONSE_CACHE.labels(endpoint, outcome).inc()
+
+
+def record_watchlist_alert(kind):
+    """นับการแจ้งเตือน watchlist"""
+    WATCHLIST_ALERTS.labels(kind).inc()
+
+
+def record_firebase_failure(operation):
+    """นับ Firebase operation ที่ล้มเหลว"""
+    FIREBASE_FAILURES.labels(operation).inc()
+
+
+def record_queue_wait(seconds):
+    """บันทึกเวลาที่เฟรมรอคิวของ scheduler ก่อนเข้าตรวจจับ"""
+    STAGE_LATENCY.labels('queue').observe(seconds)
+
+
+def record_scheduler_rejected(reason):
+    """นับเฟรมที่ scheduler ไม่ได้ส่งเข้าตรวจจับ (superseded / throttled / timed_out)"""
+    SCHEDULER_REJECTED.labels(reason).inc()
+
+
+def render_metrics():
+    """
+    Aggregate samples from every worker in Prometheus text format
+
+    Returns:
+        tuple: (body bytes, content type)
+    """
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """เรียกจาก gunicorn child_exit เพื่อล้างค่า gauge ของ worker ที่ตายแล้ว"""
+    multiprocess.mark_process_dead(pid)
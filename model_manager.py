@@ -0,0 +1,214 @@
+"""
+========================================
+🧠 YOLO Model Lifecycle Manager
+========================================
+"""
+
+import os
+import time
+import threading
+import logging
+from detection_engine import DETECTION_ENGINE, create_engine, measure_latency
+
+logger = logging.getLogger(__name__)
+
+# Model configuration
+MODEL_PATH = os.environ.get('MODEL_PATH', 'best.pt')  # หรือ 'models/best.pt' ถ้าอยู่ในโฟลเดอร์ models
+
+# ขนาดภาพสำหรับ warm-up (กว้างxสูง) ให้ตรงกับขนาดที่ webcam/upload ส่งมาบ่อย
+MODEL_WARMUP_SIZES = os.environ.get('MODEL_WARMUP_SIZES', '640x480,800x450,800x600,1280x720')
+
+# Model states
+STATE_NOT_LOADED = 'not_loaded'
+STATE_LOADING = 'loading'
+STATE_WARMING_UP = 'warming_up'
+STATE_READY = 'ready'
+STATE_FAILED = 'failed'
+
+
+def parse_warmup_sizes(value):
+    """
+    Parse warm-up sizes from a "640x480,1280x720" string
+
+    Args:
+        value: Comma separated WIDTHxHEIGHT list
+
+    Returns:
+        list: [(width, height), ...]
+    """
+    sizes = []
+    for item in (value or '').split(','):
+        item = item.strip().lower()
+        if not item:
+            continue
+        try:
+            width, height = item.split('x')
+            sizes.append((int(width), int(height)))
+        except ValueError:
+            logger.warning(f"⚠️ Invalid warm-up size ignored: {item}")
+    return sizes
+
+
+class ModelManager:
+    def __init__(self, model_path=MODEL_PATH, engine_name=DETECTION_ENGINE, warmup_sizes=None):
+        """
+        Manage loading and warm-up of the YOLO detection engine
+
+        The model is meant to be loaded once in the gunicorn master
+        (preload_app) so every forked worker shares the weights
+        copy-on-write instead of loading its own copy.
+
+        Args:
+            model_path: Path to YOLO weights
+            engine_name: Detection engine ('pytorch', 'onnx' or 'remote')
+            warmup_sizes: List of (width, height) dummy frame sizes
+        """
+        self.model_path = model_path
+        self.warmup_sizes = warmup_sizes if warmup_sizes is not None else parse_warmup_sizes(MODEL_WARMUP_SIZES)
+        self.engine_name = engine_name
+        self.engine = None
+        self.state = STATE_NOT_LOADED
+        self.error = None
+        self.load_time_ms = None
+        self.warmup_latency_ms = {}
+        self.frame_latency_ms = None
+        self.loaded_pid = None
+        self.loaded_at = None
+        self._lock = threading.RLock()
+
+    def load(self):
+        """
+        Load the detection engine (only once per process tree)
+
+        Returns:
+            Loaded engine or None if loading failed
+        """
+        with self._lock:
+            if self.engine is not None:
+                return self.engine
+
+            self.state = STATE_LOADING
+            start = time.perf_counter()
+            try:
+                self.engine = create_engine(self.model_path, self.engine_name)
+            except Exception as e:
+                self.state = STATE_FAILED
+                self.error = str(e)
+                logger.error(f"❌ Failed to load YOLO model: {e}")
+                return None
+
+            self.load_time_ms = (time.perf_counter() - start) * 1000
+            self.loaded_pid = os.getpid()
+            self.loaded_at = time.time()
+            self.error = None
+            logger.info(f"✅ YOLO model loaded: {self.model_path} [{self.engine_name}] ({self.load_time_ms:.0f} ms)")
+            return self.engine
+
+    def warmup(self, sizes=None, fork_safe=False):
+        """
+        Run dummy inferences so the first real request does not pay for
+        predictor setup, layer fusion and allocator growth
+
+        Args:
+            sizes: List of (width, height); defaults to configured sizes
+            fork_safe: Restrict torch to one thread while warming up so the
+                parent does not leave an OpenMP pool behind before fork()
+
+        Returns:
+            dict: Warm-up latency per size in milliseconds
+        """
+        with self._lock:
+            if self.engine is None:
+                return {}
+
+            import numpy as np
+
+            previous_threads = None
+            if fork_safe:
+                try:
+                    import torch
+                    previous_threads = torch.get_num_threads()
+                    torch.set_num_threads(1)
+                except Exception:
+                    previous_threads = None
+
+            self.state = STATE_WARMING_UP
+            latencies = {}
+            sizes = sizes or self.warmup_sizes
+            if self.engine_name == 'remote':
+                # โมเดล warm-up ใน inference server แล้ว ที่นี่แค่วัด latency รวม IPC
+                sizes = sizes[:1]
+            try:
+                for width, height in sizes:
+                    frame = np.zeros((height, width, 3), dtype=np.uint8)
+                    start = time.perf_counter()
+                    self.engine.predict(frame)
+                    latencies[f"{width}x{height}"] = round((time.perf_counter() - start) * 1000, 1)
+
+                # latency หลัง warm-up (steady state) ของเฟรมขนาดแรก
+                if sizes:
+                    width, height = sizes[0]
+                    self.frame_latency_ms = round(measure_latency(self.engine, width, height), 1)
+            except Exception as e:
+                # warm-up ล้มเหลวไม่ได้แปลว่าโมเดลใช้ไม่ได้
+                logger.warning(f"⚠️ Model warm-up failed: {e}")
+            finally:
+                if previous_threads is not None:
+                    import torch
+                    torch.set_num_threads(previous_threads)
+
+            self.warmup_latency_ms = latencies
+            self.state = STATE_READY
+            logger.info(f"🔥 YOLO warm-up done: {latencies}")
+            logger.info(f"⏱️ {self.engine_name} per-frame latency: {self.frame_latency_ms} ms"
+                        f"{' (single thread, pre-fork)' if fork_safe else ''}")
+            return latencies
+
+    def preload(self, fork_safe=False):
+        """
+        Load and warm up the engine
+
+        Called either in the gunicorn master before fork or from a background
+        thread in each worker. A request arriving while that is in progress
+        waits for it instead of warming up a second time.
+        """
+        with self._lock:
+            if self.load() is not None and self.state != STATE_READY:
+                self.warmup(fork_safe=fork_safe)
+            return self.engine
+
+    def get_engine(self):
+        """Return the loaded engine, loading lazily if preload was skipped"""
+        if self.engine is None and self.state != STATE_FAILED:
+            self.preload()
+        return self.engine
+
+    def is_ready(self):
+        """Check if the engine is loaded and warmed up"""
+        return self.state == STATE_READY and self.engine is not None
+
+    def status(self):
+        """
+        Get model lifecycle status for readiness checks
+
+        Returns:
+            dict: Model state, timings and process info
+        """
+        return {
+            'state': self.state,
+            'ready': self.is_ready(),
+            'model_path': self.model_path,
+            'engine': self.engine_name,
+            'load_time_ms': round(self.load_time_ms, 1) if self.load_time_ms is not None else None,
+            'warmup_latency_ms': self.warmup_latency_ms,
+            'frame_latency_ms': self.frame_latency_ms,
+            'loaded_pid': self.loaded_pid,
+            'worker_pid': os.getpid(),
+            'shared_from_parent': self.loaded_pid is not None and self.loaded_pid != os.getpid(),
+            'inference_server': getattr(self.engine, 'server_info', None),
+            'error': self.error
+        }
+
+
+# Global model manager instance
+model_manager = ModelManager()
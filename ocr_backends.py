@@ -0,0 +1,507 @@
+"""
+========================================
+🔤 OCR backends for reading plate crops
+========================================
+
+Every backend has one interface: ``recognize(image, timeout)`` takes an
+OcrImage (encoded bytes, a file path and/or the BGR crop array) and
+returns the same result dict::
+
+    {'success': True, 'license_plate': 'กข 1234', 'confidence': 0.93,
+     'raw_response': {'lp_number': 'กข 1234', 'conf': 93.0,
+                      'province': 'th-10:Bangkok (กรุงเทพมหานคร)'}}
+
+so province extraction (api_province_utils) and everything after OCR work
+unchanged whichever backend produced the read.
+
+- aiforthai: AIforThai LPR web API (encoded crop upload)
+- mock:      random plates for testing without the API
+- local:     small CRNN text recognizer in ONNX Runtime on CPU; reads the
+             crop array directly (registration line + province line)
+
+Backends are tried as a fallback chain (OCR_BACKENDS, or per request via
+the X-OCR-Backend header): the next backend runs when one fails or reads
+with less than OCR_FALLBACK_MIN_CONFIDENCE, e.g. ``local,aiforthai`` reads
+at the edge and asks the API only for hard plates, ``aiforthai,local``
+keeps reading when the connection is down.
+"""
+
+import os
+import time
+import difflib
+import threading
+import logging
+
+import metrics
+from log_config import log_payload
+
+logger = logging.getLogger(__name__)
+
+# AIforThai LPR API
+API_URL = "https://api.aiforthai.in.th/lpr-iapp"
+# API key จาก environment เท่านั้น (ไม่มี key = backend aiforthai ไม่พร้อมใช้งานและถูกข้ามใน chain)
+API_KEY = os.environ.get('AIFORTHAI_API_KEY', '')
+
+# Mock API สำหรับการทดสอบ (USE_MOCK_API=1) ไม่เปิดใน production: backend mock มีเฉพาะเมื่อเปิดเท่านั้น
+# ไม่งั้น client จะเลือก mock ผ่าน X-OCR-Backend แล้วได้ป้ายสุ่มที่ถูกบันทึกลง Firebase
+USE_MOCK_API = os.environ.get('USE_MOCK_API') == '1'
+MOCK_API_URL = "http://127.0.0.1:5001/mock-lpr"
+
+# request เลือก chain เองได้ เช่น "X-OCR-Backend: local,aiforthai"
+OCR_BACKEND_HEADER = 'X-OCR-Backend'
+
+# ลำดับ backend ที่ลอง (คั่นด้วย comma)
+OCR_BACKENDS = [b.strip() for b in os.environ.get('OCR_BACKENDS', 'mock' if USE_MOCK_API else 'aiforthai').split(',')
+                if b.strip()]
+# ผลที่ confidence ต่ำกว่านี้ให้ลอง backend ถัดไปใน chain (ถ้ามี)
+OCR_FALLBACK_MIN_CONFIDENCE = float(os.environ.get('OCR_FALLBACK_MIN_CONFIDENCE', '0.6'))
+
+# จำกัดจำนวนการเรียก OCR API พร้อมกันต่อ worker (batch jobs เรียกขนานกันได้ไม่เกินนี้)
+OCR_MAX_CONCURRENCY = int(os.environ.get('OCR_MAX_CONCURRENCY', '4'))
+
+# Local CRNN recognizer
+OCR_LOCAL_MODEL_PATH = os.environ.get('OCR_LOCAL_MODEL_PATH', 'models/thai_plate_crnn.onnx')
+# ตัวอักษรของโมเดล บรรทัดละตัว ตามลำดับ class (class 0 = CTC blank) ค่าว่าง = ไฟล์ .txt ชื่อเดียวกับโมเดล
+OCR_LOCAL_CHARSET_PATH = os.environ.get('OCR_LOCAL_CHARSET_PATH', '')
+OCR_LOCAL_HEIGHT = 32
+OCR_LOCAL_WIDTH = int(os.environ.get('OCR_LOCAL_WIDTH', '160'))
+OCR_LOCAL_THREADS = int(os.environ.get('OCR_LOCAL_THREADS', '1'))
+# ป้ายไทย 2 บรรทัด: ทะเบียนอยู่ส่วนบน ชื่อจังหวัดอยู่ส่วนล่าง (สัดส่วนความสูงของบรรทัดบน)
+PLATE_TOP_LINE_RATIO = 0.64
+# ความคล้ายขั้นต่ำของข้อความบรรทัดล่างกับชื่อจังหวัด
+PROVINCE_MATCH_CUTOFF = 0.6
+
+
+class OcrImage:
+    def __init__(self, data=None, mime_type='image/jpeg', path=None, array=None):
+        """
+        One plate image in whatever forms the caller already has
+
+        Backends take the form they need: the API uploads encoded bytes,
+        the local recognizer reads the array. Missing forms are produced
+        on first use (file read, decode or JPEG encode).
+
+        Args:
+            data: Encoded image bytes
+            mime_type: MIME type of data
+            path: Path of an image file
+            array: BGR numpy array (e.g. the plate crop)
+        """
+        self._data = data
+        self.mime_type = mime_type
+        self.path = path
+        self._array = array
+
+    def encoded(self):
+        """(bytes, mime type) for upload"""
+        if self._data is None:
+            if self.path is not None:
+                with open(self.path, 'rb') as f:
+                    self._data = f.read()
+            else:
+                import cv2
+
+                ok, buffer = cv2.imencode('.jpg', self._array, [cv2.IMWRITE_JPEG_QUALITY, 90])
+                if not ok:
+                    raise ValueError('Cannot encode image')
+                self._data, self.mime_type = buffer.tobytes(), 'image/jpeg'
+        return self._data, self.mime_type
+
+    def array(self):
+        """BGR numpy array"""
+        if self._array is None:
+            import cv2
+            import numpy as np
+
+            data, _ = self.encoded()
+            self._array = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if self._array is None:
+                raise ValueError('Cannot decode image')
+        return self._array
+
+
+def _no_plate(error, **fields):
+    return dict({'success': False, 'license_plate': '', 'confidence': 0, 'error': error}, **fields)
+
+
+class AIforThaiBackend:
+    name = 'aiforthai'
+
+    def __init__(self, api_url=API_URL, api_key=API_KEY, max_concurrency=OCR_MAX_CONCURRENCY):
+        """
+        AIforThai LPR web API
+
+        Args:
+            api_url: LPR endpoint
+            api_key: AIforThai API key
+            max_concurrency: Concurrent API calls per worker
+        """
+        self.api_url = api_url
+        self.api_key = api_key
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+
+    def is_available(self):
+        return bool(self.api_key)
+
+    def recognize(self, image, timeout):
+        import requests
+
+        try:
+            payload = {}
+            image_bytes, mime_type = image.encoded()
+            extension = 'webp' if mime_type == 'image/webp' else 'jpg'
+            files = [('file', (f'image.{extension}', image_bytes, mime_type))]
+            headers = {'apikey': self.api_key}
+            metrics.record_ocr_upload(len(image_bytes))
+
+            with self.semaphore:
+                response = requests.post(self.api_url, headers=headers, data=payload, files=files, timeout=timeout)
+
+            logger.info("API response", extra={'status_code': response.status_code,
+                                               'bytes_sent': len(image_bytes),
+                                               'elapsed_ms': round(response.elapsed.total_seconds() * 1000, 1)})
+            log_payload(logger, "API response body", response.text)
+
+            if response.status_code == 200:
+                api_result = response.json()
+
+                # ตรวจสอบโครงสร้าง response ใหม่
+                if api_result.get('status') == 200 and api_result.get('lp_number'):
+                    # API ใหม่ส่ง lp_number แทน LPR array
+                    metrics.record_ocr(metrics.OCR_SUCCESS)
+                    return {
+                        'success': True,
+                        'license_plate': api_result.get('lp_number', ''),
+                        'confidence': api_result.get('conf', 0) / 100.0,  # Convert percentage to decimal
+                        'raw_response': api_result
+                    }
+                elif 'LPR' in api_result and len(api_result['LPR']) > 0:
+                    # Old API format fallback
+                    lpr_data = api_result['LPR'][0]
+                    metrics.record_ocr(metrics.OCR_SUCCESS)
+                    return {
+                        'success': True,
+                        'license_plate': lpr_data.get('plate', ''),
+                        'confidence': lpr_data.get('confidence', 0),
+                        'raw_response': api_result
+                    }
+                else:
+                    metrics.record_ocr(metrics.OCR_NO_PLATE)
+                    return _no_plate('ไม่พบป้ายทะเบียนในภาพ', raw_response=api_result)
+            elif response.status_code == 401:
+                metrics.record_ocr(metrics.OCR_UNAUTHORIZED)
+                return {
+                    'success': False,
+                    'error': 'API Key ไม่ถูกต้องหรือหมดอายุ - กรุณาติดต่อผู้ดูแลระบบ',
+                    'message': response.text
+                }
+            elif response.status_code == 429:
+                metrics.record_ocr(metrics.OCR_RATE_LIMITED)
+                return {
+                    'success': False,
+                    'error': 'API Rate Limit - เรียกใช้บ่อยเกินไป กรุณารอสักครู่',
+                    'message': response.text
+                }
+            else:
+                metrics.record_ocr(metrics.OCR_ERROR)
+                return {
+                    'success': False,
+                    'error': f'API Error: {response.status_code}',
+                    'message': response.text
+                }
+
+        except requests.exceptions.Timeout:
+            metrics.record_ocr(metrics.OCR_TIMEOUT)
+            return {
+                'success': False,
+                'error': 'API Timeout - เชื่อมต่อเซิร์ฟเวอร์ช้าเกินไป'
+            }
+        except requests.exceptions.ConnectionError:
+            metrics.record_ocr(metrics.OCR_CONNECTION_ERROR)
+            return {
+                'success': False,
+                'error': 'Connection Error - ไม่สามารถเชื่อมต่อเซิร์ฟเวอร์ได้'
+            }
+        except Exception as e:
+            metrics.record_ocr(metrics.OCR_ERROR)
+            return {
+                'success': False,
+                'error': f'Error calling LPR API: {str(e)}'
+            }
+
+
+class MockBackend:
+    name = 'mock'
+
+    def is_available(self):
+        return True
+
+    def recognize(self, image, timeout):
+        import random
+
+        logger.debug("🎭 Using Mock API", extra={'url': MOCK_API_URL})
+
+        # จำลองการประมวลผล
+        time.sleep(random.uniform(0.2, 0.8))
+
+        # 70% chance ตรวจพบป้าย
+        if random.random() < 0.7:
+            mock_plates = ["กข 1234", "1กก 2345", "ตณ 3754", "2กร 5678", "บจ 9876"]
+            plate = random.choice(mock_plates)
+            confidence = random.uniform(80, 95)
+
+            metrics.record_ocr(metrics.OCR_SUCCESS)
+            return {
+                'success': True,
+                'license_plate': plate,
+                'confidence': confidence / 100.0,
+                'mock': True,
+                'raw_response': {'lp_number': plate, 'conf': confidence}
+            }
+        else:
+            metrics.record_ocr(metrics.OCR_NO_PLATE)
+            return _no_plate('ไม่พบป้ายทะเบียนในภาพ (Mock)', mock=True)
+
+
+def ctc_greedy_decode(logits, charset):
+    """
+    Best-path CTC decoding
+
+    Args:
+        logits: (T, C) array of class scores per time step (class 0 = blank)
+        charset: Characters for classes 1..C-1
+
+    Returns:
+        tuple: (text, confidence = mean probability of the emitted characters)
+    """
+    import numpy as np
+
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    probs = np.exp(shifted) / np.exp(shifted).sum(axis=1, keepdims=True)
+    best = probs.argmax(axis=1)
+
+    chars, scores = [], []
+    previous = 0
+    for step, cls in enumerate(best):
+        if cls != 0 and cls != previous and cls - 1 < len(charset):
+            chars.append(charset[cls - 1])
+            scores.append(probs[step, cls])
+        previous = cls
+    return ''.join(chars), float(np.mean(scores)) if scores else 0.0
+
+
+def match_province(text, cutoff=PROVINCE_MATCH_CUTOFF):
+    """
+    Closest province name to the OCR text of the province line
+
+    Returns:
+        tuple: (province or None, similarity)
+    """
+    from province_utils import THAI_PROVINCES
+
+    text = ''.join(text.split())
+    if not text:
+        return None, 0.0
+    names = {alias: province for province, aliases in THAI_PROVINCES.items()
+             for alias in [province] + aliases if len(alias) > 3}
+    match = difflib.get_close_matches(text, names, n=1, cutoff=cutoff)
+    if not match:
+        return None, 0.0
+    return names[match[0]], difflib.SequenceMatcher(None, text, match[0]).ratio()
+
+
+def format_registration(text):
+    """'1กก2345' -> '1กก 2345' (เว้นวรรคระหว่างหมวดอักษรกับตัวเลข เหมือนผลของ API)"""
+    text = ''.join(text.split())
+    split_at = len(text)
+    while split_at > 0 and text[split_at - 1].isdigit():
+        split_at -= 1
+    if 0 < split_at < len(text):
+        return f"{text[:split_at]} {text[split_at:]}"
+    return text
+
+
+class LocalCrnnBackend:
+    name = 'local'
+
+    def __init__(self, model_path=OCR_LOCAL_MODEL_PATH, charset_path=OCR_LOCAL_CHARSET_PATH):
+        """
+        CRNN text recognizer in ONNX Runtime on CPU
+
+        The model takes a (N, 1, 32, W) grayscale batch in [0, 1] and
+        returns per-time-step class scores (N, T, C) or (T, N, C) for CTC.
+        The session is created on first use.
+
+        Args:
+            model_path: Path to the .onnx recognizer
+            charset_path: Characters of the model, one per line (default: <model>.txt)
+        """
+        self.model_path = model_path
+        self.charset_path = charset_path or os.path.splitext(model_path)[0] + '.txt'
+        self.session = None
+        self.charset = None
+        self._lock = threading.Lock()
+
+    def is_available(self):
+        return os.path.exists(self.model_path) and os.path.exists(self.charset_path)
+
+    def _load(self):
+        with self._lock:
+            if self.session is None:
+                import onnxruntime as ort
+
+                options = ort.SessionOptions()
+                options.intra_op_num_threads = OCR_LOCAL_THREADS
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                with open(self.charset_path, 'r', encoding='utf-8') as f:
+                    self.charset = [line.rstrip('\n') for line in f if line.rstrip('\n')]
+                self.session = ort.InferenceSession(self.model_path, sess_options=options,
+                                                    providers=['CPUExecutionProvider'])
+                self.input_name = self.session.get_inputs()[0].name
+                logger.info(f"🔤 Local OCR model loaded: {self.model_path} ({len(self.charset)} chars)")
+        return self.session
+
+    @staticmethod
+    def _prepare_line(gray):
+        """Line image -> (1, 32, W) float32, aspect kept and right-padded"""
+        import cv2
+        import numpy as np
+
+        h, w = gray.shape[:2]
+        new_w = max(1, min(OCR_LOCAL_WIDTH, int(round(w * OCR_LOCAL_HEIGHT / max(1, h)))))
+        resized = cv2.resize(gray, (new_w, OCR_LOCAL_HEIGHT), interpolation=cv2.INTER_AREA)
+        line = np.zeros((OCR_LOCAL_HEIGHT, OCR_LOCAL_WIDTH), dtype=np.float32)
+        line[:, :new_w] = resized.astype(np.float32) / 255.0
+        return line[None]
+
+    def read_lines(self, crop):
+        """
+        Recognize the registration and province lines of a plate crop
+
+        Returns:
+            list: [(text, confidence), (text, confidence)] for top and bottom line
+        """
+        import cv2
+        import numpy as np
+
+        session = self._load()
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+        split = int(round(gray.shape[0] * PLATE_TOP_LINE_RATIO))
+        batch = np.stack([self._prepare_line(gray[:split]), self._prepare_line(gray[split:])])
+
+        output = session.run(None, {self.input_name: batch})[0]
+        if output.shape[0] != len(batch):
+            output = output.transpose(1, 0, 2)  # (T, N, C) -> (N, T, C)
+        return [ctc_greedy_decode(logits, self.charset) for logits in output]
+
+    def recognize(self, image, timeout):
+        try:
+            (plate_text, plate_conf), (province_text, _) = self.read_lines(image.array())
+        except Exception as e:
+            metrics.record_ocr(metrics.OCR_ERROR)
+            logger.exception("❌ Local OCR failed")
+            return {'success': False, 'error': f'Local OCR error: {str(e)}'}
+
+        license_plate = format_registration(plate_text)
+        if not license_plate:
+            metrics.record_ocr(metrics.OCR_NO_PLATE)
+            return _no_plate('ไม่พบป้ายทะเบียนในภาพ (Local OCR)', raw_response={'lp_number': '', 'conf': 0})
+
+        province, similarity = match_province(province_text)
+        raw_response = {'lp_number': license_plate, 'conf': round(plate_conf * 100, 2),
+                        'province_text': province_text, 'province_similarity': round(similarity, 3)}
+        if province:
+            # รูปแบบเดียวกับ AIforThai: "<code>:<name> (<ชื่อไทย>)" ให้ api_province_utils อ่านได้
+            raw_response['province'] = f"local:{province} ({province})"
+        metrics.record_ocr(metrics.OCR_SUCCESS)
+        return {
+            'success': True,
+            'license_plate': license_plate,
+            'confidence': plate_conf,
+            'raw_response': raw_response
+        }
+
+
+class OcrChain:
+    def __init__(self, backends, default=OCR_BACKENDS, min_confidence=OCR_FALLBACK_MIN_CONFIDENCE):
+        """
+        Registry of OCR backends and the fallback order
+
+        Args:
+            backends: Backend instances
+            default: Backend names tried in order when a request does not choose
+            min_confidence: Reads below this confidence fall through to the next backend
+        """
+        self.backends = {backend.name: backend for backend in backends}
+        unknown = [name for name in default if name not in self.backends]
+        if unknown:
+            raise ValueError(f"Unknown OCR backend(s): {', '.join(unknown)}")
+        self.default = list(default)
+        self.min_confidence = min_confidence
+
+    def parse(self, value):
+        """
+        Backend names from a request header / parameter ('local,aiforthai')
+
+        Returns:
+            list or None when nothing valid was given (use the default chain)
+        """
+        names = [n.strip().lower() for n in (value or '').split(',')]
+        names = [n for n in names if n in self.backends]
+        return names or None
+
+    def recognize(self, image, timeout, names=None, deadline=None):
+        """
+        Read a plate with the first backend that gives a confident answer
+
+        Args:
+            image: OcrImage
+            timeout: Maximum seconds per backend call
+            names: Backend names in order (default chain when None)
+            deadline: Request deadline; later backends are skipped when it runs short
+
+        Returns:
+            dict: Result of the backend that answered (best read if none was
+                  confident) with 'backend' and 'ocr_attempts'
+        """
+        attempts = []
+        best = None
+        for index, name in enumerate(names or self.default):
+            backend = self.backends[name]
+            if not backend.is_available():
+                attempts.append({'backend': name, 'success': False, 'error': 'unavailable'})
+                continue
+            if deadline is not None and index > 0 and not deadline.allows_ocr():
+                break
+
+            start = time.perf_counter()
+            result = backend.recognize(image, deadline.timeout_for(timeout) if deadline else timeout)
+            elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+            result['backend'] = name
+            attempts.append({'backend': name, 'success': result.get('success', False),
+                             'confidence': result.get('confidence', 0), 'ms': elapsed_ms,
+                             'error': result.get('error')})
+            metrics.record_ocr_backend(name, 'success' if result.get('success') else 'failed')
+
+            if best is None or (result.get('success'), result.get('confidence', 0)) > \
+                    (best.get('success'), best.get('confidence', 0)):
+                best = result
+            if result.get('success') and result.get('confidence', 0) >= self.min_confidence:
+                break
+
+        if best is None:
+            best = {'success': False, 'license_plate': '', 'confidence': 0,
+                    'error': 'ไม่มี OCR backend ที่ใช้งานได้'}
+        best['ocr_attempts'] = attempts
+        return best
+
+    def status(self):
+        return {
+            'default': self.default,
+            'min_confidence': self.min_confidence,
+            'available': {name: backend.is_available() for name, backend in self.backends.items()}
+        }
+
+
+# Global OCR chain instance
+ocr_chain = OcrChain([AIforThaiBackend(), LocalCrnnBackend()] + ([MockBackend()] if USE_MOCK_API else []))
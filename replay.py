@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+========================================
+🔁 Offline replay of the detection pipeline
+========================================
+
+Runs decode -> YOLO -> crop -> quality -> encode -> OCR -> province
+analysis over a directory or manifest of images without the web server,
+on a pool of processes (each loads its own engine, CPU threads split by
+cpu_budget). Results are streamed as they finish to JSONL or CSV, and a
+throughput / per-stage time summary is printed at the end.
+
+    python replay.py archive/2024-05/ -o results.jsonl
+    python replay.py manifest.csv -o results.csv --workers 8 --no-ocr
+    MODEL_PATH=new_best.pt python replay.py test_images/ --no-ocr -o new.jsonl
+
+A manifest is a text file with one path per line, a CSV with a ``path``
+column or JSONL with a ``path`` field; an optional ``source`` column /
+field selects the camera settings (ROI, imgsz) of that image. Relative
+paths are resolved from the manifest's folder.
+
+Firebase is not written unless --firebase is given.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+from contextlib import contextmanager
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
+MANIFEST_EXTENSIONS = {'txt', 'lst', 'csv', 'jsonl'}
+STAGES = ('read', 'decode', 'yolo', 'crop', 'quality', 'encode', 'ocr', 'province', 'firebase')
+
+CSV_COLUMNS = ['index', 'path', 'source', 'success', 'license_plate', 'confidence', 'yolo_confidence',
+               'bbox', 'province', 'province_confidence', 'region', 'ocr_backend', 'skipped',
+               'firebase_doc_id', 'error', 'total_ms']
+
+# ตัวแปรของแต่ละ process ใน pool (ตั้งใน _init_worker)
+_options = None
+_pipeline = None
+
+
+def _extension(path):
+    return path.rsplit('.', 1)[1].lower() if '.' in os.path.basename(path) else ''
+
+
+def iter_items(target, recursive=False, default_source='replay'):
+    """
+    Images to replay from a directory, a single image or a manifest
+
+    Yields:
+        tuple: (path, source)
+    """
+    if os.path.isdir(target):
+        if recursive:
+            for root, dirs, files in os.walk(target):
+                dirs.sort()
+                for name in sorted(files):
+                    if _extension(name) in IMAGE_EXTENSIONS:
+                        yield os.path.join(root, name), default_source
+        else:
+            for name in sorted(os.listdir(target)):
+                if _extension(name) in IMAGE_EXTENSIONS:
+                    yield os.path.join(target, name), default_source
+        return
+
+    extension = _extension(target)
+    if extension in IMAGE_EXTENSIONS:
+        yield target, default_source
+        return
+    if extension not in MANIFEST_EXTENSIONS:
+        raise ValueError(f"Not an image folder, image or manifest (.txt/.csv/.jsonl): {target}")
+
+    base = os.path.dirname(os.path.abspath(target))
+    with open(target, 'r', encoding='utf-8', newline='') as f:
+        if extension == 'csv':
+            rows = csv.DictReader(f)
+        elif extension == 'jsonl':
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = ({'path': line.strip()} for line in f if line.strip() and not line.startswith('#'))
+        for row in rows:
+            path = row.get('path') or row.get('filename')
+            if path:
+                yield os.path.join(base, path), row.get('source') or default_source
+
+
+@contextmanager
+def _timed(timings, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def _init_worker(options):
+    """Load the pipeline once per pool process"""
+    global _options, _pipeline
+
+    _options = options
+    # ค่าเหล่านี้อ่านตอน import จึงต้องตั้งก่อน import app / model_manager
+    os.environ['LPR_DEFER_BACKGROUND_INIT'] = '1'
+    os.environ['MODEL_LOAD_MODE'] = 'background'
+    if options['model']:
+        os.environ['MODEL_PATH'] = options['model']
+    if options['engine']:
+        os.environ['DETECTION_ENGINE'] = options['engine']
+
+    from cpu_budget import cpu_budget
+
+    # process ใน pool คือ worker ที่รัน inference คนละเฟรม
+    cpu_budget.configure(workers=options['workers'])
+    cpu_budget.apply_environment()
+
+    import app as pipeline
+    from model_manager import model_manager
+
+    if model_manager.preload() is None:
+        raise RuntimeError(f"Failed to load model: {model_manager.error}")
+    cpu_budget.apply()
+    if options['firebase']:
+        pipeline.firebase_manager.connect()
+    _pipeline = pipeline
+
+
+def _province(api_result, license_plate):
+    """จังหวัดจากผล OCR ก่อน แล้วจึงวิเคราะห์จากข้อความป้าย (ลำดับเดียวกับตอนบันทึก Firebase)"""
+    from api_province_utils import extract_province_from_api_response
+    from province_utils import analyze_license_plate
+
+    province, confidence, region = extract_province_from_api_response(api_result)
+    if province:
+        return province, confidence, region
+    analysis = analyze_license_plate(license_plate)
+    return analysis.get('province'), analysis.get('province_confidence', 0.0), analysis.get('region', 'ไม่ระบุ')
+
+
+def _process_item(item):
+    index, (path, source) = item
+    timings = {}
+    result = {'index': index, 'path': path, 'source': source, 'success': False}
+    start = time.perf_counter()
+    try:
+        _run_pipeline(path, source, result, timings)
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    result['timings'] = {stage: round(ms, 2) for stage, ms in timings.items()}
+    result['total_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+def _run_pipeline(path, source, result, timings):
+    from image_io import decode_image
+    from crop_quality import score_crop
+    from crop_encoding import encode_crop
+
+    with _timed(timings, 'read'):
+        with open(path, 'rb') as f:
+            data = f.read()
+    with _timed(timings, 'decode'):
+        decoded = decode_image(data)
+    if decoded is None:
+        result['error'] = 'ไม่สามารถอ่านไฟล์ภาพได้'
+        return
+
+    with _timed(timings, 'yolo'):
+        detections = _pipeline.detect_license_plate_yolo(decoded, _options['confidence'], source)
+    if detections is None:
+        result['error'] = 'YOLO detection failed'
+        return
+    result['detections'] = len(detections)
+    if not detections:
+        result['error'] = 'ไม่พบป้ายทะเบียนในภาพ'
+        return
+
+    best_detection = max(detections, key=lambda d: d['confidence'])
+    result['yolo_confidence'] = best_detection['confidence']
+    result['bbox'] = best_detection['bbox']
+
+    with _timed(timings, 'crop'):
+        cropped = _pipeline.crop_license_plate(decoded, best_detection['bbox'])
+    if cropped is None:
+        result['error'] = 'ไม่สามารถครอบตัดภาพป้ายทะเบียนได้'
+        return
+
+    with _timed(timings, 'quality'):
+        quality = score_crop(cropped, (best_detection['bbox'][2] - best_detection['bbox'][0],
+                                       best_detection['bbox'][3] - best_detection['bbox'][1]))
+    result['quality'] = quality
+    if not quality['passed'] and not _options['ignore_quality']:
+        result['skipped'] = 'low_quality'
+        result['error'] = f"คุณภาพภาพต่ำ ({', '.join(quality['reasons'])})"
+        return
+
+    if _options['no_ocr']:
+        # ตรวจจับได้ถือว่าสำเร็จเมื่อไม่อ่านป้าย (เช่นเทียบ best.pt รุ่นใหม่)
+        result['success'] = True
+        result['skipped'] = 'ocr'
+        return
+
+    with _timed(timings, 'encode'):
+        encoded = encode_crop(cropped)
+    if encoded is None:
+        result['error'] = 'ไม่สามารถ encode ภาพป้ายทะเบียนได้'
+        return
+
+    with _timed(timings, 'ocr'):
+        api_result = _pipeline.send_to_lpr_api(encoded.data, _pipeline.OCR_TIMEOUT, encoded.mime_type,
+                                               array=cropped, backends=_options['ocr_backends'])
+    result['success'] = api_result.get('success', False)
+    result['license_plate'] = api_result.get('license_plate', '')
+    result['confidence'] = api_result.get('confidence', 0)
+    result['ocr_backend'] = api_result.get('backend')
+    result['ocr_attempts'] = api_result.get('ocr_attempts')
+    if not result['success']:
+        result['error'] = api_result.get('error')
+        return
+
+    with _timed(timings, 'province'):
+        result['province'], result['province_confidence'], result['region'] = \
+            _province(api_result, result['license_plate'])
+
+    if _options['firebase'] and result['license_plate']:
+        with _timed(timings, 'firebase'):
+            result['firebase_doc_id'] = _pipeline.firebase_manager.save_detection_result(
+                license_plate=result['license_plate'],
+                confidence_api=result['confidence'],
+                confidence_yolo=result['yolo_confidence'],
+                detection_mode='auto',
+                api_response=api_result,
+                source=source
+            )
+
+
+class ResultWriter:
+    def __init__(self, output, fmt):
+        """
+        Args:
+            output: Output path, or '-' for stdout
+            fmt: 'jsonl' or 'csv'
+        """
+        self.file = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+        self.fmt = fmt
+        self.writer = None
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(self.file, fieldnames=CSV_COLUMNS, extrasaction='ignore')
+            self.writer.writeheader()
+
+    def write(self, result):
+        if self.writer is not None:
+            row = dict(result)
+            row['bbox'] = ' '.join(str(v) for v in row['bbox']) if row.get('bbox') else ''
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(result, ensure_ascii=False) + '\n')
+        # ผลถูกเขียนทันทีที่เสร็จ หยุดกลางทางแล้วยังใช้ผลที่ได้แล้วได้
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class ReplayStats:
+    """Counts and per-stage timings of a replay run"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.images = 0
+        self.detected = 0
+        self.read = 0
+        self.skipped = {}
+        self.errors = 0
+        self.stage_ms = {stage: [] for stage in STAGES}
+        self.total_ms = []
+
+    def add(self, result):
+        self.images += 1
+        if result.get('bbox'):
+            self.detected += 1
+        if result.get('license_plate'):
+            self.read += 1
+        if result.get('skipped'):
+            self.skipped[result['skipped']] = self.skipped.get(result['skipped'], 0) + 1
+        if result.get('detections') is None:
+            # อ่าน / decode ไม่ได้ หรือ YOLO ล้มเหลว (ไม่ใช่แค่ไม่พบป้าย)
+            self.errors += 1
+        for stage, ms in result['timings'].items():
+            self.stage_ms[stage].append(ms)
+        self.total_ms.append(result['total_ms'])
+
+    @staticmethod
+    def _percentile(values, q):
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    def report(self, workers):
+        elapsed = time.perf_counter() - self.started_at
+        busy_ms = sum(self.total_ms) or 1.0
+        lines = [
+            f"images={self.images} detected={self.detected} read={self.read} "
+            f"skipped={self.skipped or 0} errors={self.errors}",
+            f"elapsed={elapsed:.1f}s throughput={self.images / elapsed if elapsed else 0:.2f} img/s "
+            f"workers={workers} utilization={busy_ms / 1000 / (elapsed * workers) if elapsed else 0:.0%}",
+            f"{'stage':<10}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'share':>8}"
+        ]
+        for stage in STAGES:
+            values = self.stage_ms[stage]
+            if not values:
+                continue
+            lines.append(f"{stage:<10}{len(values):>8}{sum(values) / len(values):>10.1f}"
+                         f"{self._percentile(values, 0.5):>10.1f}{self._percentile(values, 0.95):>10.1f}"
+                         f"{sum(values) / busy_ms:>8.0%}")
+        if self.total_ms:
+            lines.append(f"{'total':<10}{len(self.total_ms):>8}{busy_ms / len(self.total_ms):>10.1f}"
+                         f"{self._percentile(self.total_ms, 0.5):>10.1f}"
+                         f"{self._percentile(self.total_ms, 0.95):>10.1f}{'100%':>8}")
+        return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the detection pipeline over images offline')
+    parser.add_argument('target', help='Image folder, image file or manifest (.txt / .csv / .jsonl)')
+    parser.add_argument('-o', '--output', default='-', help='Output file (default: stdout)')
+    parser.add_argument('--format', choices=['jsonl', 'csv'],
+                        help='Output format (default: from the output extension, else jsonl)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Pool processes')
+    parser.add_argument('--confidence', type=float, default=0.7, help='YOLO confidence threshold')
+    parser.add_argument('--source', default='replay', help='Camera source when the manifest has none')
+    parser.add_argument('--recursive', action='store_true', help='Include sub-folders')
+    parser.add_argument('--model', help='YOLO weights (default MODEL_PATH)')
+    parser.add_argument('--engine', choices=['pytorch', 'onnx'], help='Detection engine (default DETECTION_ENGINE)')
+    parser.add_argument('--no-ocr', action='store_true', help='Stop after detection / crop quality')
+    parser.add_argument('--ocr-backend', help='OCR backend chain, e.g. local,aiforthai (default OCR_BACKENDS)')
+    parser.add_argument('--ignore-quality', action='store_true', help='OCR crops that fail the quality filter')
+    parser.add_argument('--firebase', action='store_true', help='Save read plates to Firebase')
+    parser.add_argument('--limit', type=int, help='Stop after this many images')
+    args = parser.parse_args()
+
+    fmt = args.format or ('csv' if args.output.lower().endswith('.csv') else 'jsonl')
+    ocr_backends = None
+    if args.ocr_backend:
+        from ocr_backends import ocr_chain
+        ocr_backends = ocr_chain.parse(args.ocr_backend)
+        if ocr_backends is None:
+            parser.error(f"unknown OCR backend: {args.ocr_backend}")
+
+    options = {
+        'workers': max(1, args.workers),
+        'confidence': args.confidence,
+        'model': args.model,
+        'engine': args.engine,
+        'no_ocr': args.no_ocr,
+        'ocr_backends': ocr_backends,
+        'ignore_quality': args.ignore_quality,
+        'firebase': args.firebase and not args.no_ocr
+    }
+
+    items = iter_items(args.target, args.recursive, args.source)
+    if args.limit:
+        items = (item for index, item in zip(range(args.limit), items))
+
+    writer = ResultWriter(args.output, fmt)
+    stats = ReplayStats()
+    # spawn: process ลูกเริ่มใหม่และ import torch เอง ไม่รับ thread / lock จาก process นี้
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(options['workers'], initializer=_init_worker, initargs=(options,)) as pool:
+        print(f"🔁 Replaying {args.target} with {options['workers']} workers...", file=sys.stderr)
+        stats.started_at = time.perf_counter()
+        try:
+            for result in pool.imap_unordered(_process_item, enumerate(items), chunksize=4):
+                writer.write(result)
+                stats.add(result)
+                if stats.images % 100 == 0:
+                    print(f"  {stats.images} images, {stats.images / (time.perf_counter() - stats.started_at):.1f} img/s",
+                          file=sys.stderr)
+        except KeyboardInterrupt:
+            pool.terminate()
+            print("Interrupted", file=sys.stderr)
+        finally:
+            writer.close()
+
+    print(stats.report(options['workers']), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+========================================
+🧊 Response cache for dashboard read endpoints
+========================================
+
+Dashboard endpoints (stats, province stats, recent detections, info)
+read the whole detections node on every call. Their JSON responses are
+cached per endpoint and query string for RESPONSE_CACHE_TTL seconds and
+built once: concurrent misses for the same key wait for the first one
+instead of all querying Firebase.
+
+- Bodies are stored both plain and gzip-compressed, each with a strong
+  ETag, so a poll with a matching ``If-None-Match`` costs a 304 and no
+  body at all.
+- Saving or deleting a detection calls invalidate(), which bumps the
+  mtime of a generation file; every worker compares it on lookup and
+  drops entries built before the change.
+"""
+
+import os
+import gzip
+import time
+import hashlib
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_FOLDER = os.environ.get('RESPONSE_CACHE_FOLDER', 'result_cache')
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', '5'))  # วินาที (0 = ปิด)
+# body ที่เล็กกว่านี้ (bytes) ไม่คุ้มที่จะ gzip
+RESPONSE_GZIP_MIN_BYTES = 512
+RESPONSE_GZIP_LEVEL = 6
+# จำนวน key สูงสุด (endpoint x query string) ต่อ worker เกินแล้วล้างทั้งหมด
+RESPONSE_CACHE_MAX_ENTRIES = 256
+
+
+class CachedResponse:
+    def __init__(self, body, status, mimetype, generation, ttl):
+        """
+        Args:
+            body: Response body bytes
+            status: HTTP status code
+            mimetype: Response mimetype
+            generation: Generation the body was built at
+            ttl: Lifetime in seconds
+        """
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.generation = generation
+        self.expires_at = time.monotonic() + ttl
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etag = digest
+        # strong ETag ต่อ representation: body ที่ gzip แล้วเป็นคนละ representation
+        self.gzip_body = None
+        self.gzip_etag = None
+        if len(body) >= RESPONSE_GZIP_MIN_BYTES:
+            self.gzip_body = gzip.compress(body, RESPONSE_GZIP_LEVEL)
+            self.gzip_etag = f"{digest}-gz"
+
+    def is_fresh(self, generation, now):
+        return self.generation == generation and now < self.expires_at
+
+    def representation(self, accept_gzip):
+        """(body, etag, content_encoding) to send"""
+        if accept_gzip and self.gzip_body is not None:
+            return self.gzip_body, self.gzip_etag, 'gzip'
+        return self.body, self.etag, None
+
+
+class ResponseCache:
+    def __init__(self, folder=RESPONSE_CACHE_FOLDER, ttl=RESPONSE_CACHE_TTL):
+        """
+        Args:
+            folder: Where the shared generation file lives
+            ttl: Default lifetime of a cached response (seconds)
+        """
+        self.ttl = ttl
+        self.generation_path = os.path.join(folder, 'response_generation')
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        if not os.path.exists(self.generation_path):
+            self.invalidate()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def generation(self):
+        """Current generation (mtime of the shared generation file)"""
+        try:
+            return os.stat(self.generation_path).st_mtime_ns
+        except OSError:
+            return 0
+
+    def invalidate(self):
+        """Drop every cached response in all workers"""
+        try:
+            with open(self.generation_path, 'a'):
+                pass
+            os.utime(self.generation_path, None)
+        except OSError as e:
+            logger.warning(f"⚠️ Failed to invalidate response cache: {e}")
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_build(self, key, build, ttl=None):
+        """
+        Cached response for key, built by build() once per TTL
+
+        Args:
+            key: Endpoint + normalized query string
+            build: Callable returning (body bytes, status, mimetype, cacheable)
+            ttl: Lifetime override (seconds)
+
+        Returns:
+            tuple: (CachedResponse, hit)
+        """
+        generation = self.generation()
+        entry = self._entries.get(key)
+        if entry is not None and entry.is_fresh(generation, time.monotonic()):
+            self.hits += 1
+            return entry, True
+
+        # สร้างครั้งเดียวต่อ key: request อื่นที่พลาดพร้อมกันรอผลของตัวแรก
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.is_fresh(generation, time.monotonic()):
+                self.hits += 1
+                return entry, True
+
+            self.misses += 1
+            body, status, mimetype, cacheable = build()
+            entry = CachedResponse(body, status, mimetype, generation, self.ttl if ttl is None else ttl)
+            with self._lock:
+                if cacheable:
+                    if key not in self._entries and len(self._entries) >= RESPONSE_CACHE_MAX_ENTRIES:
+                        self._entries.clear()
+                        self._key_locks = {key: key_lock}
+                    self._entries[key] = entry
+                else:
+                    self._entries.pop(key, None)
+            return entry, False
+
+    def stats(self):
+        return {
+            'ttl': self.ttl,
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+# Global response cache instance
+response_cache = ResponseCache()
@@ -0,0 +1,283 @@
+"""
+========================================
+⚖️ Fair scheduling of frames across sources
+========================================
+
+Frames from every camera share this worker's detection stage (decode +
+YOLO). Instead of running them in arrival order, each flow (source +
+auto/manual) has its own queue and the next frame is picked by weighted
+fair queuing: every frame gets a virtual finish tag ``start + 1 / weight``
+(start-time fair queuing) and the smallest tag runs next. A camera that
+sends many frames only delays its own frames.
+
+- ``weight`` and ``max_fps`` per source come from camera_settings.json;
+  frames above the rate cap are refused at once.
+- Latest frame wins: an auto-mode frame still waiting when a newer frame
+  from the same source arrives is dropped (its request is answered as
+  superseded) and the newer frame takes its place in line.
+- Manual captures are a separate flow weighted by SCHEDULER_MANUAL_WEIGHT
+  and are never replaced.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from camera_config import camera_settings
+
+# จำนวนเฟรมที่ผ่านขั้นตอนตรวจจับพร้อมกันได้ต่อ worker (YOLO ใช้ทุก core อยู่แล้ว)
+SCHEDULER_CONCURRENCY = int(os.environ.get('SCHEDULER_CONCURRENCY', '1'))
+SCHEDULER_MANUAL_WEIGHT = float(os.environ.get('SCHEDULER_MANUAL_WEIGHT', '4'))
+# เวลารอคิวสูงสุดของ request (วินาที) เกินแล้วตอบ 503
+SCHEDULER_MAX_WAIT = float(os.environ.get('SCHEDULER_MAX_WAIT', '5'))
+# frame rate สูงสุดของ auto frame ต่อ source เมื่อไม่ได้กำหนด max_fps ของกล้อง (0 = ไม่จำกัด)
+SCHEDULER_DEFAULT_MAX_FPS = float(os.environ.get('SCHEDULER_DEFAULT_MAX_FPS', '0'))
+# ลบสถิติของ flow ที่ไม่มีเฟรมมานานกว่านี้ (วินาที) เช่น flow ของ batch job ที่จบแล้ว
+SCHEDULER_FLOW_IDLE_TTL = 600
+
+# Rejection reasons
+SUPERSEDED = 'superseded'
+THROTTLED = 'throttled'
+TIMED_OUT = 'timed_out'
+
+# Ticket states
+_WAITING = 'waiting'
+_RUNNING = 'running'
+_DROPPED = 'dropped'
+
+
+class FrameRejected(Exception):
+    """Raised when the scheduler will not run a frame"""
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ('flow', 'start_tag', 'finish_tag', 'enqueued_at', 'state')
+
+    def __init__(self, flow, enqueued_at):
+        self.flow = flow
+        self.start_tag = 0.0
+        self.finish_tag = 0.0
+        self.enqueued_at = enqueued_at
+        self.state = _WAITING
+
+
+class _Flow:
+    """Queue and statistics of one source + mode"""
+
+    def __init__(self, source, manual, weight, max_fps):
+        self.source = source
+        self.manual = manual
+        self.weight = weight
+        self.max_fps = max_fps
+        self.queue = deque()
+        self.finish_tag = 0.0
+        self.last_accepted = None
+        self.last_seen = time.monotonic()
+        self.running = 0
+        self.served = 0
+        self.dropped = {SUPERSEDED: 0, THROTTLED: 0, TIMED_OUT: 0}
+        self.ewma_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, wait):
+        self.ewma_wait = wait if not self.served else 0.8 * self.ewma_wait + 0.2 * wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def stats(self, now):
+        return {
+            'source': self.source,
+            'mode': 'manual' if self.manual else 'auto',
+            'weight': self.weight,
+            'max_fps': self.max_fps,
+            'queue_depth': len(self.queue),
+            'running': self.running,
+            'oldest_wait_ms': round((now - self.queue[0].enqueued_at) * 1000, 1) if self.queue else 0.0,
+            'ewma_wait_ms': round(self.ewma_wait * 1000, 1),
+            'max_wait_ms': round(self.max_wait * 1000, 1),
+            'served': self.served,
+            'dropped': dict(self.dropped)
+        }
+
+
+class FairScheduler:
+    def __init__(self, concurrency=SCHEDULER_CONCURRENCY, manual_weight=SCHEDULER_MANUAL_WEIGHT,
+                 settings=camera_settings):
+        """
+        Args:
+            concurrency: Frames allowed in the detection stage at once
+            manual_weight: Weight multiplier for manual captures
+            settings: CameraSettings providing per-source weight / max_fps
+        """
+        self.concurrency = concurrency
+        self.manual_weight = manual_weight
+        self.settings = settings
+        self.flows = {}  # "source:mode" -> _Flow
+        self.running = 0
+        self.virtual_time = 0.0
+        self.ewma_service_time = 0.2  # วินาที ค่าเริ่มต้นประมาณเวลา decode + YOLO
+        self._last_prune = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _flow(self, source, manual):
+        source = source or 'unknown'
+        key = f"{source}:{'manual' if manual else 'auto'}"
+        flow = self.flows.get(key)
+        if flow is None:
+            settings = self.settings.get(source)
+            weight = float(settings.get('weight') or 1.0) * (self.manual_weight if manual else 1.0)
+            max_fps = None if manual else float(settings.get('max_fps') or SCHEDULER_DEFAULT_MAX_FPS) or None
+            flow = self.flows[key] = _Flow(source, manual, weight, max_fps)
+        flow.last_seen = time.monotonic()
+        return flow
+
+    def _prune(self, now):
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        for key, flow in list(self.flows.items()):
+            if not flow.queue and not flow.running and now - flow.last_seen > SCHEDULER_FLOW_IDLE_TTL:
+                del self.flows[key]
+
+    def _retry_after(self):
+        """ประมาณเวลาที่คิวจะว่าง (วินาที)"""
+        queued = sum(len(flow.queue) for flow in self.flows.values())
+        return (queued + self.running) / max(1, self.concurrency) * self.ewma_service_time
+
+    def _dispatch(self):
+        """Start the waiting frames with the smallest finish tags while capacity allows"""
+        while self.running < self.concurrency:
+            heads = [flow.queue[0] for flow in self.flows.values() if flow.queue]
+            if not heads:
+                return
+            ticket = min(heads, key=lambda t: (t.finish_tag, t.enqueued_at))
+            ticket.flow.queue.popleft()
+            ticket.flow.running += 1
+            ticket.state = _RUNNING
+            self.running += 1
+            self.virtual_time = max(self.virtual_time, ticket.start_tag)
+
+    def check_rate(self, source, manual=False):
+        """
+        Enforce the per-source frame-rate cap (auto frames only)
+
+        Raises:
+            FrameRejected: THROTTLED with the seconds until the next frame is accepted
+        """
+        with self._cond:
+            flow = self._flow(source, manual)
+            if not flow.max_fps:
+                return
+            now = time.monotonic()
+            interval = 1.0 / flow.max_fps
+            if flow.last_accepted is not None and now - flow.last_accepted < interval:
+                flow.dropped[THROTTLED] += 1
+                raise FrameRejected(THROTTLED, interval - (now - flow.last_accepted))
+            flow.last_accepted = now
+
+    @contextmanager
+    def slot(self, source, manual=False, latest_wins=False, max_wait=None):
+        """
+        Wait for this frame's turn in the detection stage
+
+        Usage:
+            with frame_scheduler.slot(source, latest_wins=True, max_wait=2.0) as queue_wait:
+                detections = engine.predict(image)
+
+        Args:
+            source: Camera / client that sent the frame
+            manual: Manual capture (own flow, higher weight, never replaced)
+            latest_wins: Replace this source's frame still waiting in the queue
+            max_wait: Give up after this many seconds (None = wait as long as needed)
+
+        Yields:
+            float: Seconds spent waiting in the queue
+
+        Raises:
+            FrameRejected: SUPERSEDED when a newer frame took this one's place,
+                           TIMED_OUT when max_wait passed
+        """
+        ticket, wait = self._acquire(source, manual, latest_wins, max_wait)
+        started_at = time.monotonic()
+        try:
+            yield wait
+        finally:
+            self._release(ticket, time.monotonic() - started_at)
+
+    def _acquire(self, source, manual, latest_wins, max_wait):
+        with self._cond:
+            now = time.monotonic()
+            self._prune(now)
+            flow = self._flow(source, manual)
+            ticket = _Ticket(flow, now)
+
+            if latest_wins and not manual and flow.queue:
+                # เฟรมใหม่แทนเฟรมที่ยังรออยู่ และรับลำดับในคิวของเฟรมเก่าสุดไป
+                ticket.start_tag, ticket.finish_tag = flow.queue[0].start_tag, flow.queue[0].finish_tag
+                for stale in flow.queue:
+                    stale.state = _DROPPED
+                    flow.dropped[SUPERSEDED] += 1
+                flow.queue.clear()
+            else:
+                ticket.start_tag = max(self.virtual_time, flow.finish_tag)
+                ticket.finish_tag = ticket.start_tag + 1.0 / flow.weight
+                flow.finish_tag = ticket.finish_tag
+            flow.queue.append(ticket)
+            self._dispatch()
+            self._cond.notify_all()
+
+            give_up_at = None if max_wait is None else now + max_wait
+            while ticket.state == _WAITING:
+                if give_up_at is None:
+                    self._cond.wait()
+                    continue
+                remaining = give_up_at - time.monotonic()
+                if remaining <= 0:
+                    flow.queue.remove(ticket)
+                    flow.dropped[TIMED_OUT] += 1
+                    raise FrameRejected(TIMED_OUT, self._retry_after())
+                self._cond.wait(remaining)
+
+            if ticket.state == _DROPPED:
+                raise FrameRejected(SUPERSEDED)
+            wait = time.monotonic() - ticket.enqueued_at
+            flow.record_wait(wait)
+            return ticket, wait
+
+    def _release(self, ticket, elapsed):
+        with self._cond:
+            flow = ticket.flow
+            flow.running -= 1
+            flow.served += 1
+            self.running -= 1
+            self.ewma_service_time = 0.8 * self.ewma_service_time + 0.2 * elapsed
+            self._dispatch()
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Queue depth and wait times per source of this worker
+
+        Returns:
+            dict: Totals and per-flow statistics
+        """
+        with self._cond:
+            now = time.monotonic()
+            return {
+                'pid': os.getpid(),
+                'concurrency': self.concurrency,
+                'running': self.running,
+                'queued': sum(len(flow.queue) for flow in self.flows.values()),
+                'ewma_service_time': round(self.ewma_service_time, 3),
+                'flows': {key: flow.stats(now) for key, flow in sorted(self.flows.items())}
+            }
+
+
+# Global frame scheduler (หนึ่งตัวต่อ worker process)
+frame_scheduler = FairScheduler()
@@ -0,0 +1,188 @@
+"""
+========================================
+⏱️ Startup profile
+========================================
+
+Records where a (re)starting process spends its time: how long each
+module takes to import and how long each backend takes to initialize,
+relative to the moment the process was started.
+
+Import times come from a ``sys.meta_path`` hook that times each module's
+execution. Times are inclusive (a module includes everything it imports
+for the first time) and ``depth`` 0 marks the import that triggered the
+chain. Heavy dependencies are imported lazily on first use, so their
+import shows up later with a larger ``at_ms``.
+
+Import this module before anything else so the hook sees every import.
+"""
+
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+STARTUP_PROFILE_ENABLED = os.environ.get('STARTUP_PROFILE', '1') == '1'
+# import ที่ใช้เวลาน้อยกว่านี้ (ms) ไม่ถูกเก็บในรายงาน
+STARTUP_PROFILE_MIN_MS = float(os.environ.get('STARTUP_PROFILE_MIN_MS', '5'))
+
+
+def process_age():
+    """
+    Seconds since this process was started, read from /proc
+
+    Returns:
+        float or None if /proc is not available
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # field 22 (starttime) นับจาก field 3 ที่อยู่หลังชื่อ process ในวงเล็บ
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _ImportTimer:
+    """meta_path finder that times module execution of the specs other finders return"""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self._local = threading.local()
+
+    def find_spec(self, fullname, path=None, target=None):
+        if getattr(self._local, 'searching', False):
+            return None
+        self._local.searching = True
+        try:
+            spec = None
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+        finally:
+            self._local.searching = False
+
+        # ห่อเฉพาะ loader ที่เป็นของ module นี้ตัวเดียว (FileLoader / ExtensionFileLoader)
+        # loader ที่ใช้ร่วมกันหลาย module (built-in, frozen, zipimport) ปล่อยไว้ตามเดิม
+        loader = getattr(spec, 'loader', None)
+        if loader is None or getattr(loader, 'name', None) != fullname or not hasattr(loader, 'exec_module'):
+            return spec
+
+        exec_module = loader.exec_module
+        local = self._local
+        profile = self.profile
+
+        def timed_exec_module(module):
+            depth = getattr(local, 'depth', 0)
+            local.depth = depth + 1
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                local.depth = depth
+                loader.__dict__.pop('exec_module', None)
+                profile.record_import(fullname, time.perf_counter() - start, depth)
+
+        try:
+            loader.exec_module = timed_exec_module
+        except AttributeError:
+            pass
+        return spec
+
+
+class StartupProfile:
+    def __init__(self):
+        """
+        Import / initialization timings of this process
+
+        All times are milliseconds since the process started. Under gunicorn
+        the profile is created in the master and inherited by each worker,
+        so a worker's report starts at the master's start.
+        """
+        age = process_age()
+        self.origin = time.perf_counter() - (age or 0.0)
+        self.imports = []
+        self.import_count = 0
+        self.import_total_ms = 0.0
+        self.stages = []
+        self.milestones = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def elapsed_ms(self):
+        """Milliseconds since the process started"""
+        return round((time.perf_counter() - self.origin) * 1000, 1)
+
+    def install_import_timer(self):
+        """Start timing imports (idempotent)"""
+        if self._timer is None:
+            self._timer = _ImportTimer(self)
+            sys.meta_path.insert(0, self._timer)
+
+    def record_import(self, name, seconds, depth=0):
+        ms = seconds * 1000
+        with self._lock:
+            self.import_count += 1
+            if depth == 0:
+                self.import_total_ms += ms
+            if ms >= STARTUP_PROFILE_MIN_MS:
+                self.imports.append({'module': name, 'ms': round(ms, 1), 'depth': depth,
+                                     'at_ms': self.elapsed_ms()})
+
+    @contextmanager
+    def stage(self, name):
+        """Time an initialization step (e.g. model load, Firebase connect)"""
+        started_at = self.elapsed_ms()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stages.append({'name': name, 'started_at_ms': started_at,
+                                    'ms': round((time.perf_counter() - start) * 1000, 1),
+                                    'thread': threading.current_thread().name})
+
+    def mark(self, name):
+        """Record when a milestone was first reached (later calls are ignored)"""
+        self.milestones.setdefault(name, self.elapsed_ms())
+
+    def slowest_imports(self, count=10):
+        """Slowest top-level imports"""
+        with self._lock:
+            roots = [i for i in self.imports if i['depth'] == 0]
+        return sorted(roots, key=lambda i: -i['ms'])[:count]
+
+    def report(self):
+        """
+        Startup report of this process
+
+        Returns:
+            dict: milestones, stages and imports (slowest first)
+        """
+        with self._lock:
+            imports = sorted(self.imports, key=lambda i: -i['ms'])
+            stages = list(self.stages)
+            import_count, import_total_ms = self.import_count, self.import_total_ms
+        return {
+            'pid': os.getpid(),
+            'uptime_ms': self.elapsed_ms(),
+            'milestones': dict(self.milestones),
+            'stages': stages,
+            'imports': {
+                'count': import_count,
+                'total_ms': round(import_total_ms, 1),
+                'min_ms': STARTUP_PROFILE_MIN_MS,
+                'modules': imports
+            }
+        }
+
+
+# Global startup profile instance
+startup_profile = StartupProfile()
+if STARTUP_PROFILE_ENABLED:
+    startup_profile.install_import_timer()
@@ -60,8 +60,18 @@ function viewFile(filename) {
     // Update modal image source
     const modalImage = document.getElementById("modalImage");
     if (modalImage) {
-      modalImage.src = `/static/uploads/${filename}`;
+      // แสดงภาพย่อขนาด preview ภาพเต็มความละเอียดโหลดเมื่อกดดูต้นฉบับเท่านั้น
+      modalImage.src = `/thumbnails/preview/${encodeURIComponent(filename)}`;
       modalImage.alt = filename;
+      modalImage.onerror = () => {
+        modalImage.onerror = null;
+        modalImage.src = `/static/uploads/${filename}`;
+      };
+
+      const originalLink = document.getElementById("modalOriginalLink");
+      if (originalLink) {
+        originalLink.href = `/static/uploads/${filename}`;
+      }
 
       // Update modal title
       const modalTitle = document.querySelector(".modal-title");
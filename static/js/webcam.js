@@ -13,6 +13,7 @@ let isRunning = false;
 let isProcessing = false; // Track API processing state
 let detectionMode = "auto";
 let lastApiCall = 0;
+let retryAfterUntil = 0; // server ขอให้รอ (503 Retry-After) ถึงเวลานี้
 let sessionResults = [];
 let fpsCounter = 0;
 let lastFpsTime = Date.now();
@@ -392,7 +393,10 @@ function processFrame() {
   // Auto detection - only if not currently processing
   if (detectionMode === "auto" && !isProcessing) {
     const now = Date.now();
-    if (now - lastApiCall >= settings.autoInterval * 1000) {
+    if (
+      now - lastApiCall >= settings.autoInterval * 1000 &&
+      now >= retryAfterUntil
+    ) {
       captureAndAnalyze();
       lastApiCall = now;
     }
@@ -467,28 +471,32 @@ async function captureAndAnalyze() {
     // Update loading status
     showLoadingWithStatus("กำลังประมวลผลภาพ...");
 
-    // Get image data with lower quality for faster processing
-    const imageData = tempCanvas.toDataURL("image/jpeg", 0.5);
-
-    // Convert to blob
-    const response = await fetch(imageData);
-    const blob = await response.blob();
+    // Encode เป็น JPEG blob โดยตรง (ไม่ผ่าน base64 data URL)
+    const blob = await new Promise((resolve, reject) =>
+      tempCanvas.toBlob(
+        (result) =>
+          result ? resolve(result) : reject(new Error("ไม่สามารถสร้างภาพได้")),
+        "image/jpeg",
+        0.5
+      )
+    );
 
     // Update loading status
     showLoadingWithStatus("กำลังส่งข้อมูลไป API...");
 
-    // Create form data
-    const formData = new FormData();
-    formData.append("file", blob, `capture_${Date.now()}.jpg`);
-    formData.append("confidence", settings.confidence);
-    formData.append("source", "webcam");
+    // ส่งภาพเป็น raw body (image/jpeg) พารามิเตอร์อยู่ใน query string ไม่ต้องใช้ multipart
+    const params = new URLSearchParams({
+      confidence: settings.confidence,
+      source: "webcam",
+    });
 
     // Send to API with timeout
+    const apiTimeoutMs = 8000; // Reduced to 8 seconds
     const controller = new AbortController();
     const timeoutId = setTimeout(() => {
       console.log("⏰ API timeout after 8 seconds");
       controller.abort();
-    }, 8000); // Reduced to 8 seconds
+    }, apiTimeoutMs);
 
     updateStatus("กำลังส่งข้อมูลไป API...", "warning");
 
@@ -497,14 +505,35 @@ async function captureAndAnalyze() {
       detectionMode === "auto" ? "/api/detect-yolo" : "/api/detect";
     console.log(`📡 Using ${apiEndpoint} for ${detectionMode} mode`);
 
-    const apiResponse = await fetch(apiEndpoint, {
+    // บอก server ว่ารอผลได้นานเท่าไร (หักเวลาอัปโหลด/เครือข่ายไว้ 500ms)
+    // server จะลด timeout ของ OCR หรือเลิกทำงานเมื่อเลยเวลานี้
+    const apiResponse = await fetch(`${apiEndpoint}?${params}`, {
       method: "POST",
-      body: formData,
+      body: blob,
+      headers: {
+        "Content-Type": "image/jpeg",
+        "X-Request-Deadline-Ms": String(apiTimeoutMs - 500),
+        "X-Detection-Mode": detectionMode,
+      },
       signal: controller.signal,
     });
 
     clearTimeout(timeoutId);
 
+    // Server overloaded หรือส่งเฟรมเกิน max_fps ของกล้อง - รอตาม Retry-After ที่ server บอก
+    if (
+      apiResponse.status === 503 ||
+      (apiResponse.status === 429 && apiResponse.headers.has("Retry-After"))
+    ) {
+      const overloadError = new Error(
+        `HTTP ${apiResponse.status}: Server overloaded`
+      );
+      overloadError.name = "OverloadedError";
+      overloadError.retryAfter =
+        parseInt(apiResponse.headers.get("Retry-After"), 10) || 1;
+      throw overloadError;
+    }
+
     if (!apiResponse.ok) {
       throw new Error(`HTTP ${apiResponse.status}: ${apiResponse.statusText}`);
     }
@@ -519,6 +548,13 @@ async function captureAndAnalyze() {
     stats.apiCalls++;
     updateStatistics();
 
+    // เฟรมนี้ถูกแทนด้วยเฟรมใหม่กว่าที่รอคิวอยู่ - ไม่ต้องแสดงผล
+    if (result.superseded) {
+      hideLoadingWithStatus();
+      isProcessing = false;
+      return;
+    }
+
     // Handle API Rate Limit
     if (result.error && result.error.includes("Rate Limit")) {
       showDetectionInfo("Rate Limit - รอสักครู่", 0, "warning");
@@ -569,6 +605,17 @@ async function captureAndAnalyze() {
         "success"
       );
 
+      // ป้ายอยู่ใน watchlist
+      if (result.watchlist_matches && result.watchlist_matches.length > 0) {
+        const labels = result.watchlist_matches
+          .map((match) => match.label || match.plate || match.pattern)
+          .join(", ");
+        showNotification(
+          `🚨 Watchlist: ${result.license_plate} (${labels})`,
+          "danger"
+        );
+      }
+
       addResult(canvas.toDataURL("image/jpeg", 0.8), result);
       updateStatus(`พบป้ายทะเบียน: ${result.license_plate}`, "success");
 
@@ -660,6 +707,15 @@ async function captureAndAnalyze() {
       showDetectionInfo("Timeout", 0, "danger");
       showNotification("การประมวลผลช้าเกินไป - ลองใหม่อีกครั้ง", "warning");
       updateStatus("Timeout - ลองใหม่อีกครั้ง", "danger");
+    } else if (error.name === "OverloadedError") {
+      // เลื่อนการจับภาพอัตโนมัติครั้งถัดไปตามที่ server ขอ แทนการเพิ่ม interval แบบตายตัว
+      retryAfterUntil = Date.now() + error.retryAfter * 1000;
+      showDetectionInfo("Server Busy", 0, "warning");
+      showNotification(
+        `เซิร์ฟเวอร์ทำงานเต็มกำลัง - ลองใหม่ใน ${error.retryAfter} วินาที`,
+        "warning"
+      );
+      updateStatus(`รอ ${error.retryAfter} วินาที`, "warning");
     } else if (
       error.message.includes("429") ||
       error.message.includes("rate limit")
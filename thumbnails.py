@@ -0,0 +1,178 @@
+"""
+========================================
+🖼️ Cached thumbnails of uploads
+========================================
+
+The history page shows small previews instead of full-resolution uploads.
+Thumbnails are decoded with the reduced JPEG decode used for detection
+(image_io), resized, encoded as WebP or JPEG and cached on disk under
+``THUMBNAIL_FOLDER/<size>/`` so every gunicorn worker shares them.
+
+- New uploads are queued on a small background pool (WebP ``thumb`` only),
+  anything else is generated on the first request.
+- Upload names are content hashes, so a thumbnail never changes and is
+  served with a long-lived ``immutable`` Cache-Control.
+"""
+
+import os
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from image_io import decode_image
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_FOLDER = 'static/uploads'
+THUMBNAIL_FOLDER = os.environ.get('THUMBNAIL_FOLDER', 'thumbnails')
+# ด้านยาวสุด (pixel) ของแต่ละขนาด: thumb สำหรับ grid, preview สำหรับ modal
+THUMBNAIL_SIZES = {'thumb': 320, 'preview': 1024}
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', '75'))
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', '1'))
+# งานสร้างล่วงหน้าที่ค้างได้สูงสุด เกินแล้วปล่อยให้สร้างตอนมีคนขอ
+THUMBNAIL_MAX_PENDING = 64
+THUMBNAIL_MAX_AGE = 365 * 24 * 3600  # วินาที
+
+MIME_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp'}
+
+
+def encode_thumbnail(image, max_side, fmt='webp', quality=THUMBNAIL_QUALITY):
+    """
+    Resize a BGR image to max_side and encode it
+
+    Args:
+        image: BGR numpy array
+        max_side: Long side of the thumbnail (smaller images are not upscaled)
+        fmt: 'webp' or 'jpeg'
+        quality: Encoder quality
+
+    Returns:
+        bytes or None if encoding failed
+    """
+    import cv2
+
+    h, w = image.shape[:2]
+    if max(h, w) > max_side:
+        ratio = max_side / max(h, w)
+        image = cv2.resize(image, (max(1, int(w * ratio)), max(1, int(h * ratio))),
+                           interpolation=cv2.INTER_AREA)
+    if fmt == 'webp':
+        ok, buffer = cv2.imencode('.webp', image, [cv2.IMWRITE_WEBP_QUALITY, quality])
+    else:
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality,
+                                                  cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+    return buffer.tobytes() if ok else None
+
+
+class ThumbnailService:
+    def __init__(self, upload_folder=UPLOAD_FOLDER, folder=THUMBNAIL_FOLDER, max_workers=THUMBNAIL_WORKERS):
+        """
+        Args:
+            upload_folder: Where the original uploads are stored
+            folder: Disk cache of generated thumbnails
+            max_workers: Background pool size for thumbnails of new uploads
+        """
+        self.upload_folder = upload_folder
+        self.folder = folder
+        self.max_workers = max_workers
+        self.generated = 0
+        self.failed = 0
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        for size in THUMBNAIL_SIZES:
+            os.makedirs(os.path.join(folder, size), exist_ok=True)
+
+    def _get_executor(self):
+        """สร้าง thread pool หลัง fork เท่านั้น (thread ไม่ข้าม fork)"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='thumbnail')
+            return self._executor
+
+    def path_for(self, filename, size, fmt):
+        """Cache path of a thumbnail"""
+        stem = filename.rsplit('.', 1)[0]
+        return os.path.join(self.folder, size, f"{stem}.{EXTENSIONS[fmt]}")
+
+    def get(self, filename, size='thumb', fmt='webp'):
+        """
+        Path of the thumbnail, generated now if it is not cached yet
+
+        Args:
+            filename: Upload filename (already validated by the caller)
+            size: Key of THUMBNAIL_SIZES
+            fmt: 'webp' or 'jpeg'
+
+        Returns:
+            str or None when the upload is missing or cannot be decoded
+        """
+        path = self.path_for(filename, size, fmt)
+        if os.path.exists(path):
+            return path
+        source = os.path.join(self.upload_folder, filename)
+        if not os.path.exists(source):
+            return None
+
+        # request พร้อมกันหลายตัวสำหรับภาพเดียวกันสร้างแค่ครั้งเดียว (ใน worker นี้)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(path, threading.Lock())
+        with key_lock:
+            try:
+                if os.path.exists(path):
+                    return path
+                return self._generate(source, path, THUMBNAIL_SIZES[size], fmt)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(path, None)
+
+    def _generate(self, source, path, max_side, fmt):
+        try:
+            with open(source, 'rb') as f:
+                # decode แบบย่อ 1/2-1/8 ตามขนาดที่ต้องการ ไม่ decode เต็มความละเอียด
+                decoded = decode_image(f.read(), target_size=max_side)
+            data = encode_thumbnail(decoded.image, max_side, fmt) if decoded is not None else None
+        except Exception:
+            logger.exception("❌ Thumbnail generation failed", extra={'source': source})
+            data = None
+        if data is None:
+            self.failed += 1
+            return None
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.generated += 1
+        return path
+
+    def schedule(self, filename, size='thumb', fmt='webp'):
+        """Generate a thumbnail of a new upload in the background (skipped when the pool is busy)"""
+        if os.path.exists(self.path_for(filename, size, fmt)):
+            return
+        with self._lock:
+            if self._pending >= THUMBNAIL_MAX_PENDING:
+                return
+            self._pending += 1
+        self._get_executor().submit(self._run_scheduled, filename, size, fmt)
+
+    def _run_scheduled(self, filename, size, fmt):
+        try:
+            self.get(filename, size, fmt)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self):
+        return {
+            'generated': self.generated,
+            'failed': self.failed,
+            'pending': self._pending
+        }
+
+
+# Global thumbnail service instance
+thumbnail_service = ThumbnailService()
@@ -0,0 +1,248 @@
+"""
+========================================
+🗃️ Content-addressed uploads & result cache
+========================================
+
+Uploaded images are stored under their SHA-256 so the same bytes are kept
+on disk once, and the complete pipeline result is cached per hash with a
+TTL. Repeated uploads and client retries are answered from the cache
+without running YOLO or calling the OCR API again. Requests carrying an
+``Idempotency-Key`` header replay the stored response of the first call.
+
+Everything lives on disk so every gunicorn worker shares the same cache.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_FOLDER = 'static/uploads'
+RESULT_CACHE_FOLDER = os.environ.get('RESULT_CACHE_FOLDER', 'result_cache')
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', '3600'))  # วินาที
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', '86400'))  # วินาที
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+# request แรกที่ถือ key ค้างนานกว่านี้ถือว่าตายไปแล้ว (มากกว่า MAX_REQUEST_BUDGET_MS)
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
+
+
+class IdempotencyConflict(Exception):
+    """Raised when a request with the same Idempotency-Key is still running"""
+
+
+def content_hash(data):
+    """SHA-256 ของ bytes ของภาพ (hex)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _key_digest(*parts):
+    return hashlib.sha256('\x00'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+def _write_json_atomic(path, data):
+    """เขียน JSON แบบ atomic เพื่อไม่ให้ worker อื่นอ่านไฟล์ที่เขียนไม่เสร็จ"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_cacheable(result):
+    """
+    Only cache final answers, never transient failures
+
+    A plate read, "no plate" from the OCR API or YOLO and a crop skipped
+    for low quality are final. Rate limits, timeouts, auth errors, deadline
+    aborts and YOLO failures (model still loading, engine error) are not.
+    """
+    if result.get('deadline_exceeded') or result.get('yolo_error'):
+        return False
+    if result.get('success') or result.get('skipped') == 'low_quality':
+        return True
+    api_result = result.get('api_result') or result
+    return 'raw_response' in api_result or result.get('yolo_detections') == []
+
+
+class UploadStore:
+    def __init__(self, upload_folder=UPLOAD_FOLDER, cache_folder=RESULT_CACHE_FOLDER,
+                 result_ttl=RESULT_CACHE_TTL, idempotency_ttl=IDEMPOTENCY_TTL):
+        """
+        Args:
+            upload_folder: Where image bytes are stored (served as static files)
+            cache_folder: Where cached results and idempotent responses are stored
+            result_ttl: Lifetime of a cached pipeline result (seconds)
+            idempotency_ttl: Lifetime of a stored idempotent response (seconds)
+        """
+        self.upload_folder = upload_folder
+        self.results_folder = os.path.join(cache_folder, 'results')
+        self.idempotency_folder = os.path.join(cache_folder, 'idempotency')
+        self.result_ttl = result_ttl
+        self.idempotency_ttl = idempotency_ttl
+        self._last_purge = time.time()
+        for folder in (upload_folder, self.results_folder, self.idempotency_folder):
+            os.makedirs(folder, exist_ok=True)
+
+    # ---------- Image bytes ----------
+
+    def put(self, data, filename=None):
+        """
+        Store image bytes under their hash (no-op when already stored)
+
+        Args:
+            data: Image bytes
+            filename: Original filename, only used for the extension
+
+        Returns:
+            tuple: (digest, stored filename)
+        """
+        digest = content_hash(data)
+        ext = 'jpg'
+        if filename and '.' in filename and filename.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS:
+            ext = filename.rsplit('.', 1)[1].lower()
+        stored_name = f"{digest}.{ext}"
+        path = os.path.join(self.upload_folder, stored_name)
+
+        if os.path.exists(path):
+            # ไฟล์เดิม: แค่อัปเดตเวลาให้หน้า history เรียงถูก
+            os.utime(path, None)
+        else:
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest, stored_name
+
+    def path_for(self, stored_name):
+        """Full path of a stored image"""
+        return os.path.join(self.upload_folder, stored_name)
+
+    # ---------- Whole-result cache ----------
+
+    def _result_path(self, digest, variant):
+        # ผลลัพธ์ขึ้นกับ pipeline และพารามิเตอร์ (confidence, source) ไม่ใช่แค่ภาพ
+        return os.path.join(self.results_folder, f"{digest}_{_key_digest(*sorted(variant.items()))[:16]}.json")
+
+    def get_result(self, digest, variant):
+        """
+        Cached result for this image and pipeline variant
+
+        Args:
+            digest: Image hash from put() / content_hash()
+            variant: dict of everything else the result depends on
+
+        Returns:
+            dict or None when missing or expired
+        """
+        entry = _read_json(self._result_path(digest, variant))
+        if entry is None or time.time() - entry.get('stored_at', 0) > self.result_ttl:
+            return None
+        return entry['result']
+
+    def put_result(self, digest, variant, result):
+        """Cache a final pipeline result (transient failures are ignored)"""
+        if not is_cacheable(result):
+            return
+        _write_json_atomic(self._result_path(digest, variant),
+                           {'stored_at': time.time(), 'result': result})
+
+        # ล้างรายการที่หมดอายุอย่างมากครั้งละ TTL ไม่ต้องมี background thread
+        if time.time() - self._last_purge > self.result_ttl:
+            self._last_purge = time.time()
+            self.purge_expired()
+
+    # ---------- Idempotency-Key ----------
+
+    def _idempotency_paths(self, scope, key):
+        base = os.path.join(self.idempotency_folder, _key_digest(scope, key))
+        return base + '.json', base + '.lock'
+
+    def begin_idempotent(self, scope, key):
+        """
+        Claim an Idempotency-Key or get the stored response
+
+        Args:
+            scope: Endpoint name (the same key on another endpoint is a different request)
+            key: Idempotency-Key header value
+
+        Returns:
+            dict: {'status': int, 'body': dict} of the first call, or None
+                  when this request now owns the key and must run
+
+        Raises:
+            IdempotencyConflict: The first call is still running
+        """
+        response_path, lock_path = self._idempotency_paths(scope, key)
+        entry = _read_json(response_path)
+        if entry is not None and time.time() - entry.get('stored_at', 0) <= self.idempotency_ttl:
+            return entry
+
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.close(fd)
+        except FileExistsError:
+            try:
+                stale = time.time() - os.path.getmtime(lock_path) > IDEMPOTENCY_LOCK_TIMEOUT
+            except OSError:
+                stale = True
+            if not stale:
+                raise IdempotencyConflict(key)
+            # worker ที่ถือ key ตายไปแล้ว ให้ request นี้รับช่วงต่อ
+            os.utime(lock_path, None)
+        return None
+
+    def finish_idempotent(self, scope, key, status, body):
+        """Store the response of the request that owned the key"""
+        response_path, lock_path = self._idempotency_paths(scope, key)
+        _write_json_atomic(response_path, {'stored_at': time.time(), 'status': status, 'body': body})
+        self.abandon_idempotent(scope, key)
+
+    def abandon_idempotent(self, scope, key):
+        """Release the key without storing (the client may retry)"""
+        _, lock_path = self._idempotency_paths(scope, key)
+        try:
+            os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+
+    # ---------- Maintenance ----------
+
+    def purge_expired(self):
+        """
+        Delete expired cache entries
+
+        Returns:
+            int: Number of files removed
+        """
+        removed = 0
+        now = time.time()
+        for folder, ttl in ((self.results_folder, self.result_ttl),
+                            (self.idempotency_folder, self.idempotency_ttl)):
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                try:
+                    if now - os.path.getmtime(path) > ttl:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+# Global upload store instance
+upload_store = UploadStore()
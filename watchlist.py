@@ -0,0 +1,379 @@
+"""
+========================================
+🚨 Watchlist matching
+========================================
+
+Operators list plates (or glob patterns such as ``กข*``) to be alerted
+on. The list is compiled into an immutable matcher that every detection
+is checked against inline:
+
+- plates are folded to a canonical form (separators removed, Thai digits
+  converted, characters OCR often confuses mapped to one representative)
+- exact hits are a single dict lookup on the canonical form
+- near misses (Levenshtein distance <= WATCHLIST_MAX_DISTANCE) are found
+  with a symmetric-delete index over the canonical forms
+- patterns are combined into one regular expression
+
+Editing the list builds a new matcher and swaps it in, so lookups never
+take a lock. The list is stored in WATCHLIST_PATH; an edit re-reads the
+file under ``flock`` and replaces it atomically, so edits made through
+different gunicorn workers are not lost, and other workers pick up
+changes by checking the file's stat. The alert cooldown is kept in
+small shared files (like detection_dedup) so a sighting alerts once,
+not once per worker.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import fnmatch
+import hashlib
+import threading
+import logging
+from contextlib import contextmanager
+
+from detection_dedup import normalize_plate
+
+logger = logging.getLogger(__name__)
+
+WATCHLIST_PATH = os.environ.get('WATCHLIST_PATH', 'watchlist.json')
+WATCHLIST_MAX_DISTANCE = int(os.environ.get('WATCHLIST_MAX_DISTANCE', '1'))
+# แจ้งเตือนซ้ำสำหรับรายการเดิมจากกล้องเดิมได้ไม่บ่อยกว่านี้ (วินาที)
+WATCHLIST_ALERT_COOLDOWN = float(os.environ.get('WATCHLIST_ALERT_COOLDOWN', '60'))
+# เวลาแจ้งเตือนล่าสุดต่อ (รายการ, กล้อง) ใช้ร่วมกันทุก worker
+WATCHLIST_ALERT_FOLDER = os.environ.get('WATCHLIST_ALERT_FOLDER', '/tmp/lpr_watchlist_alerts')
+# ตรวจว่าไฟล์ watchlist ถูกแก้โดย worker อื่นหรือไม่ ไม่บ่อยกว่านี้ (วินาที)
+WATCHLIST_RELOAD_INTERVAL = 2.0
+
+# ตัวอักษรที่ OCR มักอ่านสลับกัน แต่ละกลุ่มถูกแทนด้วยตัวแรกของกลุ่ม
+OCR_CONFUSIONS = [
+    'ขชซ', 'คดตฅ', 'บปษ', 'ผฝ', 'พฟ', 'ถภ', 'ฎฏ', 'ฆม', 'ฑฒ',
+    '0OQD', '1IL', '2Z', '5S', '8B'
+]
+_CONFUSION_MAP = str.maketrans({ch: group[0] for group in OCR_CONFUSIONS for ch in group[1:]})
+
+# Match kinds
+MATCH_EXACT = 'exact'
+MATCH_FUZZY = 'fuzzy'
+MATCH_PATTERN = 'pattern'
+
+
+def canonical_plate(license_plate):
+    """Normalized plate with OCR-confusable characters folded together"""
+    return normalize_plate(license_plate).translate(_CONFUSION_MAP)
+
+
+def levenshtein(a, b, limit=None):
+    """
+    Edit distance between two strings
+
+    Args:
+        limit: Stop early and return limit + 1 once the distance exceeds it
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _deletions(word, max_distance):
+    """All strings reachable from word by deleting up to max_distance characters"""
+    variants = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        variants |= frontier
+    return variants
+
+
+class DeletionIndex:
+    """
+    Symmetric-delete index for edit-distance lookups
+
+    Every word is stored under all its deletion variants. Two words within
+    edit distance k share at least one variant, so a lookup only generates
+    the query's variants (about len(query) for k = 1), collects candidates
+    from the dict and verifies them; the cost does not grow with the number
+    of entries.
+    """
+
+    def __init__(self, words=(), max_distance=1):
+        self.max_distance = max_distance
+        self.index = {}  # deletion variant -> set of words
+        for word in words:
+            for variant in _deletions(word, max_distance):
+                self.index.setdefault(variant, set()).add(word)
+
+    def search(self, word):
+        """
+        Returns:
+            list: [(distance, word), ...] within max_distance
+        """
+        candidates = set()
+        for variant in _deletions(word, self.max_distance):
+            candidates |= self.index.get(variant, set())
+        found = []
+        for candidate in candidates:
+            distance = levenshtein(word, candidate, self.max_distance)
+            if distance <= self.max_distance:
+                found.append((distance, candidate))
+        return found
+
+
+class WatchlistMatcher:
+    def __init__(self, entries, max_distance=WATCHLIST_MAX_DISTANCE):
+        """
+        Compile watchlist entries (immutable after construction)
+
+        Args:
+            entries: [{'id', 'plate' or 'pattern', 'label', ...}, ...]
+            max_distance: Edit distance tolerated for fuzzy matches
+        """
+        self.max_distance = max_distance
+        self.by_canonical = {}  # canonical plate -> [entry, ...]
+        patterns = []
+        self.pattern_entries = {}
+        for entry in entries:
+            if entry.get('plate'):
+                self.by_canonical.setdefault(canonical_plate(entry['plate']), []).append(entry)
+            elif entry.get('pattern'):
+                group = f"p{len(patterns)}"
+                regex = fnmatch.translate(canonical_plate(entry['pattern']))
+                patterns.append(f"(?P<{group}>{regex})")
+                self.pattern_entries[group] = entry
+        self.fuzzy = DeletionIndex(self.by_canonical, max_distance) if max_distance > 0 else None
+        self.patterns = re.compile('|'.join(patterns)) if patterns else None
+
+    def __len__(self):
+        return sum(len(v) for v in self.by_canonical.values()) + len(self.pattern_entries)
+
+    def match(self, license_plate):
+        """
+        Check a detected plate against the watchlist
+
+        Returns:
+            list: [{'entry': entry, 'kind': exact|fuzzy|pattern, 'distance': int}, ...]
+        """
+        canonical = canonical_plate(license_plate)
+        if not canonical:
+            return []
+        matches = []
+
+        exact = self.by_canonical.get(canonical)
+        if exact:
+            matches.extend({'entry': e, 'kind': MATCH_EXACT, 'distance': 0} for e in exact)
+        elif self.fuzzy is not None:
+            for distance, word in sorted(self.fuzzy.search(canonical)):
+                matches.extend({'entry': e, 'kind': MATCH_FUZZY, 'distance': distance}
+                               for e in self.by_canonical[word])
+
+        if self.patterns is not None:
+            found = self.patterns.match(canonical)
+            if found:
+                matches.append({'entry': self.pattern_entries[found.lastgroup],
+                                'kind': MATCH_PATTERN, 'distance': 0})
+        return matches
+
+
+class Watchlist:
+    def __init__(self, path=WATCHLIST_PATH, max_distance=WATCHLIST_MAX_DISTANCE,
+                 alert_cooldown=WATCHLIST_ALERT_COOLDOWN, alert_folder=WATCHLIST_ALERT_FOLDER):
+        """
+        Watchlist stored in a JSON file with a compiled matcher
+
+        Args:
+            path: JSON file holding the entries
+            max_distance: Edit distance tolerated for fuzzy matches
+            alert_cooldown: Seconds before the same entry alerts again for a source
+            alert_folder: Directory for the shared alert cooldown files
+        """
+        self.path = path
+        self.max_distance = max_distance
+        self.alert_cooldown = alert_cooldown
+        self.alert_folder = alert_folder
+        self.entries = []
+        self.matcher = WatchlistMatcher([], max_distance)
+        self._version = None
+        self._checked_at = 0.0
+        self._last_purge = time.time()
+        self._lock = threading.Lock()
+        os.makedirs(alert_folder, exist_ok=True)
+        self.load()
+
+    def _file_version(self):
+        """(inode, mtime, size) ของไฟล์: os.replace เปลี่ยน inode เสมอ แม้ mtime จะเท่าเดิม"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read_entries(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load(self):
+        """Load entries from the JSON file (if present) and compile"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            version = self._file_version()
+            entries = self._read_entries()
+            self._compile(entries)
+            self._version = version
+            logger.info(f"🚨 Watchlist loaded: {len(entries)} entries")
+        except Exception as e:
+            logger.error(f"❌ Failed to load watchlist: {e}")
+
+    def _compile(self, entries):
+        matcher = WatchlistMatcher(entries, self.max_distance)
+        # สลับ reference ทีเดียว lookup ที่กำลังทำงานอยู่ใช้ matcher เดิมต่อได้
+        self.entries, self.matcher = entries, matcher
+
+    @contextmanager
+    def _file_lock(self):
+        """flock ข้าม worker ระหว่างอ่าน-แก้-เขียนไฟล์ watchlist"""
+        with open(f"{self.path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _modify(self, change):
+        """
+        Apply change(entries) -> entries to the latest list on disk
+
+        Re-reads the file under flock so an edit made by another worker is
+        not overwritten, then writes atomically and recompiles.
+        """
+        with self._lock, self._file_lock():
+            entries = self._read_entries()
+            updated = change(entries)
+            if updated is None:
+                # ไม่มีอะไรเปลี่ยน แต่ใช้รายการล่าสุดจากไฟล์
+                self._compile(entries)
+                self._version = self._file_version()
+                return False
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(updated, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+            self._compile(updated)
+            self._version = self._file_version()
+            return True
+
+    def refresh(self, force=False):
+        """Reload when another worker changed the file (checked at most every WATCHLIST_RELOAD_INTERVAL)"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < WATCHLIST_RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+        version = self._file_version()
+        if version is not None and version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self.load()
+
+    def add(self, plate=None, pattern=None, label=None):
+        """
+        Add a plate or glob pattern
+
+        Returns:
+            dict: The new entry
+        """
+        entry = {'id': uuid.uuid4().hex[:8], 'label': label or '', 'created_at': time.time()}
+        if plate:
+            entry['plate'] = plate
+        else:
+            entry['pattern'] = pattern
+        self._modify(lambda entries: entries + [entry])
+        return entry
+
+    def remove(self, entry_id):
+        """
+        Remove an entry
+
+        Returns:
+            True if removed, False if not found
+        """
+        def change(entries):
+            kept = [e for e in entries if e.get('id') != entry_id]
+            return kept if len(kept) != len(entries) else None
+
+        return self._modify(change)
+
+    def _claim_alert(self, entry_id, source, now):
+        """
+        Record an alert for (entry, source) unless one was raised within the cooldown
+
+        The last alert time is kept in a shared file under flock, so only
+        one worker alerts for the same sighting.
+        """
+        digest = hashlib.sha256(f"{entry_id}\x00{source}".encode('utf-8')).hexdigest()[:32]
+        with open(os.path.join(self.alert_folder, f"{digest}.json"), 'a+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    last_alert = json.loads(f.read() or '{}').get('last_alert', 0.0)
+                except ValueError:
+                    last_alert = 0.0
+                if now - last_alert < self.alert_cooldown:
+                    return False
+                f.seek(0)
+                f.truncate()
+                json.dump({'last_alert': now}, f)
+                f.flush()
+                return True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _purge_alerts(self, now):
+        """ลบไฟล์ cooldown ที่หมดอายุแล้ว (เป็นระยะ ไม่ต้องมี background thread)"""
+        self._last_purge = now
+        for name in os.listdir(self.alert_folder):
+            path = os.path.join(self.alert_folder, name)
+            try:
+                if now - os.path.getmtime(path) > self.alert_cooldown:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def check(self, license_plate, source=None):
+        """
+        Match a detection and decide which matches should alert
+
+        Returns:
+            tuple: (matches, alerts) where alerts are the matches not
+                   already alerted for this source within the cooldown
+        """
+        self.refresh()
+        matches = self.matcher.match(license_plate)
+        if not matches:
+            return [], []
+
+        # เวลาจริง (ไม่ใช่ monotonic) เพราะเทียบกันข้าม process
+        now = time.time()
+        if now - self._last_purge > max(self.alert_cooldown, 60) * 10:
+            self._purge_alerts(now)
+        alerts = [match for match in matches if self._claim_alert(match['entry'].get('id'), source, now)]
+        return matches, alerts
+
+
+# Global watchlist instance
+watchlist = Watchlist()